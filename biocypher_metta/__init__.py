@@ -1,25 +1,174 @@
 from biocypher import BioCypher
 from collections import Counter, defaultdict
 from abc import ABC, abstractmethod
+from functools import lru_cache
+import copy
+import hashlib
 import pathlib
 import os
+import re
+import shutil
+
+from biocypher_metta.compression import Compression
+from biocypher_metta.schema_cache import load_schema
+
+# In interned provenance mode every dataset is written once as a node of label DATASET_LABEL under
+# PROVENANCE_DIR, and the records reference it by its id in their source property
+DATASET_LABEL = "dataset"
+DATASET_PROPERTIES = ("name", "version", "url", "imported_on")
+PROVENANCE_DIR = "provenance"
+
+
+@lru_cache(maxsize=None)
+def dataset_id(name, url=None):
+    """
+    Id of the node of a dataset: its name reduced to lowercase word characters, which every writer
+    writes unchanged both as a node id and as a property value, followed by a hash of its url.
+    Adapters sharing a name (e.g. GTEx) with different urls are different datasets.
+    """
+    id = re.sub(r"\W+", "_", name).strip("_").lower()
+    if url is None:
+        return id
+    return f"{id}_{hashlib.sha1(str(url).encode('utf-8')).hexdigest()[:8]}"
+
+
+def interned_properties(properties):
+    """
+    The properties of a record with its source replaced by the id of its dataset and without its
+    source_url, which the dataset node holds.
+    """
+    if "source" not in properties and "source_url" not in properties:
+        return properties
+    # a new dict, adapters may share the properties dict between records
+    source_url = properties.get("source_url")
+    properties = {k: v for k, v in properties.items() if k != "source_url"}
+    source = properties.get("source")
+    if isinstance(source, str):
+        properties["source"] = dataset_id(source, source_url)
+    return properties
+
+
+def _interned_node_formatter(formatter):
+    def format_node(id, properties):
+        return formatter(id, interned_properties(properties))
+    return format_node
+
+
+def _interned_edge_formatter(formatter):
+    def format_edge(source_id, target_id, properties):
+        return formatter(source_id, target_id, interned_properties(properties))
+    return format_edge
 
 
 class BaseWriter(ABC):
-    def __init__(self, schema_config, biocypher_config, output_dir):
+    def __init__(self, schema_config, biocypher_config, output_dir, compression=None, intern_provenance=False):
+        """
+        :param compression: Compression of the output files, uncompressed if None
+        :param intern_provenance: reference the dataset of every record by id instead of repeating its
+            source and source_url, see write_datasets
+        """
         self.schema_config = schema_config
         self.biocypher_config = biocypher_config
         self.output_path = pathlib.Path(output_dir)
-        self.bcy = BioCypher(schema_config_path=schema_config,
-                             biocypher_config_path=biocypher_config)
+        self.schema = load_schema(schema_config, biocypher_config)
         if not os.path.exists(output_dir):
             self.output_path.mkdir(parents=True)
-        self.ontology = self.bcy._get_ontology()
+        self._bcy = None
+        self.compression = compression or Compression()
+        self.intern_provenance = intern_provenance
 
         self.node_freq = Counter()
         self.node_props = defaultdict(set)
         self.edge_freq = Counter()
 
+        # label -> formatter of the records with that label, see node_formatter and edge_formatter
+        self.node_formatters = {}
+        self.edge_formatters = {}
+
+    @property
+    def bcy(self):
+        """
+        BioCypher instance of the writer, only created when it is used since loading the
+        ontology is slow. The writers get the schema from the compiled schema instead.
+        """
+        if self._bcy is None:
+            self._bcy = BioCypher(schema_config_path=self.schema_config,
+                                  biocypher_config_path=self.biocypher_config)
+        return self._bcy
+
+    @property
+    def ontology(self):
+        return self.bcy._get_ontology()
+
+    def output_file(self, path):
+        """
+        Path of an output file, with the extension of the compression codec.
+        """
+        return f"{path}{self.compression.suffix}"
+
+    def open_output(self, path, mode="a", newline=None):
+        """
+        Open the output file for path, see output_file, for writing text through the compression codec.
+        """
+        return self.compression.open(self.output_file(path), mode, newline=newline)
+
+    def normalize_id(self, id):
+        """
+        The id of a node as the writer outputs it, records with the same label and normalized id are
+        the same node of the output.
+        """
+        return id
+
+    @abstractmethod
+    def compile_node_formatter(self, label):
+        """
+        :return: a function of the id and properties of a node with the given label formatting it
+        """
+        pass
+
+    @abstractmethod
+    def compile_edge_formatter(self, label):
+        """
+        :return: a function of the source id, target id and properties of an edge with the given
+            label formatting it
+        """
+        pass
+
+    def node_formatter(self, label):
+        """
+        The formatter of the nodes with the given label, with everything that only depends on the
+        label resolved once. Compiled by compile_node_formatter on the first use of the label.
+        """
+        formatter = self.node_formatters.get(label)
+        if formatter is None:
+            formatter = self.compile_node_formatter(label)
+            if self.intern_provenance:
+                formatter = _interned_node_formatter(formatter)
+            self.node_formatters[label] = formatter
+        return formatter
+
+    def edge_formatter(self, label):
+        """
+        The formatter of the edges with the given label, see node_formatter.
+        """
+        formatter = self.edge_formatters.get(label)
+        if formatter is None:
+            formatter = self.compile_edge_formatter(label)
+            if self.intern_provenance:
+                formatter = _interned_edge_formatter(formatter)
+            self.edge_formatters[label] = formatter
+        return formatter
+
+    def compile_formatters(self):
+        """
+        Compile the formatters of the node and edge labels of the schema, the formatters of other
+        labels (e.g. prefixed node labels) are compiled when they are first used.
+        """
+        for label in self.schema["node_labels"]:
+            self.node_formatter(label)
+        for label in self.edge_node_types:
+            self.edge_formatter(label)
+
     @abstractmethod
     def write_nodes(self, nodes, path_prefix=None, create_dir=True):
         pass
@@ -28,6 +177,25 @@ class BaseWriter(ABC):
     def write_edges(self, edges, path_prefix=None, create_dir=True):
         pass
 
+    def write_datasets(self, datasets):
+        """
+        Write every dataset of the build as a node of label DATASET_LABEL in PROVENANCE_DIR, which the
+        records reference in interned provenance mode. Replaces the datasets of a previous build.
+        :param datasets: dict of dataset id -> dataset entry of the build, with its name, version, url
+            and import date
+        """
+        shutil.rmtree(self.output_path / PROVENANCE_DIR, ignore_errors=True)
+        nodes = [(dataset_id(dataset["name"], dataset.get("url")), DATASET_LABEL,
+                  {k: dataset.get(k) for k in DATASET_PROPERTIES})
+                 for _, dataset in sorted(datasets.items())]
+        self.write_nodes(nodes, path_prefix=PROVENANCE_DIR)
+
+    def finalize(self):
+        """
+        Called once by the build script after the output of every adapter was written and merged.
+        """
+        pass
+
     def extract_node_info(self, node):
         id, label, properties = node
         self.node_freq[label] += 1
@@ -40,4 +208,39 @@ class BaseWriter(ABC):
     def clear_counts(self):
         self.node_freq.clear()
         self.node_props.clear()
-        self.edge_freq.clear()
\ No newline at end of file
+        self.edge_freq.clear()
+
+    def clone(self, output_dir):
+        """
+        Return a copy of this writer that writes under output_dir and keeps its own counters.
+        The schema and ontology objects are shared with this writer.
+        """
+        writer = copy.copy(self)
+        writer.output_path = pathlib.Path(output_dir)
+        writer.output_path.mkdir(parents=True, exist_ok=True)
+        writer.node_freq = Counter()
+        writer.node_props = defaultdict(set)
+        writer.edge_freq = Counter()
+        return writer
+
+    def merge_shard(self, shard_dir, move=False):
+        """
+        Append every file a clone of this writer produced under shard_dir to the file with the
+        same relative path in this writer's output directory.
+        :param move: move the shard files that have no counterpart in the output yet instead of
+            copying them, leaving the shard incomplete
+        """
+        shard_dir = pathlib.Path(shard_dir)
+        if not shard_dir.exists():
+            return
+        for src in sorted(p for p in shard_dir.rglob("*") if p.is_file()):
+            dest = self.output_path / src.relative_to(shard_dir)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            self.merge_file(src, dest, move)
+
+    def merge_file(self, src, dest, move=False):
+        if move and not dest.exists():
+            os.replace(src, dest)
+            return
+        with open(src, "rb") as fin, open(dest, "ab") as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
\ No newline at end of file
@@ -0,0 +1,488 @@
+"""
+Helpers for running the adapter entries of an adapters config, either one after
+another in the current process or in a pool of worker processes. Entries that read
+the same input file are run together over a single scan of the file.
+"""
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import importlib
+import os
+import pathlib
+import shutil
+import threading
+import time
+
+from biocypher._logger import logger
+from biocypher_metta import dataset_id
+from biocypher_metta.aux_maps import load_aux_map, plan_releases, release_finished
+from biocypher_metta.build_metrics import PhaseMetrics, input_size, log_progress, merge_metrics
+from biocypher_metta.dbsnp_store import load_rsid_map, load_pos_map
+from biocypher_metta.dedupe import DEDUPE_SPOOL_DIR, spool_nodes
+from biocypher_metta.integrity import NodeFilters, spool_edges, spooled_edge_counts
+from biocypher_metta.prefetch import Prefetcher
+from biocypher_metta.regions import region_args, region_scope, set_active_regions
+from biocypher_metta.shared_scan import SharedScan
+
+SHARDS_DIR = ".shards"
+
+# Build-wide settings of the runner, set by the build script and copied to the worker processes
+#   log_every: log the progress of an adapter phase every N records, 0 to disable
+#   regions: RegionSet of a region-scoped build, None to build everything
+#   prefetch_batch_size: records per batch handed from an adapter's producer thread to the writer, 0 to
+#       run the adapter and the writer on the same thread
+#   prefetch_queue_depth: number of batches the producer can get ahead of the writer
+#   dedupe_partitions: number of partitions the nodes are spooled to for deduplication instead of being
+#       written, 0 to write them directly, see biocypher_metta.dedupe
+#   integrity: settings of the referential integrity check, None to disable, see biocypher_metta.integrity
+#       capacity: expected number of nodes of the labels without an expected count
+#       expected: dict of node label -> expected number of nodes
+#       fp_rate: false positive rate of the node filters
+#       drop: spool the edges and write the ones that are not dangling after the check
+run_options = {
+    "log_every": 0,
+    "regions": None,
+    "prefetch_batch_size": 0,
+    "prefetch_queue_depth": 4,
+    "dedupe_partitions": 0,
+    "integrity": None,
+}
+
+
+def new_totals():
+    return {
+        "nodes_count": Counter(),
+        "nodes_props": defaultdict(set),
+        "edges_count": Counter(),
+        "datasets": {},
+        "metrics": {},
+    }
+
+
+def create_adapter(config, dbsnp_rsids, dbsnp_pos, write_properties, add_provenance):
+    """
+    Create the adapter of an entry. The dbSNP maps are only loaded if the adapter takes them.
+    :param dbsnp_rsids: path of the dbsnp rsid map
+    :param dbsnp_pos: path of the dbsnp position map
+    """
+    adapter_config = config["adapter"]
+    adapter_module = importlib.import_module(adapter_config["module"])
+    adapter_cls = getattr(adapter_module, adapter_config["cls"])
+    ctr_args = dict(adapter_config["args"])
+
+    if "dbsnp_rsid_map" in ctr_args: #this for dbs that use grch37 assembly and to map grch37 to grch38
+        ctr_args["dbsnp_rsid_map"] = load_aux_map(dbsnp_rsids, load_rsid_map)
+    if "dbsnp_pos_map" in ctr_args:
+        ctr_args["dbsnp_pos_map"] = load_aux_map(dbsnp_pos, load_pos_map)
+    ctr_args.update(region_args(adapter_cls, run_options["regions"], adapter_config["args"]))
+    ctr_args["write_properties"] = write_properties
+    ctr_args["add_provenance"] = add_provenance
+
+    return adapter_cls(**ctr_args)
+
+
+def run_adapter(name, config, writer, dbsnp_rsids, dbsnp_pos,
+                write_properties, add_provenance, schema_dict, adapter=None, phases=("nodes", "edges")):
+    """
+    Run a single adapter entry and write its nodes and edges with the given writer.
+    :param adapter: an already created adapter for the entry, created from the config if None
+    :param phases: which of the "nodes" and "edges" phases enabled in the config to run
+    :return: a dict with the node/edge counters, node properties and the dataset entry of the adapter
+    """
+    writer.clear_counts() # Reset counter for this adapter
+    metrics = {"outdir": config["outdir"], "input_bytes": input_size(config)}
+    if adapter is None:
+        logger.info(f"Running adapter: {name}")
+        start = time.perf_counter()
+        adapter = create_adapter(config, dbsnp_rsids, dbsnp_pos, write_properties, add_provenance)
+        metrics["setup_wall_s"] = round(time.perf_counter() - start, 3)
+    write_nodes = config["nodes"] and "nodes" in phases
+    write_edges = config["edges"] and "edges" in phases
+    outdir = config["outdir"]
+    output_dir = writer.output_path / outdir
+    log_every = run_options["log_every"]
+    integrity = run_options["integrity"]
+
+    dataset_name = getattr(adapter, 'source', None)
+    version = getattr(adapter, 'version', None)
+    source_url = getattr(adapter, 'source_url', None)
+
+    result = new_totals()
+    dataset = None
+    if dataset_name is None:
+        logger.warning(f"Dataset name is None for adapter: {name}. Ensure 'source' is defined in the adapter constructor.")
+    else:
+        dataset = {
+            "name": dataset_name,
+            "version": version,
+            "url": source_url,
+            "nodes": set(),
+            "edges": set(),
+            "imported_on": str(date.today())
+        }
+        # keyed by id, the entries sharing a name and url are the same dataset
+        result["datasets"][dataset_id(dataset_name, source_url)] = dataset
+    result["metrics"][name] = metrics
+
+    # check_genomic_location only applies the active regions to the records of region-aware
+    # adapters, the prefetchers run the adapter generators in a copy of this context
+    with region_scope(type(adapter)):
+        if write_nodes:
+            with PhaseMetrics(output_dir, "nodes") as phase:
+                nodes = adapter.get_nodes()
+                prefetch = _prefetch(nodes, f"{name}:nodes")
+                nodes = prefetch or nodes
+                if log_every:
+                    nodes = log_progress(nodes, name, "nodes", log_every)
+                node_filters = NodeFilters(integrity, writer.normalize_id) if integrity else None
+                if node_filters is not None:
+                    nodes = node_filters.watch(nodes)
+                try:
+                    if run_options["dedupe_partitions"]:
+                        freq, props = spool_nodes(nodes, writer.output_path / DEDUPE_SPOOL_DIR,
+                                                  run_options["dedupe_partitions"], outdir, writer.normalize_id)
+                    else:
+                        freq, props = writer.write_nodes(nodes, path_prefix=outdir)
+                finally:
+                    if prefetch is not None:
+                        prefetch.close()
+                        phase.extra_cpu = prefetch.cpu_time
+                if node_filters is not None:
+                    node_filters.save(writer.output_path)
+                phase.records = sum(freq.values())
+            metrics["nodes"] = phase.metrics
+            for node_label in freq:
+                result["nodes_count"][node_label] += freq[node_label]
+                if dataset is not None:
+                    dataset['nodes'].add(node_label)
+            for node_label in props:
+                result["nodes_props"][node_label] = result["nodes_props"][node_label].union(props[node_label])
+
+        if write_edges:
+            with PhaseMetrics(output_dir, "edges") as phase:
+                edges = adapter.get_edges()
+                prefetch = _prefetch(edges, f"{name}:edges")
+                edges = prefetch or edges
+                if log_every:
+                    edges = log_progress(edges, name, "edges", log_every)
+                try:
+                    if integrity and integrity["drop"]:
+                        # written by check_edges once the nodes of every adapter are known
+                        freq = spooled_edge_counts(edges, writer.output_path, outdir)
+                    elif integrity:
+                        freq = writer.write_edges(spool_edges(edges, writer.output_path, outdir, keep=False),
+                                                  path_prefix=outdir)
+                    else:
+                        freq = writer.write_edges(edges, path_prefix=outdir)
+                finally:
+                    if prefetch is not None:
+                        prefetch.close()
+                        phase.extra_cpu = prefetch.cpu_time
+                phase.records = sum(freq.values())
+            metrics["edges"] = phase.metrics
+            for edge_label in freq:
+                result["edges_count"][edge_label] += freq[edge_label]
+                label = schema_dict[edge_label]['output_label'] or edge_label
+                if dataset is not None:
+                    dataset['edges'].add(label)
+
+    return result
+
+
+def _prefetch(records, name):
+    """
+    :return: a Prefetcher running the adapter generator on a producer thread ahead of the writer,
+        or None if prefetching is disabled in run_options
+    """
+    if not run_options["prefetch_batch_size"]:
+        return None
+    return Prefetcher(records, run_options["prefetch_batch_size"], run_options["prefetch_queue_depth"], name=name)
+
+
+def merge_result(totals, result):
+    """
+    Merge the counters and dataset entry returned by run_adapter into the running totals.
+    """
+    totals["nodes_count"].update(result["nodes_count"])
+    totals["edges_count"].update(result["edges_count"])
+    for node_label, props in result["nodes_props"].items():
+        totals["nodes_props"][node_label] = totals["nodes_props"][node_label].union(props)
+
+    for id, dataset in result["datasets"].items():
+        if id not in totals["datasets"]:
+            totals["datasets"][id] = dataset
+        else:
+            totals["datasets"][id]["nodes"].update(dataset["nodes"])
+            totals["datasets"][id]["edges"].update(dataset["edges"])
+    merge_metrics(totals["metrics"], result.get("metrics", {}))
+    return totals
+
+
+def reads_shared_scans(config):
+    """
+    Whether the adapter of an entry reads its `filepath` with open_input and can take part in a
+    shared scan, which adapters declare with a shared_scan class attribute.
+    """
+    adapter_config = config["adapter"]
+    try:
+        adapter_cls = getattr(importlib.import_module(adapter_config["module"]), adapter_config["cls"])
+    except (ImportError, AttributeError):
+        # reported when the entry is run on its own
+        return False
+    return getattr(adapter_cls, "shared_scan", False)
+
+
+def plan_units(adapters_dict, names):
+    """
+    Split the entries into units of work. Entries reading the same `filepath` with adapters that
+    take part in shared scans form one unit so the file is scanned once for all of them, every
+    other entry is a unit on its own. Units are ordered by the position of their first entry.
+    """
+    by_path = {}
+    units = []
+    for name in names:
+        path = adapters_dict[name]["adapter"]["args"].get("filepath")
+        if isinstance(path, str) and os.path.isfile(path) and reads_shared_scans(adapters_dict[name]):
+            path = os.path.realpath(path)
+            if path in by_path:
+                by_path[path].append(name)
+                continue
+            by_path[path] = [name]
+            units.append(by_path[path])
+        else:
+            units.append([name])
+    return [tuple(unit) for unit in units]
+
+
+def _run_consumer(scan, stream, name, config, writer, adapter, phase, args, results, errors):
+    try:
+        with scan.attach(stream):
+            results.append(run_adapter(name, config, writer, *args, adapter=adapter, phases=(phase,)))
+    except BaseException as e:
+        errors.append(e)
+
+
+def run_unit(unit, adapters_dict, writer, shards_root, dbsnp_rsids, dbsnp_pos,
+             write_properties, add_provenance, schema_dict):
+    """
+    Run the entries of a unit, each into its own shard directory under shards_root.
+    When several entries read the same file, every enabled phase of every entry runs on its
+    own thread, fed by a single SharedScan of the file.
+    :return: a dict of entry name -> result
+    """
+    args = (dbsnp_rsids, dbsnp_pos, write_properties, add_provenance, schema_dict)
+    if len(unit) == 1:
+        name = unit[0]
+        return {name: run_adapter(name, adapters_dict[name], writer.clone(shard_dir_for(shards_root, name)), *args)}
+
+    logger.info(f"Running adapters {', '.join(unit)} over a shared scan")
+    scan = SharedScan(adapters_dict[unit[0]]["adapter"]["args"]["filepath"])
+    threads = []
+    results = {name: [] for name in unit}
+    errors = []
+    setup_times = {}
+    for name in unit:
+        config = adapters_dict[name]
+        start = time.perf_counter()
+        adapter = create_adapter(config, dbsnp_rsids, dbsnp_pos, write_properties, add_provenance)
+        setup_times[name] = round(time.perf_counter() - start, 3)
+        for phase in ("nodes", "edges"):
+            if not config[phase]:
+                continue
+            # every phase gets its own writer so that counters are not shared between threads
+            phase_writer = writer.clone(shard_dir_for(shards_root, name))
+            threads.append(threading.Thread(
+                target=_run_consumer, name=f"{name}:{phase}",
+                args=(scan, scan.add_consumer(), name, config, phase_writer, adapter, phase, args,
+                      results[name], errors)))
+
+    scan.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scan.join()
+    if errors:
+        raise errors[0]
+
+    unit_results = {}
+    for name in unit:
+        unit_results[name] = new_totals()
+        for result in results[name]:
+            merge_result(unit_results[name], result)
+        unit_results[name]["metrics"].setdefault(name, {})["setup_wall_s"] = setup_times[name]
+    return unit_results
+
+
+# State of a worker process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(writer_factory, shards_root, dbsnp_rsids, dbsnp_pos,
+                 write_properties, add_provenance, schema_dict, last_use, options):
+    run_options.update(options)
+    set_active_regions(run_options["regions"])
+    _worker["writer"] = writer_factory(shards_root)
+    _worker["args"] = (shards_root, dbsnp_rsids, dbsnp_pos, write_properties, add_provenance, schema_dict)
+    _worker["last_use"] = last_use
+
+
+def _run_unit(index, unit, adapters_dict):
+    results = run_unit(unit, adapters_dict, _worker["writer"], *_worker["args"])
+    # the pool starts the units in order, so every unit up to this one has been started by some worker
+    release_finished(_worker["last_use"], index)
+    return results
+
+
+def shard_dir_for(shards_root, name):
+    return pathlib.Path(shards_root) / name
+
+
+def iter_sharded(adapters_dict, names, writer, writer_factory, workers, shards_root, dbsnp_rsids,
+                 dbsnp_pos, write_properties, add_provenance, schema_dict):
+    """
+    Run the given adapter entries, each into its own shard directory under shards_root, and yield
+    (name, result) pairs in the order of `names`.
+    With more than one worker the units of entries run in a process pool, otherwise in this process.
+    :param writer_factory: callable taking an output directory and returning a new writer,
+        used to create one writer per worker process
+    """
+    for name in names:
+        shard_dir = shard_dir_for(shards_root, name)
+        if shard_dir.exists():
+            shutil.rmtree(shard_dir)
+
+    units = plan_units(adapters_dict, names)
+    last_use = plan_releases(adapters_dict, units, {"dbsnp_rsid_map": dbsnp_rsids, "dbsnp_pos_map": dbsnp_pos})
+    if workers <= 1:
+        results = {}
+        for index, unit in enumerate(units):
+            results.update(run_unit(unit, adapters_dict, writer, shards_root, dbsnp_rsids, dbsnp_pos,
+                                    write_properties, add_provenance, schema_dict))
+            release_finished(last_use, index)
+            # yield the entries in config order as soon as all the entries before them are done
+            while names and names[0] in results:
+                yield names[0], results.pop(names[0])
+                names = names[1:]
+        return
+
+    init_args = (writer_factory, shards_root, dbsnp_rsids, dbsnp_pos,
+                 write_properties, add_provenance, schema_dict, last_use, dict(run_options))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+        futures = {}
+        for index, unit in enumerate(units):
+            future = pool.submit(_run_unit, index, unit, {name: adapters_dict[name] for name in unit})
+            for name in unit:
+                futures[name] = future
+        for name in names:
+            yield name, futures[name].result()[name]
+
+
+def run_sequential(adapters_dict, writer, dbsnp_rsids, dbsnp_pos,
+                   write_properties, add_provenance, schema_dict):
+    """
+    Run the adapter entries one after another in this process. Entries that share their input
+    file run together over a single scan of the file into shards, which are moved into the
+    output at the position of each entry in the config.
+    """
+    totals = new_totals()
+    shards_root = writer.output_path / SHARDS_DIR
+    units = plan_units(adapters_dict, list(adapters_dict))
+    last_use = plan_releases(adapters_dict, units, {"dbsnp_rsid_map": dbsnp_rsids, "dbsnp_pos_map": dbsnp_pos})
+    shared = {unit: None for unit in units if len(unit) > 1}
+    if shared and shards_root.exists():
+        shutil.rmtree(shards_root)
+
+    for name in adapters_dict:
+        unit = next(unit for unit in units if name in unit)
+        if unit not in shared:
+            result = run_adapter(name, adapters_dict[name], writer, dbsnp_rsids, dbsnp_pos,
+                                 write_properties, add_provenance, schema_dict)
+            release_finished(last_use, units.index(unit))
+        else:
+            if shared[unit] is None:
+                shared[unit] = run_unit(unit, adapters_dict, writer, shards_root, dbsnp_rsids,
+                                        dbsnp_pos, write_properties, add_provenance, schema_dict)
+                release_finished(last_use, units.index(unit))
+            result = shared[unit].pop(name)
+            writer.merge_shard(shard_dir_for(shards_root, name), move=True)
+        merge_result(totals, result)
+
+    if shared:
+        shutil.rmtree(shards_root, ignore_errors=True)
+    return totals
+
+
+def run_parallel(adapters_dict, writer, writer_factory, workers, dbsnp_rsids, dbsnp_pos,
+                 write_properties, add_provenance, schema_dict):
+    """
+    Run the adapter entries in a pool of `workers` processes. Every entry writes into its own
+    shard directory, which is appended to the output of `writer` in config order once the entry
+    finishes, so entries sharing an outdir end up in the same files as in a sequential run.
+    """
+    totals = new_totals()
+    shards_root = writer.output_path / SHARDS_DIR
+    if shards_root.exists():
+        shutil.rmtree(shards_root)
+    shards_root.mkdir(parents=True)
+
+    # merge in config order so that shared outdir files keep the order of a sequential run
+    for name, result in iter_sharded(adapters_dict, list(adapters_dict), writer, writer_factory, workers,
+                                     shards_root, dbsnp_rsids, dbsnp_pos, write_properties,
+                                     add_provenance, schema_dict):
+        shard_dir = shard_dir_for(shards_root, name)
+        writer.merge_shard(shard_dir, move=True)
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        merge_result(totals, result)
+        logger.info(f"Merged output of adapter: {name}")
+
+    shutil.rmtree(shards_root, ignore_errors=True)
+    return totals
+
+
+def run_incremental(adapters_dict, writer, writer_factory, workers, manifest, dbsnp_rsids, dbsnp_pos,
+                    write_properties, add_provenance, schema_dict):
+    """
+    Re-run only the entries whose fingerprint in the build manifest changed. The shards of all
+    entries are kept under the output directory and the output files are rebuilt from them in
+    config order.
+    """
+    totals = new_totals()
+    shards_root = writer.output_path / SHARDS_DIR
+    if not manifest.path.exists() and any(p.is_dir() and p.name != SHARDS_DIR for p in writer.output_path.iterdir()):
+        logger.warning(f"{writer.output_path} already contains output that is not tracked by a build manifest, "
+                       f"it will be appended to. Use an empty output directory for the first incremental build.")
+    shards_root.mkdir(parents=True, exist_ok=True)
+
+    names = list(adapters_dict)
+    dirty = [name for name in names
+             if not manifest.is_clean(name, adapters_dict[name], shard_dir_for(shards_root, name))]
+    logger.info(f"{len(names) - len(dirty)} adapters are up to date, running {len(dirty)} adapters")
+
+    # Remove the output files built from the previous shards, including shards of entries
+    # that were removed from the config, the output is rebuilt from the shards below
+    for shard_dir in shards_root.iterdir():
+        if not shard_dir.is_dir():
+            continue
+        for src in shard_dir.rglob("*"):
+            dest = writer.output_path / src.relative_to(shard_dir)
+            if src.is_file() and dest.exists():
+                dest.unlink()
+        if shard_dir.name not in adapters_dict:
+            shutil.rmtree(shard_dir)
+
+    for name, result in iter_sharded(adapters_dict, dirty, writer, writer_factory, workers, shards_root,
+                                     dbsnp_rsids, dbsnp_pos, write_properties, add_provenance,
+                                     schema_dict):
+        manifest.record(name, result)
+        manifest.save()
+        # only the entries run by this build have metrics, the manifest does not keep them
+        merge_metrics(totals["metrics"], result["metrics"])
+
+    for name in names:
+        writer.merge_shard(shard_dir_for(shards_root, name))
+        merge_result(totals, manifest.result(name))
+
+    manifest.retain(names)
+    manifest.save()
+    return totals
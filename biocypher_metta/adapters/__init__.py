@@ -1,6 +1,10 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
 
 class Adapter:
+    # set by the adapters that read their filepath with shared_scan.open_input, whose entries
+    # reading the same file are run over a single scan of it
+    shared_scan = False
+
     def __init__(self, write_properties, add_provenance):
         self.write_properties = write_properties
         self.add_provenance = add_provenance
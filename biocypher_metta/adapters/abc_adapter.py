@@ -1,6 +1,6 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
 from biocypher_metta.adapters import Adapter
-import pickle
+from biocypher_metta.aux_maps import load_aux_map
 import csv
 import gzip
 from biocypher_metta.adapters.helpers import check_genomic_location, to_float
@@ -22,8 +22,8 @@ class ABCAdapter(Adapter):
                  dbsnp_rsid_map, write_properties, add_provenance,
                  chr=None, start=None, end=None):
         self.file_path = filepath
-        self.hgnc_to_ensembl_map = pickle.load(open(hgnc_to_ensembl_map, 'rb'))
-        self.tissue_to_ontology_id_map = pickle.load(open(tissue_to_ontology_id_map, 'rb'))
+        self.hgnc_to_ensembl_map = load_aux_map(hgnc_to_ensembl_map)
+        self.tissue_to_ontology_id_map = load_aux_map(tissue_to_ontology_id_map)
         self.dbsnp_rsid_map = dbsnp_rsid_map
         self.chr = chr
         self.start = start
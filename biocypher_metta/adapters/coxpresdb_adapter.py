@@ -1,6 +1,6 @@
 
 from biocypher_metta.adapters import Adapter
-import pickle
+from biocypher_metta.aux_maps import load_aux_map
 import os
 
 # https://coxpresdb.jp/download/Hsa-r.c6-0/coex/Hsa-r.v22-05.G16651-S235187.combat_pca.subagging.z.d.zip
@@ -33,8 +33,7 @@ class CoxpresdbAdapter(Adapter):
 
         gene_ids = [f for f in os.listdir(self.file_path) if os.path.isfile(os.path.join(self.file_path, f))]
 
-        with open(self.ensemble_to_entrez_path, 'rb') as f:
-            entrez_ensembl_dict = pickle.load(f)
+        entrez_ensembl_dict = load_aux_map(self.ensemble_to_entrez_path)
         for gene_id in gene_ids:
             gene_file_path = os.path.join(self.file_path, gene_id)
             entrez_id = gene_id
@@ -1,8 +1,8 @@
 from collections import defaultdict
 import csv
 import gzip
-import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 
 from biocypher_metta.adapters.helpers import build_regulatory_region_id, check_genomic_location, convert_genome_reference
 # Example dbSuper tsv input files:
@@ -20,8 +20,8 @@ class DBSuperAdapter(Adapter):
                  type='super enhancer', label='super_enhancer', delimiter='\t',
                  chr=None, start=None, end=None):
         self.filePath = filepath
-        self.hgnc_to_ensembl_map = pickle.load(open(hgnc_to_ensembl_map, 'rb'))
-        self.dbsuper_tissues_map = pickle.load(open(dbsuper_tissues_map, 'rb'))
+        self.hgnc_to_ensembl_map = load_aux_map(hgnc_to_ensembl_map)
+        self.dbsuper_tissues_map = load_aux_map(dbsuper_tissues_map)
         self.type = type
         self.label = label
         self.delimiter = delimiter
@@ -1,7 +1,7 @@
 import gzip
 import os
-import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 from biocypher_metta.adapters.helpers import build_regulatory_region_id, check_genomic_location, to_float
 
 # Example enhancer atlas input file:
@@ -80,8 +80,7 @@ class EnhancerAtlasAdapter(Adapter):
 
     def get_edges(self):
         tissues = [f for f in os.listdir(self.enhancer_gene_filepath) if os.path.isfile(os.path.join(self.enhancer_gene_filepath, f))]
-        with open(self.tissue_to_ontology_filepath, 'rb') as f:
-            tissues_ontology_map = pickle.load(f)
+        tissues_ontology_map = load_aux_map(self.tissue_to_ontology_filepath)
         
         for tissue in tissues:
             tissue_file_path = os.path.join(self.enhancer_gene_filepath, tissue)
@@ -1,7 +1,7 @@
 import csv
 import gzip
-import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 from biocypher_metta.adapters.helpers import build_regulatory_region_id, check_genomic_location
 # Example EPD bed input file:
 ##CHRM Start  End   Id  Score Strand -  -
@@ -17,7 +17,7 @@ class EPDAdapter(Adapter):
                  type='promoter', label='promoter', delimiter=' ',
                  chr=None, start=None, end=None):
         self.filepath = filepath
-        self.hgnc_to_ensembl_map = pickle.load(open(hgnc_to_ensembl_map, 'rb'))
+        self.hgnc_to_ensembl_map = load_aux_map(hgnc_to_ensembl_map)
         self.type = type
         self.label = label
         self.delimiter = delimiter
@@ -1,5 +1,5 @@
-import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 from biocypher._logger import logger
 from biocypher_metta.adapters.helpers import to_float
 # Example fabian variant tsv input file:
@@ -16,7 +16,7 @@ class FabianAdapter(Adapter):
     INDEX = {'variant': 0, 'tf': 1, 'prediction': 12, 'score': 13}
     def __init__(self, filepath, hgnc_to_ensembl, dbsnp_pos_map, label, write_properties, add_provenance):
         self.filepath = filepath
-        self.hgnc_to_ensembl_map = pickle.load(open(hgnc_to_ensembl, 'rb'))
+        self.hgnc_to_ensembl_map = load_aux_map(hgnc_to_ensembl)
         self.dbsnp_pos_map = dbsnp_pos_map
         self.label = label
 
@@ -1,5 +1,5 @@
 from biocypher_metta.adapters import Adapter
-import gzip
+from biocypher_metta.shared_scan import open_input
 from biocypher_metta.adapters.helpers import check_genomic_location
 from biocypher_metta.adapters.hgnc_processor import HGNCSymbolProcessor  
 
@@ -15,6 +15,8 @@ from biocypher_metta.adapters.hgnc_processor import HGNCSymbolProcessor
 # chr1    HAVANA  exon    12613   12721   .       +       .       gene_id "ENSG00000290825.1"; transcript_id "ENST00000456328.2"; gene_type "lncRNA"; gene_name "DDX11L2"; transcript_type "lncRNA"; transcript_name "DDX11L2-202"; exon_number 2; exon_id "ENSE00003582793.1"; level 2; transcript_support_level "1"; tag "basic"; tag "Ensembl_canonical"; havana_transcript "OTTHUMT00000362751.1";
 
 class GencodeAdapter(Adapter):
+    shared_scan = True
+
     ALLOWED_TYPES = ['transcript', 'transcribed to', 'transcribed from']
     ALLOWED_LABELS = ['transcript', 'transcribed_to', 'transcribed_from']
     ALLOWED_KEYS = ['gene_id', 'gene_type', 'gene_name',
@@ -55,7 +57,7 @@ class GencodeAdapter(Adapter):
         return parsed_info
 
     def get_nodes(self):
-        with gzip.open(self.filepath, 'rt') as input:
+        with open_input(self.filepath) as input:
             for line in input:
                 if line.startswith('#'):
                     continue
@@ -116,7 +118,7 @@ class GencodeAdapter(Adapter):
                     print(f'Error: {str(e)}')
 
     def get_edges(self):
-        with gzip.open(self.filepath, 'rt') as input:
+        with open_input(self.filepath) as input:
             for line in input:
                 if line.startswith('#'):
                     continue
@@ -1,5 +1,5 @@
-import gzip
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.shared_scan import open_input
 from biocypher_metta.adapters.helpers import check_genomic_location
 
 # Example genocde vcf input file:
@@ -15,6 +15,8 @@ from biocypher_metta.adapters.helpers import check_genomic_location
 
 
 class GencodeExonAdapter(Adapter):
+    shared_scan = True
+
     ALLOWED_KEYS = ['gene_id', 'transcript_id', 'transcript_type', 'transcript_name', 'exon_number', 'exon_id']
     INDEX = {'chr': 0, 'type': 2, 'coord_start': 3, 'coord_end': 4, 'info': 8}
 
@@ -40,7 +42,7 @@ class GencodeExonAdapter(Adapter):
         return parsed_info
 
     def get_nodes(self):
-        with gzip.open(self.filepath, 'rt') as input:
+        with open_input(self.filepath) as input:
             for line in input:
                 if line.startswith('#'):
                     continue
@@ -83,7 +85,7 @@ class GencodeExonAdapter(Adapter):
                             f'fail to process for label to load: {self.label}, type to load: {self.type}, data: {line}')
 
     def get_edges(self):
-        with gzip.open(self.filepath, 'rt') as input:
+        with open_input(self.filepath) as input:
             for line in input:
                 if line.startswith('#'):
                     continue
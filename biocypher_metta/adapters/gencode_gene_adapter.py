@@ -1,5 +1,6 @@
 import gzip
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.shared_scan import open_input
 from biocypher_metta.adapters.helpers import check_genomic_location
 from biocypher_metta.adapters.hgnc_processor import HGNCSymbolProcessor  
 # Example genocde vcf input file:
@@ -15,6 +16,8 @@ from biocypher_metta.adapters.hgnc_processor import HGNCSymbolProcessor
 
 
 class GencodeGeneAdapter(Adapter):
+    shared_scan = True
+
     ALLOWED_KEYS = ['gene_id', 'gene_type', 'gene_name',
                     'transcript_id', 'transcript_type', 'transcript_name', 'hgnc_id']
     INDEX = {'chr': 0, 'type': 2, 'coord_start': 3, 'coord_end': 4, 'info': 8}
@@ -87,7 +90,7 @@ class GencodeGeneAdapter(Adapter):
 
     def get_nodes(self):
         alias_dict = self.get_gene_alias()
-        with gzip.open(self.filepath, 'rt') as input:
+        with open_input(self.filepath) as input:
             for line in input:
                 if line.startswith('#'):
                     continue
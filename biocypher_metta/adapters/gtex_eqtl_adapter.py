@@ -1,7 +1,7 @@
 import csv
 import os
-import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 from biocypher_metta.adapters.helpers import to_float, check_genomic_location
 from biocypher._logger import logger
 import gzip
@@ -36,7 +36,7 @@ class GTExEQTLAdapter(Adapter):
         :param end: end position
         """
         self.filepath = filepath
-        self.gtex_tissue_ontology_map = pickle.load(open(gtex_tissue_ontology_map, 'rb'))
+        self.gtex_tissue_ontology_map = load_aux_map(gtex_tissue_ontology_map)
         self.tissue_names = tissue_names
         self.chr = chr
         self.start = start
@@ -2,9 +2,9 @@ import csv
 import os
 import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.shared_scan import open_input
 from biocypher_metta.adapters.helpers import to_float, check_genomic_location
 from biocypher._logger import logger
-import gzip
 
 # DATE ADDED TO CATALOG	PUBMEDID	FIRST AUTHOR	DATE	JOURNAL	LINK	STUDY	DISEASE/TRAIT	INITIAL SAMPLE SIZE	REPLICATION SAMPLE SIZE	REGION	CHR_ID	CHR_POS	REPORTED GENE(S)	MAPPED_GENE	UPSTREAM_GENE_ID	DOWNSTREAM_GENE_ID	SNP_GENE_IDS	UPSTREAM_GENE_DISTANCE	DOWNSTREAM_GENE_DISTANCE	STRONGEST SNP-RISK ALLELE	SNPS	MERGED	SNP_ID_CURRENT	CONTEXT	INTERGENIC	RISK ALLELE FREQUENCY	P-VALUE	PVALUE_MLOG	P-VALUE (TEXT)	OR or BETA	95% CI (TEXT)	PLATFORM [SNPS PASSING QC]	CNV	MAPPED_TRAIT	MAPPED_TRAIT_URI	STUDY ACCESSION	GENOTYPING TECHNOLOGY
 # 8/20/2020	32372009	de Las Fuentes L	5/5/2020	Mol Psychiatry	www.ncbi.nlm.nih.gov/pubmed/32372009	Gene-educational attainment interactions in a multi-ancestry genome-wide meta-analysis identify novel blood pressure loci.	Systolic blood pressure x educational attainment (some college) interaction (2df)	27,617 European ancestry individuals with some college education, 20,253 European ancestry individuals without college education, 8,128 African ancestry individuals with some college education, 8,537 African ancestry individuals without college education, 1,138 Asian ancestry individuals with some college education, 10,214 Asian ancestry individuals without college education, 1,869 Hispanic/Latin American individuals with some college education, 3,276 Hispanic/Latin American individuals without college education	131,584 European ancestry individuals with some college education, 110,940 European ancestry individuals without college education, 1,494 African ancestry individuals with some college education, 5,704 African ancestry individuals without college education, 2,339 Asian ancestry individuals with some college education, 8,567 Asian ancestry individuals without college education, 4,133 Hispanic individuals with some college education, 7,498 Hispanic individuals without college education	1p21.2	1	100364129	CDC14A	CDC14A			ENSG00000079335			rs114558965-A	rs114558965	0	114558965	intron_variant	0	0.97	1.00E-09	9	(African)	4.123	[1.46-6.78] unit increase	Affymetrix, Illumina [~ 18800000] (imputed)	N	systolic blood pressure, self reported educational attainment	http://www.ebi.ac.uk/efo/EFO_0006335, http://www.ebi.ac.uk/efo/EFO_0004784	GCST010426	Genome-wide genotyping array
@@ -15,6 +15,7 @@ import gzip
 
 
 class GWASAdapter(Adapter):
+    shared_scan = True
 
     index = {
         "rsid": 21,
@@ -49,7 +50,7 @@ class GWASAdapter(Adapter):
         super(GWASAdapter, self).__init__(write_properties, add_provenance)
 
     def get_edges(self):
-        with open(self.filepath, "rt") as gwas:
+        with open_input(self.filepath) as gwas:
             next(gwas)  # skip header
             gwas_row = csv.reader(gwas, delimiter='\t')
             for row in gwas_row:
@@ -7,6 +7,8 @@ import hgvs.dataproviders.uta
 from hgvs.easy import parser
 from hgvs.extras.babelfish import Babelfish
 
+from biocypher_metta.regions import active_regions
+
 ALLOWED_ASSEMBLIES = ['GRCh38']
 _lifters = {}
 
@@ -121,7 +123,11 @@ def check_genomic_location(chr, start, end,
     Checks if the curr locations are within the specified locations (chr, start, end)
     If no chr is specified, then it returns True b/c that means we want to import all chromosomes
     Used when we want to filter the data imported from a file by location
+    The curr locations must also lie within the regions of a region-scoped build, if any
     """
+    regions = active_regions()
+    if regions is not None and not regions.contains(curr_chr, curr_start, curr_end):
+        return False
     if chr is None:  # import the data on all chromosomes
         return True
     else:  # filter by chromosome and (if specified) by location
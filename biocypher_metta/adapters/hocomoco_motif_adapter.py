@@ -1,7 +1,7 @@
 import os
-import pickle
 import csv
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 
 # Example TF motif file from HOCOMOCO (e.g. ATF1_HUMAN.H11MO.0.B.pwm), which adastra used.
 # Each pwm (position weight matrix) is a N x 4 matrix, where N is the length of the TF motif.
@@ -25,7 +25,7 @@ class HoCoMoCoMotifAdapter(Adapter):
 
         self.filepath = filepath
         assert os.path.isdir(self.filepath), f"{self.filepath} is not a directory"
-        self.hgnc_to_ensembl_map = pickle.load(open(hgnc_to_ensembl_map, 'rb'))
+        self.hgnc_to_ensembl_map = load_aux_map(hgnc_to_ensembl_map)
         self.model_tf_path = annotation_file
 
         self.label = 'motif'
@@ -1,8 +1,8 @@
 import csv
 import gzip
-import pickle
 
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 from biocypher_metta.adapters.helpers import build_regulatory_region_id, check_genomic_location, to_float
 # Example PEREGRINE input files:
 
@@ -41,8 +41,8 @@ class PEREGRINEAdapter(Adapter):
         self.enhancers_file = enhancers_file
         self.enhancer_gene_link = enhancer_gene_link
         self.source_file = source_file
-        self.hgnc_ensembl_map = pickle.load(open(hgnc_ensembl_map, 'rb'))
-        self.tissue_ontology_map = pickle.load(open(tissue_ontology_map, 'rb'))
+        self.hgnc_ensembl_map = load_aux_map(hgnc_ensembl_map)
+        self.tissue_ontology_map = load_aux_map(tissue_ontology_map)
         self.type = type
         self.label = label
         self.delimiter = delimiter
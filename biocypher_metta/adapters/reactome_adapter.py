@@ -1,6 +1,6 @@
-import gzip
 from Bio import SeqIO
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.shared_scan import open_input
 
 # Data file for genes_pathways: https://reactome.org/download/current/Ensembl2Reactome_All_Levels.txt
 # data format:
@@ -28,6 +28,7 @@ from biocypher_metta.adapters import Adapter
 
 
 class ReactomeAdapter(Adapter):
+    shared_scan = True
 
     ALLOWED_LABELS = ['genes_pathways',
                       'parent_pathway_of', 'child_pathway_of']
@@ -45,7 +46,7 @@ class ReactomeAdapter(Adapter):
         super(ReactomeAdapter, self).__init__(write_properties, add_provenance)
 
     def get_edges(self):
-        with open(self.filepath) as input:
+        with open_input(self.filepath) as input:
             _props = {}
             if self.write_properties and self.add_provenance:
                 _props['source'] = self.source
@@ -1,6 +1,6 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
 from biocypher_metta.adapters import Adapter
-import pickle
+from biocypher_metta.aux_maps import load_aux_map
 import csv
 import gzip
 from biocypher_metta.adapters.helpers import check_genomic_location, build_regulatory_region_id
@@ -25,7 +25,7 @@ class RefSeqClosestGeneAdapter(Adapter):
         self.chr = chr
         self.start = start
         self.end = end
-        self.hgnc_to_ensembl_map = pickle.load(open(hgnc_to_ensembl_map, 'rb'))
+        self.hgnc_to_ensembl_map = load_aux_map(hgnc_to_ensembl_map)
 
         self.label = "closest_gene"
         self.source = "RefSeq Closest Gene"
@@ -2,8 +2,8 @@
 import csv
 import gzip
 import os.path
-import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 from biocypher_metta.adapters.helpers import check_genomic_location
 
 # Example roadmap csv input files
@@ -29,7 +29,7 @@ class RoadMapH3MarkAdapter(Adapter):
         """
         self.filepath = filepath
         assert os.path.isdir(self.filepath), "The path to the directory containing epigenomic data is not directory"
-        self.cell_to_ontology_id_map = pickle.load(open(cell_to_ontology_id_map, 'rb'))
+        self.cell_to_ontology_id_map = load_aux_map(cell_to_ontology_id_map)
         self.dbsnp_rsid_map = dbsnp_rsid_map
         self.chr = chr
         self.start = start
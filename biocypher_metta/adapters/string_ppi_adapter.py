@@ -1,6 +1,6 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
 from biocypher_metta.adapters import Adapter
-import pickle
+from biocypher_metta.aux_maps import load_aux_map
 import csv
 import gzip
 from biocypher_metta.adapters.helpers import to_float
@@ -26,8 +26,7 @@ class StringPPIAdapter(Adapter):
         """
         self.filepath = filepath
 
-        with open(ensembl_to_uniprot_map, "rb") as f:
-            self.ensembl2uniprot = pickle.load(f)
+        self.ensembl2uniprot = load_aux_map(ensembl_to_uniprot_map)
 
         self.label = "interacts_with"
         self.source = "STRING"
@@ -1,6 +1,6 @@
 import gzip
-import pickle
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map
 from biocypher_metta.adapters.helpers import build_regulatory_region_id, check_genomic_location, to_float
 
 # Example data
@@ -16,7 +16,7 @@ class TfbsAdapter(Adapter):
     def __init__(self, write_properties, add_provenance, filepath,
                  hgnc_to_ensembl, label, chr=None, start=None, end=None):
         self.filepath = filepath
-        self.hgnc_to_ensembl_map = pickle.load(open(hgnc_to_ensembl, 'rb'))
+        self.hgnc_to_ensembl_map = load_aux_map(hgnc_to_ensembl)
         self.chr = chr
         self.start = start
         self.end = end
@@ -1,6 +1,6 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
 from biocypher_metta.adapters import Adapter
-import pickle
+from biocypher_metta.aux_maps import load_aux_map
 import csv
 import gzip
 
@@ -24,8 +24,7 @@ class TFLinkAdapter(Adapter):
         """
         self.filepath = filepath
 
-        with open(entrez_to_ensemble_map, "rb") as f:
-            self.entrez2ensemble = pickle.load(f)
+        self.entrez2ensemble = load_aux_map(entrez_to_ensemble_map)
 
         self.label = "tf_gene"
         self.source = "TFLink"
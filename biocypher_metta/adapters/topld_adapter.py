@@ -4,6 +4,7 @@ import json
 import os
 from biocypher_metta.adapters import Adapter
 from biocypher_metta.adapters.helpers import build_variant_id, to_float, check_genomic_location
+from biocypher_metta.dbsnp_store import lookup_rsids
 from biocypher._logger import logger
 
 
@@ -19,7 +20,7 @@ class TopLDAdapter(Adapter):
     INDEX = {'SNP1': 0, 'SNP2': 1, 'R2': 4, 'Dprime': 5, '+/-corr': 6}
     def __init__(self, filepath, dbsnp_pos_map, chr,
                  ancestry, write_properties, add_provenance,
-                 start=None, end=None, cutoff=0.5):
+                 start=None, end=None, cutoff=0.5, batch_size=10000):
         self.file_path = filepath
         self.dbsnp_pos_map = dbsnp_pos_map
         self.chr = chr
@@ -27,6 +28,7 @@ class TopLDAdapter(Adapter):
         self.start = start
         self.end = end
         self.cutoff = cutoff
+        self.batch_size = batch_size
         self.label = "in_ld_with"
         self.source = "TopLD"
         self.source_url = "http://topld.genetics.unc.edu/"
@@ -36,6 +38,7 @@ class TopLDAdapter(Adapter):
         with gzip.open(self.file_path, 'rt') as f:
             reader = csv.reader(f)
             next(reader)
+            batch = []
             for row in reader:
                 try:
                     var1_pos = int(row[TopLDAdapter.INDEX['SNP1']])
@@ -43,28 +46,41 @@ class TopLDAdapter(Adapter):
                     if not check_genomic_location(self.chr, self.start, self.end, self.chr, var1_pos, var1_pos) or \
                             not check_genomic_location(self.chr, self.start, self.end, self.chr, var2_pos, var2_pos):
                         continue
-                    rsid_1 = self.dbsnp_pos_map.get(f"{self.chr}_{var1_pos}", None)
-                    rsid_2 = self.dbsnp_pos_map.get(f"{self.chr}_{var2_pos}", None)
-                    if rsid_1 is None or rsid_2 is None:
-                        logger.warning(f"Couldn't find rsid for position {var1_pos} or {var2_pos}")
-                        continue
-
-                    r2_score = to_float(f"{row[TopLDAdapter.INDEX['+/-corr']]}{row[TopLDAdapter.INDEX['R2']]}")
-                    if abs(r2_score) < self.cutoff:
-                        continue
-                    props = {}
-                    if self.write_properties:
-                        props = {
-                            'r2': to_float(r2_score),
-                            'd_prime': to_float(row[TopLDAdapter.INDEX['Dprime']]),
-                            'ancestry': self.ancestry
-                        }
-                        if self.add_provenance:
-                            props['source'] = self.source
-                            props['source_url'] = self.source_url
-
-                    yield rsid_1, rsid_2, self.label, props
-
+                    batch.append((row, var1_pos, var2_pos))
                 except Exception as e:
                     logger.error(f"Error while processing line {row}, error: {e}, skipping...")
                     continue
+                if len(batch) == self.batch_size:
+                    yield from self.process_batch(batch)
+                    batch = []
+            yield from self.process_batch(batch)
+
+    def process_batch(self, batch):
+        # Look up the rsids of the whole batch at once, the position store does it in one vectorized search
+        rsids_1 = lookup_rsids(self.dbsnp_pos_map, self.chr, [var1_pos for _, var1_pos, _ in batch])
+        rsids_2 = lookup_rsids(self.dbsnp_pos_map, self.chr, [var2_pos for _, _, var2_pos in batch])
+        for (row, var1_pos, var2_pos), rsid_1, rsid_2 in zip(batch, rsids_1, rsids_2):
+            try:
+                if rsid_1 is None or rsid_2 is None:
+                    logger.warning(f"Couldn't find rsid for position {var1_pos} or {var2_pos}")
+                    continue
+
+                r2_score = to_float(f"{row[TopLDAdapter.INDEX['+/-corr']]}{row[TopLDAdapter.INDEX['R2']]}")
+                if abs(r2_score) < self.cutoff:
+                    continue
+                props = {}
+                if self.write_properties:
+                    props = {
+                        'r2': to_float(r2_score),
+                        'd_prime': to_float(row[TopLDAdapter.INDEX['Dprime']]),
+                        'ancestry': self.ancestry
+                    }
+                    if self.add_provenance:
+                        props['source'] = self.source
+                        props['source_url'] = self.source_url
+
+                yield rsid_1, rsid_2, self.label, props
+
+            except Exception as e:
+                logger.error(f"Error while processing line {row}, error: {e}, skipping...")
+                continue
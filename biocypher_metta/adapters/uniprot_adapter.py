@@ -1,6 +1,6 @@
-import gzip
 from Bio import SeqIO
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.shared_scan import open_input
 
 # Data file is uniprot_sprot_human.dat.gz and uniprot_trembl_human.dat.gz at https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/taxonomic_divisions/.
 # We can use SeqIO from Bio to read the file.
@@ -9,6 +9,7 @@ from biocypher_metta.adapters import Adapter
 
 
 class UniprotAdapter(Adapter):
+    shared_scan = True
 
     ALLOWED_TYPES = ['translates to', 'translation of']
     ALLOWED_LABELS = ['translates_to', 'translation_of']
@@ -31,7 +32,7 @@ class UniprotAdapter(Adapter):
         super(UniprotAdapter, self).__init__(write_properties, add_provenance)
 
     def get_edges(self):
-        with gzip.open(self.filepath, 'rt') as input_file:
+        with open_input(self.filepath) as input_file:
             records = SeqIO.parse(input_file, 'swiss')
             for record in records:
                 if self.type == 'translates to':
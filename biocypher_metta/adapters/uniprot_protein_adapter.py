@@ -1,7 +1,7 @@
-import gzip
 import json
 import os
 from biocypher_metta.adapters import Adapter
+from biocypher_metta.shared_scan import open_input
 from Bio import SwissProt
 
 
@@ -12,6 +12,8 @@ from Bio import SwissProt
 
 
 class UniprotProteinAdapter(Adapter):
+    shared_scan = True
+
    # ALLOWED_SOURCES = ['UniProtKB/Swiss-Prot', 'UniProtKB/TrEMBL']
 
     def __init__(self, filepath, write_properties, add_provenance):
@@ -44,7 +46,7 @@ class UniprotProteinAdapter(Adapter):
         return sorted(list(set(dbxrefs)), key=str.casefold)
 
     def get_nodes(self):
-        with gzip.open(self.filepath, 'rt') as input_file:
+        with open_input(self.filepath) as input_file:
             records = SwissProt.parse(input_file)
             for record in records:
                 dbxrefs = self.get_dbxrefs(record.cross_references)
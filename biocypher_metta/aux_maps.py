@@ -0,0 +1,102 @@
+"""
+Process-wide registry of the auxiliary maps read by the adapters (the pickled ID and tissue maps
+under aux_files and the dbSNP maps).
+
+A map is loaded the first time an adapter asks for it and memoized by its path and modification
+time, so adapter entries sharing a map in the same process load it once. The adapter runner plans
+which unit of entries uses each map last and releases the map once that unit has run.
+
+A map is shared by every adapter reading it, so dict maps are returned as read-only
+MappingProxyType views. The views are shallow: callers must not mutate the values they hold either.
+"""
+import os
+import pickle
+import threading
+from types import MappingProxyType
+
+from biocypher._logger import logger
+
+# realpath -> (mtime_ns, size, map)
+_maps = {}
+_lock = threading.Lock()
+
+# adapter args that are filled in with the dbSNP maps given to the build script
+DBSNP_ARGS = ("dbsnp_rsid_map", "dbsnp_pos_map")
+
+
+def _load_pickle(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def map_key(path):
+    return os.path.realpath(path)
+
+
+def load_aux_map(path, loader=None):
+    """
+    Return the auxiliary map stored at path, loading it if it is not loaded yet or changed on disk.
+    A dict map is returned as a read-only view, other maps (the dbSNP stores) as loaded.
+    :param loader: callable loading the map from path, unpickles the file by default
+    """
+    key = map_key(path)
+    stat = os.stat(path)
+    with _lock:
+        cached = _maps.get(key)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        logger.info(f"Loading auxiliary map {path}")
+        value = (loader or _load_pickle)(path)
+        if isinstance(value, dict):
+            value = MappingProxyType(value)
+        _maps[key] = (stat.st_mtime_ns, stat.st_size, value)
+        return value
+
+
+def release_aux_map(path):
+    with _lock:
+        if _maps.pop(map_key(path), None) is not None:
+            logger.info(f"Released auxiliary map {path}")
+
+
+def loaded_aux_maps():
+    return list(_maps)
+
+
+def needed_maps(config, dbsnp_paths):
+    """
+    The keys of the auxiliary maps an adapter entry reads: the pickle files in its args and the
+    dbSNP maps it is given.
+    :param dbsnp_paths: dict of dbsnp arg name -> path of the map passed in that arg
+    """
+    keys = set()
+    for arg, value in config["adapter"]["args"].items():
+        if arg in DBSNP_ARGS:
+            if dbsnp_paths.get(arg) is not None:
+                keys.add(map_key(dbsnp_paths[arg]))
+        elif isinstance(value, str) and value.endswith(".pkl") and os.path.isfile(value):
+            keys.add(map_key(value))
+    return keys
+
+
+def plan_releases(adapters_dict, units, dbsnp_paths):
+    """
+    :param units: the units of entries in the order they are started
+    :return: dict of map key -> index of the last unit that reads the map
+    """
+    last_use = {}
+    for i, unit in enumerate(units):
+        for name in unit:
+            for key in needed_maps(adapters_dict[name], dbsnp_paths):
+                last_use[key] = i
+    return last_use
+
+
+def release_finished(last_use, index):
+    """
+    Release the maps that no unit started after the unit at `index` reads.
+    Units must be started in order, so that every unit reading a map has started by then.
+    """
+    for key, last in last_use.items():
+        if last <= index and key in _maps:
+            release_aux_map(key)
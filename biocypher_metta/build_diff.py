@@ -0,0 +1,431 @@
+"""
+Delta between two builds of the knowledge graph, to update a loaded database with the changes of a
+new build instead of reloading it.
+
+The output files of the two builds are matched by their path relative to the build directory, so
+every label (Neo4j CSV) and every shard (MeTTa, Prolog) is compared on its own. The lines of a file
+are keyed by the entity they belong to (the node id or edge source id of a MeTTa atom or Prolog
+clause, the id or source, target and label of a CSV row), sorted on disk with an external sort and
+the two sorted streams merged, so memory stays bounded whatever the size of the builds. Entities
+only in the new build are added, only in the old build removed, and changed when their lines differ.
+
+The delta is written in the format of the writer under the delta directory, mirroring the layout
+of the builds:
+    MeTTa: <name>.added.metta holds the added atoms, <name>.removed.metta a remove-atom of every
+        removed atom, applied by scripts/metta_space_import.py --delta-dir after loading the old build
+    Prolog: <name>.added.pl holds the added clauses, <name>.removed.pl a retract of every removed
+        clause, apply_delta.pl consults the removals then the additions
+    Neo4j CSV: <name>.csv holds the rows of the added and changed entities with the load query of
+        the new build in <name>.cypher, changed to replace the properties of an entity with the ones
+        of its row (keeping the id of a node) so that the properties the new build dropped are
+        removed, <name>.delete.csv the rows of the removed entities with a query deleting them in
+        <name>.delete.cypher, loaded with scripts/neo4j_loader.py
+
+The other outputs (parquet, the batches of the cypher writer, the neo4j-admin import) are listed as
+unsupported in the report.
+"""
+from collections import defaultdict
+import csv
+import json
+import pathlib
+import re
+import tempfile
+
+from biocypher._logger import logger
+
+from biocypher_metta.compression import open_text, strip_suffix
+from biocypher_metta.external_sort import DEFAULT_RUN_LINES, external_sort
+from biocypher_metta.output_index import INDEX_SUFFIX, metta_key, prolog_key
+
+DELTA_REPORT = "delta_report.json"
+PROLOG_LOADER = "apply_delta.pl"
+
+# output files that are not records of the graph
+SKIPPED_FILES = {"load.pl", "shards.json"}
+
+# the key of an entity can't hold the separator of the sorted entries or characters sorting before it
+KEY_TABLE = {i: " " for i in range(0x20)}
+
+CSV_FILE = re.compile(r"^(nodes|edges)_.+\.csv$")
+FIELD_TERMINATOR = re.compile(r"FIELDTERMINATOR '(.)'")
+LOAD_PATH = re.compile(r"file:///[^']+")
+NODE_LABEL = re.compile(r"MERGE \(n:(\w+)")
+# the properties set by a load query, from the columns of the row that aren't the id of the entity
+SET_PROPERTIES = re.compile(r"SET (\w+) \+= (apoc\.map\.removeKeys\(row, \[[^\]]*\]\))")
+EDGE_LABEL = re.compile(r"\[r:(\w+)\]")
+
+
+def _open_delta(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+class LineDelta:
+    """
+    Delta of a MeTTa or Prolog file, the added and removed lines of every entity.
+    """
+    suffix = None
+
+    def __init__(self, old_path, new_path, out_dir, stem):
+        self.out_dir = out_dir
+        self.stem = stem
+        self.added_file = None
+        self.removed_file = None
+        self.files = []
+
+    def key(self, line):
+        raise NotImplementedError
+
+    def removal(self, line):
+        raise NotImplementedError
+
+    def header(self, path):
+        return None
+
+    def write_added(self, lines):
+        if self.added_file is None:
+            path = self.out_dir / f"{self.stem}.added{self.suffix}"
+            self.added_file = _open_delta(path)
+            self.files.append(path)
+        for line in lines:
+            self.added_file.write(line + "\n")
+
+    def write_removed(self, lines):
+        if self.removed_file is None:
+            path = self.out_dir / f"{self.stem}.removed{self.suffix}"
+            self.removed_file = _open_delta(path)
+            self.files.append(path)
+        for line in lines:
+            self.removed_file.write(self.removal(line) + "\n")
+
+    def added(self, key, lines):
+        self.write_added(lines)
+
+    def removed(self, key, lines):
+        self.write_removed(lines)
+
+    def changed(self, key, old_lines, new_lines):
+        old = set(old_lines)
+        new = set(new_lines)
+        self.write_removed(line for line in old_lines if line not in new)
+        self.write_added(line for line in new_lines if line not in old)
+
+    def close(self):
+        for f in (self.added_file, self.removed_file):
+            if f is not None:
+                f.close()
+        return self.files
+
+
+class MeTTaDelta(LineDelta):
+    suffix = ".metta"
+
+    def key(self, line):
+        return metta_key(line.encode("utf-8")) or ""
+
+    def removal(self, line):
+        return f"!(remove-atom &self {line})"
+
+
+class PrologDelta(LineDelta):
+    suffix = ".pl"
+
+    def key(self, line):
+        return prolog_key(line.encode("utf-8")) or ""
+
+    def removal(self, line):
+        return f":- retract({line[:-1] if line.endswith('.') else line})."
+
+
+class CSVDelta:
+    """
+    Delta of a Neo4j CSV file of a label, upserting the rows of the added and changed entities with
+    the load query of the new build, replacing their properties, and deleting the removed entities.
+    """
+    def __init__(self, old_path, new_path, out_dir, stem):
+        self.out_dir = out_dir
+        self.stem = stem
+        self.old_path = old_path
+        self.new_path = new_path
+        self.edges = stem.startswith("edges_")
+        self.old_query = self.query_of(old_path)
+        self.new_query = self.query_of(new_path)
+        query = self.new_query or self.old_query or ""
+        match = FIELD_TERMINATOR.search(query)
+        self.delimiter = match.group(1) if match is not None else "|"
+        self.headers = {}
+        self.upsert_file = None
+        self.delete_file = None
+        self.files = []
+
+    @staticmethod
+    def query_of(path):
+        """
+        The load query the writer wrote next to a csv file.
+        """
+        if path is None:
+            return None
+        query_path = pathlib.Path(strip_suffix(path)).with_suffix(".cypher")
+        return query_path.read_text() if query_path.exists() else None
+
+    @staticmethod
+    def supports(path):
+        return CSV_FILE.match(pathlib.Path(strip_suffix(path)).name) is not None and \
+            "LOAD CSV" in (CSVDelta.query_of(path) or "")
+
+    def header(self, path):
+        with open_text(path, newline="") as f:
+            header = f.readline().rstrip("\r\n")
+        self.headers[path] = header
+        return header
+
+    def key(self, line):
+        fields = next(csv.reader([line], delimiter=self.delimiter), [])
+        if self.edges:
+            # source_type, source_id, target_type, target_id, label: the load query merges the edges
+            # of a source, target and label into one relationship
+            return "\x1f".join(fields[i] for i in (1, 3, 4) if i < len(fields))
+        return fields[0] if fields else ""
+
+    def write_upsert(self, lines):
+        if self.upsert_file is None:
+            path = self.out_dir / f"{self.stem}.csv"
+            self.upsert_file = _open_delta(path)
+            self.upsert_file.write(self.headers[self.new_path] + "\n")
+            self.files.append(path)
+            query_path = self.out_dir / f"{self.stem}.cypher"
+            with open(query_path, "w") as f:
+                f.write(self.upsert_query(path))
+            self.files.append(query_path)
+        for line in lines:
+            self.upsert_file.write(line + "\n")
+
+    def write_delete(self, lines):
+        if self.delete_file is None:
+            path = self.out_dir / f"{self.stem}.delete.csv"
+            self.delete_file = _open_delta(path)
+            self.delete_file.write(self.headers[self.old_path] + "\n")
+            self.files.append(path)
+            query_path = self.out_dir / f"{self.stem}.delete.cypher"
+            with open(query_path, "w") as f:
+                f.write(self.delete_query(path))
+            self.files.append(query_path)
+        for line in lines:
+            self.delete_file.write(line + "\n")
+
+    def upsert_query(self, csv_path):
+        """
+        The load query of the new build for csv_path, setting the properties of an entity to the ones
+        of its row instead of adding them, which would keep the properties of the old build.
+        """
+        query = LOAD_PATH.sub(lambda _: f"file:///{csv_path.resolve().as_posix()}", self.new_query)
+        match = SET_PROPERTIES.search(query)
+        if match is None:
+            raise ValueError(f"Can't find the properties set by the load query of {self.new_path}")
+        name, properties = match.groups()
+        # the row of a node holds its id, which removeKeys drops from the properties
+        replace = f"SET {name} = {properties}" if self.edges else f"SET {name} = {properties}, {name}.id = row.id"
+        return query[:match.start()] + replace + query[match.end():]
+
+    def delete_query(self, csv_path):
+        label = (EDGE_LABEL if self.edges else NODE_LABEL).search(self.old_query or "")
+        if label is None:
+            raise ValueError(f"Can't find the label of {self.old_path} in its load query")
+        if self.edges:
+            statement = (f"MATCH (source {{id: row.source_id}})-[r:{label.group(1)}]->(target {{id: row.target_id}}) "
+                         f"DELETE r")
+        else:
+            statement = f"MATCH (n:{label.group(1)} {{id: row.id}}) DETACH DELETE n"
+        return f"""
+CALL apoc.periodic.iterate(
+    "LOAD CSV WITH HEADERS FROM 'file:///{csv_path.resolve().as_posix()}' AS row FIELDTERMINATOR '{self.delimiter}' RETURN row",
+    "{statement}",
+    {{batchSize:1000}}
+)
+YIELD batches, total
+RETURN batches, total;
+"""
+
+    def added(self, key, lines):
+        self.write_upsert(lines)
+
+    def removed(self, key, lines):
+        self.write_delete(lines)
+
+    def changed(self, key, old_lines, new_lines):
+        self.write_upsert(new_lines)
+
+    def close(self):
+        for f in (self.upsert_file, self.delete_file):
+            if f is not None:
+                f.close()
+        return self.files
+
+
+def delta_class(path):
+    """
+    :return: the delta class of an output file, None if the file is not supported
+    """
+    name = pathlib.Path(strip_suffix(path)).name
+    if name in SKIPPED_FILES:
+        return None
+    if name.endswith(".metta"):
+        return MeTTaDelta
+    if name.endswith(".pl"):
+        return PrologDelta
+    if name.endswith(".csv") and CSVDelta.supports(path):
+        return CSVDelta
+    return None
+
+
+def output_files(build_dir):
+    """
+    :return: dict of the path relative to build_dir, without the compression suffix, of every
+        output file of a build -> its path, the hidden directories excluded
+    """
+    files = {}
+    for path in sorted(build_dir.rglob("*")):
+        relative = path.relative_to(build_dir)
+        if not path.is_file() or any(part.startswith(".") for part in relative.parts[:-1]):
+            continue
+        if path.suffix in (".json", INDEX_SUFFIX, ".cypher"):
+            continue
+        files[pathlib.Path(strip_suffix(relative))] = path
+    return files
+
+
+def sorted_entries(path, delta, work_dir, run_lines):
+    """
+    Sort the lines of an output file on the key of their entity.
+    :return: the path of the sorted key<TAB>line file
+    """
+    fd, entries = tempfile.mkstemp(suffix=".entries", dir=work_dir)
+    with open(fd, "w", encoding="utf-8", newline="") as out:
+        if path is not None:
+            header = delta.header(path)
+            with open_text(path, newline="") as f:
+                if header is not None:
+                    next(f, None)
+                for line in f:
+                    line = line.rstrip("\r\n")
+                    if line:
+                        out.write(f"{delta.key(line).translate(KEY_TABLE)}\t{line}\n")
+    # duplicated lines are loaded once
+    external_sort(entries, entries, run_lines, unique=True)
+    return entries
+
+
+def grouped(entries):
+    """
+    Yield the key and lines of every entity of a sorted entries file.
+    """
+    with open(entries, encoding="utf-8", newline="") as f:
+        key = None
+        lines = []
+        for entry in f:
+            entry_key, line = entry.rstrip("\n").split("\t", 1)
+            if entry_key != key:
+                if lines:
+                    yield key, lines
+                key = entry_key
+                lines = []
+            lines.append(line)
+        if lines:
+            yield key, lines
+
+
+def diff_file(old_path, new_path, delta, work_dir, run_lines=DEFAULT_RUN_LINES):
+    """
+    Merge the sorted entities of the two versions of a file, writing their delta with delta.
+    :return: the counts of added, removed, changed and unchanged entities
+    """
+    counts = {"added": 0, "removed": 0, "changed": 0, "unchanged": 0}
+    old = grouped(sorted_entries(old_path, delta, work_dir, run_lines))
+    new = grouped(sorted_entries(new_path, delta, work_dir, run_lines))
+    old_entity = next(old, None)
+    new_entity = next(new, None)
+    while old_entity is not None or new_entity is not None:
+        if new_entity is None or (old_entity is not None and old_entity[0] < new_entity[0]):
+            delta.removed(*old_entity)
+            counts["removed"] += 1
+            old_entity = next(old, None)
+        elif old_entity is None or new_entity[0] < old_entity[0]:
+            delta.added(*new_entity)
+            counts["added"] += 1
+            new_entity = next(new, None)
+        else:
+            if old_entity[1] != new_entity[1]:
+                delta.changed(old_entity[0], old_entity[1], new_entity[1])
+                counts["changed"] += 1
+            else:
+                counts["unchanged"] += 1
+            old_entity = next(old, None)
+            new_entity = next(new, None)
+    return counts
+
+
+def diff_builds(old_dir, new_dir, delta_dir, run_lines=DEFAULT_RUN_LINES):
+    """
+    Write the delta from the build in old_dir to the build in new_dir to delta_dir, with a report
+    of the entities added, removed and changed in every file.
+    :return: the report
+    """
+    old_dir, new_dir, delta_dir = pathlib.Path(old_dir), pathlib.Path(new_dir), pathlib.Path(delta_dir)
+    delta_dir.mkdir(parents=True, exist_ok=True)
+    old_files = output_files(old_dir)
+    new_files = output_files(new_dir)
+
+    files = {}
+    unsupported = []
+    prolog_files = defaultdict(list)
+    with tempfile.TemporaryDirectory(prefix=".diff-", dir=delta_dir) as work_dir:
+        for relative in sorted(set(old_files) | set(new_files)):
+            old_path = old_files.get(relative)
+            new_path = new_files.get(relative)
+            cls = delta_class(new_path if new_path is not None else old_path)
+            if cls is None:
+                unsupported.append(relative.as_posix())
+                continue
+            stem = relative.name[:-len(relative.suffix)]
+            delta = cls(old_path, new_path, delta_dir / relative.parent, stem)
+            try:
+                counts = diff_file(old_path, new_path, delta, work_dir, run_lines)
+            finally:
+                written = delta.close()
+            status = "added" if old_path is None else "removed" if new_path is None else "compared"
+            files[relative.as_posix()] = dict(counts, file=status,
+                                              delta=[p.relative_to(delta_dir).as_posix() for p in written])
+            if cls is PrologDelta:
+                prolog_files[relative.as_posix()] = written
+            changes = counts["added"] + counts["removed"] + counts["changed"]
+            if changes:
+                logger.info(f"{relative}: {counts['added']} added, {counts['removed']} removed, "
+                            f"{counts['changed']} changed")
+
+    if prolog_files:
+        write_prolog_loader(delta_dir, [p for written in prolog_files.values() for p in written])
+
+    report = {
+        "old_build": str(old_dir),
+        "new_build": str(new_dir),
+        **{kind: sum(counts[kind] for counts in files.values()) for kind in ("added", "removed", "changed")},
+        "files": files,
+        "unsupported": unsupported,
+    }
+    with open(delta_dir / DELTA_REPORT, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def write_prolog_loader(delta_dir, written):
+    """
+    Write apply_delta.pl, which retracts the removed clauses of every file and then consults the
+    added ones. Retracting needs the predicates to be dynamic in the loaded database.
+    """
+    removals = sorted(p for p in written if p.name.endswith(".removed.pl"))
+    additions = sorted(p for p in written if p.name.endswith(".added.pl"))
+    lines = ["% Generated by biocypher_metta.build_diff, consult this file to apply the delta."]
+    for path in removals + additions:
+        lines.append(f":- consult('{path.relative_to(delta_dir).as_posix()}').")
+    with open(delta_dir / PROLOG_LOADER, "w") as f:
+        f.write("\n".join(lines) + "\n")
@@ -0,0 +1,237 @@
+"""
+Build manifest used for incremental rebuilds. For every adapter entry it records a
+fingerprint of the entry's input files, its args block, the source of the adapter module,
+the writer settings and the source of the writer module, together with the counters the
+entry produced, so unchanged entries can reuse their previous output shard. The sources of
+the adapter and writer modules include the biocypher_metta modules they import, directly or
+not, such as the helpers of the adapters package.
+"""
+import ast
+from collections import Counter, defaultdict
+import hashlib
+import importlib.util
+import json
+import os
+import pathlib
+
+from biocypher._logger import logger
+
+MANIFEST_VERSION = 1
+
+# the modules whose imports are followed when hashing the source of a module
+PACKAGE = "biocypher_metta"
+PACKAGE_DIR = pathlib.Path(__file__).resolve().parent
+
+
+def module_file(module):
+    """
+    The source file of a module, None if it is not found. The biocypher_metta modules are found
+    without importing them or their packages, some adapters connect to services on import.
+    """
+    if module == PACKAGE or module.startswith(PACKAGE + "."):
+        path = PACKAGE_DIR.joinpath(*module.split(".")[1:])
+        for candidate in (path.with_suffix(".py"), path / "__init__.py"):
+            if candidate.is_file():
+                return candidate
+        return None
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    return spec.origin if spec is not None and spec.origin and os.path.isfile(spec.origin) else None
+
+
+def imported_modules(path):
+    """
+    The biocypher_metta modules imported by the source file of a module.
+    """
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), filename=str(path))
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.append(node.module)
+            # the names of "from package import name" may be submodules
+            modules.extend(f"{node.module}.{alias.name}" for alias in node.names)
+    return [module for module in modules if module == PACKAGE or module.startswith(PACKAGE + ".")]
+
+
+def _serialize_result(result):
+    return {
+        "nodes_count": dict(result["nodes_count"]),
+        "nodes_props": {label: sorted(props) for label, props in result["nodes_props"].items()},
+        "edges_count": dict(result["edges_count"]),
+        "datasets": {name: {**dataset, "nodes": sorted(dataset["nodes"]), "edges": sorted(dataset["edges"])}
+                     for name, dataset in result["datasets"].items()},
+    }
+
+
+def _deserialize_result(data):
+    return {
+        "nodes_count": Counter(data["nodes_count"]),
+        "nodes_props": defaultdict(set, {label: set(props) for label, props in data["nodes_props"].items()}),
+        "edges_count": Counter(data["edges_count"]),
+        "datasets": {name: {**dataset, "nodes": set(dataset["nodes"]), "edges": set(dataset["edges"])}
+                     for name, dataset in data["datasets"].items()},
+    }
+
+
+class BuildManifest:
+    FILE_NAME = "build_manifest.json"
+
+    def __init__(self, output_dir, writer_type, write_properties, add_provenance, shared_inputs=None,
+                 regions=None, compression=None, shards=None, clustered=None,
+                 intern_provenance=None, dedupe=None, integrity=None, writer_class=None):
+        """
+        :param output_dir: output directory of the build, where the manifest is stored
+        :param shared_inputs: inputs passed to the adapters by the build script rather than the config,
+            as a dict of arg name -> file path (e.g. the dbsnp maps)
+        :param regions: the [chr, start, end] regions of a region-scoped build
+        :param compression: settings of the compression of the output files
+        :param shards: number of shard files per output directory of the MeTTa writer
+        :param clustered: whether the Prolog writer writes the clustered layout
+        :param intern_provenance: whether the records reference their dataset instead of holding its source
+        :param dedupe: number of partitions the nodes are spooled to for deduplication
+        :param integrity: mode of the referential integrity check, report or drop
+        :param writer_class: class of the writer, whose module source is part of the fingerprints
+        """
+        self.path = pathlib.Path(output_dir) / BuildManifest.FILE_NAME
+        self.settings = {
+            "writer_type": writer_type,
+            "write_properties": write_properties,
+            "add_provenance": add_provenance,
+            "regions": regions,
+            "compression": compression,
+            "shards": shards,
+            "clustered": clustered,
+            "intern_provenance": intern_provenance,
+            "dedupe": dedupe,
+            "integrity": integrity,
+            "writer_class": f"{writer_class.__module__}.{writer_class.__qualname__}" if writer_class else None,
+        }
+        self.writer_module = writer_class.__module__ if writer_class else None
+        self.shared_inputs = shared_inputs or {}
+        self._module_sources = {}
+        self.entries = {}
+        self.file_hashes = {}
+        self._fingerprints = {}
+
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    self.entries = data.get("entries", {})
+                    self.file_hashes = data.get("file_hashes", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable build manifest {self.path}: {e}")
+
+    def hash_file(self, path):
+        """
+        sha256 of a file's content. The hash of the previous build is reused when the size
+        and modification time of the file did not change.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.file_hashes.get(path)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        self.file_hashes[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha.hexdigest()}
+        return sha.hexdigest()
+
+    def hash_input(self, path):
+        if os.path.isdir(path):
+            sha = hashlib.sha256()
+            for file in sorted(p for p in pathlib.Path(path).rglob("*") if p.is_file()):
+                sha.update(f"{file.relative_to(path)}:{self.hash_file(file)}\n".encode())
+            return sha.hexdigest()
+        return self.hash_file(path)
+
+    def input_paths(self, value):
+        """
+        Values of an args block that point to existing files or directories.
+        """
+        if isinstance(value, dict):
+            for v in value.values():
+                yield from self.input_paths(v)
+        elif isinstance(value, list):
+            for v in value:
+                yield from self.input_paths(v)
+        elif isinstance(value, str) and os.path.exists(value):
+            yield value
+
+    def module_source(self, module):
+        """
+        Hash of the source of a module and of the biocypher_metta modules it imports, directly or not.
+        :return: dict of module name -> sha256 of its source file, empty if the module is not found
+        """
+        if module in self._module_sources:
+            return self._module_sources[module]
+        sources = {}
+        pending = [module]
+        while pending:
+            name = pending.pop()
+            if name in sources:
+                continue
+            path = module_file(name)
+            if path is None:
+                continue
+            sources[name] = self.hash_file(path)
+            pending.extend(imported_modules(path))
+        self._module_sources[module] = dict(sorted(sources.items()))
+        return self._module_sources[module]
+
+    def fingerprint(self, name, config):
+        args = config["adapter"]["args"]
+        inputs = {path: self.hash_input(path) for path in self.input_paths(args)}
+        for arg, path in self.shared_inputs.items():
+            if arg in args and path is not None:
+                inputs[arg] = self.hash_input(path)
+
+        key = {
+            "adapter": {"module": config["adapter"]["module"], "cls": config["adapter"]["cls"], "args": args},
+            "module_source": self.module_source(config["adapter"]["module"]),
+            "writer_source": self.module_source(self.writer_module) if self.writer_module else None,
+            "inputs": inputs,
+            "outdir": config["outdir"],
+            "nodes": config["nodes"],
+            "edges": config["edges"],
+            **self.settings,
+        }
+        fingerprint = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+        self._fingerprints[name] = fingerprint
+        return fingerprint
+
+    def is_clean(self, name, config, shard_dir):
+        """
+        True if the entry's fingerprint matches the previous build and its shard is still on disk.
+        """
+        fingerprint = self.fingerprint(name, config)
+        entry = self.entries.get(name)
+        return entry is not None and entry["fingerprint"] == fingerprint and pathlib.Path(shard_dir).exists()
+
+    def result(self, name):
+        return _deserialize_result(self.entries[name]["result"])
+
+    def record(self, name, result):
+        self.entries[name] = {"fingerprint": self._fingerprints[name], "result": _serialize_result(result)}
+
+    def retain(self, names):
+        """
+        Forget the entries that are no longer part of the adapters config.
+        """
+        self.entries = {name: entry for name, entry in self.entries.items() if name in names}
+
+    def save(self):
+        data = {"version": MANIFEST_VERSION, "entries": self.entries, "file_hashes": self.file_hashes}
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,151 @@
+"""
+Per-adapter performance metrics of a build, written to build_metrics.json next to graph_info.json.
+
+For every adapter entry the node and edge phases are timed separately (wall and CPU time of the
+thread running the phase), together with the number of records, the bytes the writer added to
+the output files of the phase, the growth of the peak RSS of the process and the input bytes the
+adapter read through biocypher_metta.shared_scan.open_input, before and after decompression. The
+input bytes are None for the adapters opening their input otherwise, whose reads are not measured.
+
+The output files of a phase are the files of the output directory starting with its name and the
+files named after neither phase (the predicate files of the clustered Prolog layout), which are
+counted for both phases when the phases of an entry run at the same time over a shared scan.
+"""
+import json
+import os
+import pathlib
+import resource
+import time
+
+from biocypher._logger import logger
+from biocypher_metta.shared_scan import track_input_reads
+
+METRICS_FILE = "build_metrics.json"
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+PHASES = ("nodes", "edges")
+
+
+def _output_sizes(output_dir, phase):
+    """
+    Size of every output file of a phase in output_dir: the files of the phase (nodes* or edges*)
+    and the files named after neither phase, e.g. the predicate files of the clustered Prolog
+    layout, hidden files excluded.
+    """
+    output_dir = pathlib.Path(output_dir)
+    if not output_dir.is_dir():
+        return {}
+    others = tuple(p for p in PHASES if p != phase)
+    return {f: f.stat().st_size for f in output_dir.rglob("*")
+            if f.is_file() and not f.name.startswith(".") and not f.name.startswith(others)}
+
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(f.stat().st_size for f in pathlib.Path(path).rglob("*") if f.is_file())
+
+
+def input_size(config):
+    """
+    On-disk size of the input files and directories in the args of an adapter entry,
+    the pickled auxiliary maps excluded.
+    """
+    size = 0
+    for value in config["adapter"]["args"].values():
+        if isinstance(value, str) and not value.endswith(".pkl") and os.path.exists(value):
+            size += _path_size(value)
+    return size
+
+
+def log_progress(records, name, phase, every):
+    """
+    Pass the records through, logging the count and the rate every `every` records.
+    """
+    start = time.perf_counter()
+    for i, record in enumerate(records, 1):
+        if i % every == 0:
+            elapsed = time.perf_counter() - start
+            logger.info(f"{name}: {i} {phase} in {elapsed:.1f}s ({i / elapsed:.0f} records/s)")
+        yield record
+
+
+class PhaseMetrics:
+    """
+    Measures one phase of an adapter entry:
+
+        with PhaseMetrics(output_dir, "nodes") as phase:
+            freq, props = writer.write_nodes(...)
+            phase.records = sum(freq.values())
+        phase.metrics
+    """
+    def __init__(self, output_dir, phase):
+        self.output_dir = output_dir
+        self.phase = phase
+        self.records = 0
+        # CPU time spent on behalf of the phase by other threads (e.g. a prefetching producer)
+        self.extra_cpu = 0.0
+        self.metrics = None
+
+    def __enter__(self):
+        self._sizes = _output_sizes(self.output_dir, self.phase)
+        self._rss = _peak_rss_mb()
+        self._inputs = track_input_reads()
+        self._reads = self._inputs.__enter__()
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu + self.extra_cpu
+        self._inputs.__exit__(exc_type, exc_value, traceback)
+        # None when the adapter opened no input with open_input, whose reads are not measured
+        read, decompressed = (0, 0) if self._reads else (None, None)
+        for handle in self._reads:
+            counts = handle.input_counts()
+            read += counts[0]
+            decompressed += counts[1]
+        sizes = _output_sizes(self.output_dir, self.phase)
+        self.metrics = {
+            "records": self.records,
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            "records_per_s": round(self.records / wall, 1) if wall > 0 else None,
+            "bytes_written": sum(size - self._sizes.get(f, 0) for f, size in sizes.items()),
+            "peak_rss_delta_mb": round(_peak_rss_mb() - self._rss, 1),
+            "input_bytes_read": read,
+            "input_bytes_decompressed": decompressed,
+        }
+
+
+def merge_metrics(metrics, entry_metrics):
+    """
+    Merge the metrics of the phases of an entry that ran separately.
+    """
+    for name, entry in entry_metrics.items():
+        metrics.setdefault(name, {}).update(entry)
+    return metrics
+
+
+def write_metrics(output_dir, metrics, **build):
+    """
+    :param metrics: dict of adapter entry name -> metrics of the entry
+    :param build: build-wide values stored next to the per-adapter metrics
+    """
+    phases = [phase for entry in metrics.values() for key, phase in entry.items() if key in ("nodes", "edges")]
+    data = {
+        **build,
+        "records": sum(phase["records"] for phase in phases),
+        "bytes_written": sum(phase["bytes_written"] for phase in phases),
+        "adapters": metrics,
+    }
+    file_path = pathlib.Path(output_dir) / METRICS_FILE
+    with open(file_path, "w") as f:
+        json.dump(data, f, indent=2)
+    logger.info(f"Wrote build metrics to {file_path}")
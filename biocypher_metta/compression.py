@@ -0,0 +1,113 @@
+"""
+Compressed output streams of the writers.
+
+A writer opens its output files through its Compression, which appends the extension of the
+codec to the file name (.gz for gzip, .zst for zstd). Every time a file is opened for appending a
+new gzip member or zstd frame is started, and concatenated members/frames decompress to the
+concatenation of their content, so shards can still be merged by appending their bytes.
+zstd needs the zstandard package and is the only codec compressing on several threads. The text
+of every file is utf-8, whatever the codec and the locale.
+"""
+import gzip
+import io
+
+CODECS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+# Size of the buffer between the text layer and the compressor
+BUFFER_SIZE = 1 << 20
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the zstandard package: pip install zstandard")
+    return zstandard
+
+
+class Compression:
+    def __init__(self, codec="none", level=None, threads=0):
+        """
+        :param codec: one of CODECS
+        :param level: compression level, the default level of the codec if None
+        :param threads: number of compression threads (zstd only), 0 to compress on the writing thread
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression codec {codec}, expected one of {', '.join(CODECS)}")
+        if codec == "zstd":
+            _zstandard()
+        self.codec = codec
+        self.level = level if level is not None else DEFAULT_LEVELS.get(codec)
+        self.threads = threads
+
+    @property
+    def suffix(self):
+        return CODECS[self.codec]
+
+    @property
+    def enabled(self):
+        return self.codec != "none"
+
+    def settings(self):
+        return {"codec": self.codec, "level": self.level}
+
+    def open(self, path, mode="a", newline=None, buffering=BUFFER_SIZE):
+        """
+        Open path (which already carries the extension of the codec) for writing text.
+        :param mode: "w" or "a"
+        """
+        if self.codec == "none":
+            return open(path, mode, encoding="utf-8", newline=newline, buffering=buffering)
+        if self.codec == "gzip":
+            raw = gzip.GzipFile(path, mode + "b", compresslevel=self.level)
+        else:
+            zstandard = _zstandard()
+            compressor = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+            raw = compressor.stream_writer(open(path, mode + "b"), closefd=True, write_return_read=True)
+        return io.TextIOWrapper(io.BufferedWriter(raw, buffering), encoding="utf-8", newline=newline)
+
+    def __repr__(self):
+        return f"Compression({self.codec!r}, level={self.level}, threads={self.threads})"
+
+
+def codec_of(path):
+    """
+    The codec of a file, from its extension.
+    """
+    name = str(path)
+    for codec, suffix in CODECS.items():
+        if suffix and name.endswith(suffix):
+            return codec
+    return "none"
+
+
+def strip_suffix(path):
+    """
+    The path without the extension of its codec, e.g. nodes.metta for nodes.metta.gz.
+    """
+    suffix = CODECS[codec_of(path)]
+    return str(path)[:-len(suffix)] if suffix else str(path)
+
+
+def open_binary(path):
+    """
+    Open a possibly compressed file for reading its decompressed bytes, reading across all the
+    gzip members or zstd frames of the file.
+    """
+    codec = codec_of(path)
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    if codec == "zstd":
+        zstandard = _zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    return open(path, "rb")
+
+
+def open_text(path, newline=None):
+    """
+    Open a possibly compressed file for reading text.
+    """
+    if codec_of(path) == "none":
+        return open(path, "r", encoding="utf-8", newline=newline)
+    return io.TextIOWrapper(io.BufferedReader(open_binary(path), BUFFER_SIZE), encoding="utf-8", newline=newline)
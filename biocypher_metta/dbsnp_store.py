@@ -0,0 +1,355 @@
+"""
+Memory-mapped stores for the dbSNP maps.
+
+The dbSNP maps hold hundreds of millions of entries, which as pickled dicts take tens of GB
+of RAM and minutes to unpickle. The stores keep them on disk as sorted numpy arrays that are
+memory-mapped and searched with binary search, so opening one is instant and the pages are
+shared through the OS page cache by every worker process that opens the same store.
+
+A rsid store directory holds
+    meta.json   the format version, the number of entries, the chromosome names and the
+                entries whose rsid is not of the form rs<number>
+    rsids.npy   the numeric part of the rsids, sorted
+    chr.npy     the index of each rsid's chromosome in the chromosome names
+    pos.npy     the position of each rsid
+
+A position store directory holds
+    meta.json   the format version, the number of entries, the [start, end) range of each chromosome
+                and the entries whose value is not of the form rs<number> or whose key is not of
+                the form <chr>_<pos>
+    pos.npy     the positions, grouped by chromosome and sorted within each chromosome
+    rsids.npy   the numeric part of the rsid at each position
+"""
+from array import array
+from collections.abc import Mapping
+import json
+import os
+import pathlib
+import pickle
+
+from biocypher._logger import logger
+import numpy as np
+
+STORE_VERSION = 1
+RSID_STORE_KIND = "dbsnp_rsids"
+POS_STORE_KIND = "dbsnp_pos"
+
+
+def _parse_number(text):
+    """
+    :return: the integer of which text is the decimal form, or None, e.g. for "01" which the
+        stores would not tell apart from "1"
+    """
+    if not text.isascii() or not text.isdigit() or (len(text) > 1 and text[0] == "0"):
+        return None
+    return int(text)
+
+
+def _parse_rsid(rsid):
+    """
+    :return: the numeric part of a `rs<number>` id, or None if rsid is not in that form
+    """
+    if not isinstance(rsid, str) or not rsid.startswith("rs"):
+        return None
+    return _parse_number(rsid[2:])
+
+
+def _last_of_duplicates(keys):
+    """
+    :param keys: sorted keys, in the order of their entries among equal keys
+    :return: mask of the last entry of every key, which wins as in a dict built from the entries
+    """
+    keep = np.ones(len(keys), dtype=bool)
+    keep[:-1] = keys[1:] != keys[:-1]
+    if not keep.all():
+        logger.warning(f"Keeping the last of the entries of {int(len(keys) - keep.sum())} duplicate keys")
+    return keep
+
+
+def _save_arrays(out_dir, kind, arrays, **meta):
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(out_dir / f"{name}.npy", values)
+    with open(out_dir / "meta.json", "w") as f:
+        json.dump({"kind": kind, "version": STORE_VERSION, **meta}, f, indent=2)
+
+
+def _load_meta(path, kind):
+    with open(pathlib.Path(path) / "meta.json") as f:
+        meta = json.load(f)
+    if meta.get("kind") != kind or meta.get("version") != STORE_VERSION:
+        raise ValueError(f"{path} is not a version {STORE_VERSION} {kind} store")
+    return meta
+
+
+class DbsnpRsidStore(Mapping):
+    """
+    Read-only mapping of rsid -> {"chr": ..., "pos": ...} backed by a memory-mapped rsid store.
+    It is a drop-in replacement for the pickled dbsnp rsid map.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        meta = _load_meta(path, RSID_STORE_KIND)
+        self.chroms = meta["chroms"]
+        self.extra = meta["extra"]
+        self._rsids = np.load(os.path.join(self.path, "rsids.npy"), mmap_mode="r")
+        self._chr = np.load(os.path.join(self.path, "chr.npy"), mmap_mode="r")
+        self._pos = np.load(os.path.join(self.path, "pos.npy"), mmap_mode="r")
+
+    def _index(self, rsid):
+        number = _parse_rsid(rsid)
+        if number is None or number > np.iinfo(self._rsids.dtype).max:
+            return -1
+        i = int(np.searchsorted(self._rsids, number))
+        if i < len(self._rsids) and self._rsids[i] == number:
+            return i
+        return -1
+
+    def __getitem__(self, rsid):
+        i = self._index(rsid)
+        if i < 0:
+            if rsid in self.extra:
+                return dict(self.extra[rsid])
+            raise KeyError(rsid)
+        return {"chr": self.chroms[self._chr[i]], "pos": int(self._pos[i])}
+
+    def __contains__(self, rsid):
+        return self._index(rsid) >= 0 or rsid in self.extra
+
+    def __len__(self):
+        return len(self._rsids) + len(self.extra)
+
+    def __iter__(self):
+        for number in self._rsids:
+            yield f"rs{number}"
+        yield from self.extra
+
+    # Only the path is pickled, worker processes map the same files instead of copying the arrays
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+class DbsnpPosStore(Mapping):
+    """
+    Read-only mapping of "<chr>_<pos>" -> rsid backed by a memory-mapped position store.
+    Use lookup() and lookup_many() to look up positions without building the string keys.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        meta = _load_meta(path, POS_STORE_KIND)
+        self.chroms = meta["chroms"]
+        self.extra = meta["extra"]
+        self._pos = np.load(os.path.join(self.path, "pos.npy"), mmap_mode="r")
+        self._rsids = np.load(os.path.join(self.path, "rsids.npy"), mmap_mode="r")
+
+    def _positions(self, chr):
+        start, end = self.chroms.get(chr, (0, 0))
+        return start, self._pos[start:end]
+
+    def lookup(self, chr, pos):
+        """
+        :return: the rsid at position pos of chromosome chr, or None
+        """
+        start, positions = self._positions(chr)
+        pos = int(pos)
+        if pos < 0 or pos > np.iinfo(positions.dtype).max:
+            return None
+        i = int(np.searchsorted(positions, pos))
+        if i < len(positions) and positions[i] == pos:
+            return f"rs{self._rsids[start + i]}"
+        if self.extra:
+            return self.extra.get(f"{chr}_{pos}")
+        return None
+
+    def lookup_many(self, chr, positions):
+        """
+        Look up several positions of one chromosome with a single vectorized search.
+        :param positions: sequence of integer positions
+        :return: list with the rsid at each position, or None where there is none
+        """
+        start, chr_positions = self._positions(chr)
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(chr_positions) == 0 or len(positions) == 0:
+            return [None] * len(positions)
+        idx = np.searchsorted(chr_positions, positions)
+        clipped = np.minimum(idx, len(chr_positions) - 1)
+        found = (idx < len(chr_positions)) & (chr_positions[clipped] == positions)
+        rsids = self._rsids[start + clipped]
+        result = [f"rs{rsid}" if hit else None for rsid, hit in zip(rsids.tolist(), found.tolist())]
+        if self.extra:
+            for i, pos in enumerate(positions.tolist()):
+                if result[i] is None:
+                    result[i] = self.extra.get(f"{chr}_{pos}")
+        return result
+
+    def __getitem__(self, key):
+        chr, _, pos = key.rpartition("_")
+        rsid = self.lookup(chr, pos) if _parse_number(pos) is not None else self.extra.get(key)
+        if rsid is None:
+            raise KeyError(key)
+        return rsid
+
+    def __len__(self):
+        return len(self._pos) + len(self.extra)
+
+    def __iter__(self):
+        for chr, (start, end) in self.chroms.items():
+            for pos in self._pos[start:end]:
+                yield f"{chr}_{pos}"
+        yield from self.extra
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+def lookup_rsids(dbsnp_pos_map, chr, positions):
+    """
+    Look up the rsids at positions of chromosome chr in a position store or a pickled "<chr>_<pos>" -> rsid dict.
+    """
+    if isinstance(dbsnp_pos_map, DbsnpPosStore):
+        return dbsnp_pos_map.lookup_many(chr, positions)
+    return [dbsnp_pos_map.get(f"{chr}_{pos}", None) for pos in positions]
+
+
+def build_rsid_store(entries, out_dir):
+    """
+    Write a rsid store from (rsid, chr, pos) tuples.
+    :param entries: iterable of (rsid, chr, pos)
+    :param out_dir: directory the store is written to
+    """
+    rsids = array("Q")
+    chrs = array("H")
+    positions = array("Q")
+    chrom_codes = {}
+    extra = {}
+    for rsid, chr, pos in entries:
+        number = _parse_rsid(rsid)
+        if number is None:
+            extra[rsid] = {"chr": chr, "pos": pos}
+            continue
+        code = chrom_codes.setdefault(chr, len(chrom_codes))
+        rsids.append(number)
+        chrs.append(code)
+        positions.append(int(pos))
+    if extra:
+        logger.warning(f"Storing {len(extra)} entries without a numeric rsid in the store metadata")
+
+    rsids = np.frombuffer(rsids, dtype=np.uint64)
+    order = np.argsort(rsids, kind="stable")
+    order = order[_last_of_duplicates(rsids[order])]
+    rsids = rsids[order]
+    positions = np.frombuffer(positions, dtype=np.uint64)[order]
+    # use 32 bit integers whenever the values fit, which halves the size of the store
+    rsid_dtype = np.uint32 if len(rsids) == 0 or rsids[-1] <= np.iinfo(np.uint32).max else np.uint64
+    pos_dtype = np.uint32 if len(positions) == 0 or positions.max() <= np.iinfo(np.uint32).max else np.uint64
+    _save_arrays(out_dir, RSID_STORE_KIND, {
+        "rsids": rsids.astype(rsid_dtype),
+        "chr": np.frombuffer(chrs, dtype=np.uint16)[order],
+        "pos": positions.astype(pos_dtype),
+    }, size=len(rsids), chroms=list(chrom_codes), extra=extra)
+    logger.info(f"Wrote {len(rsids)} rsids to {out_dir}")
+
+
+def convert_rsid_pickle(pickle_path, out_dir):
+    """
+    Convert a pickled rsid -> {"chr": ..., "pos": ...} dict into a rsid store.
+    """
+    with open(pickle_path, "rb") as f:
+        rsid_map = pickle.load(f)
+    build_rsid_store(((rsid, v["chr"], v["pos"]) for rsid, v in rsid_map.items()), out_dir)
+
+
+def build_pos_store(entries, out_dir, extra=None):
+    """
+    Write a position store from (chr, pos, rsid) tuples.
+    :param entries: iterable of (chr, pos, rsid)
+    :param out_dir: directory the store is written to
+    :param extra: dict of key -> rsid of the entries whose key is not of the form <chr>_<pos>, kept
+        as is in the store metadata
+    """
+    chrom_entries = {}
+    extra = dict(extra or {})
+    for chr, pos, rsid in entries:
+        number = _parse_rsid(rsid)
+        if number is None:
+            extra[f"{chr}_{pos}"] = rsid
+            continue
+        if chr not in chrom_entries:
+            chrom_entries[chr] = (array("Q"), array("Q"))
+        positions, rsids = chrom_entries[chr]
+        positions.append(int(pos))
+        rsids.append(number)
+    if extra:
+        logger.warning(f"Storing {len(extra)} entries without a position or a numeric rsid in the store metadata")
+
+    all_positions = []
+    all_rsids = []
+    chroms = {}
+    start = 0
+    for chr, (positions, rsids) in chrom_entries.items():
+        positions = np.frombuffer(positions, dtype=np.uint64)
+        order = np.argsort(positions, kind="stable")
+        order = order[_last_of_duplicates(positions[order])]
+        all_positions.append(positions[order])
+        all_rsids.append(np.frombuffer(rsids, dtype=np.uint64)[order])
+        chroms[chr] = [start, start + len(order)]
+        start += len(order)
+
+    positions = np.concatenate(all_positions) if all_positions else np.zeros(0, dtype=np.uint64)
+    rsids = np.concatenate(all_rsids) if all_rsids else np.zeros(0, dtype=np.uint64)
+    pos_dtype = np.uint32 if len(positions) == 0 or positions.max() <= np.iinfo(np.uint32).max else np.uint64
+    rsid_dtype = np.uint32 if len(rsids) == 0 or rsids.max() <= np.iinfo(np.uint32).max else np.uint64
+    _save_arrays(out_dir, POS_STORE_KIND, {
+        "pos": positions.astype(pos_dtype),
+        "rsids": rsids.astype(rsid_dtype),
+    }, size=len(positions), chroms=chroms, extra=extra)
+    logger.info(f"Wrote {len(positions)} positions to {out_dir}")
+
+
+def convert_pos_pickle(pickle_path, out_dir):
+    """
+    Convert a pickled "<chr>_<pos>" -> rsid dict into a position store.
+    """
+    with open(pickle_path, "rb") as f:
+        pos_map = pickle.load(f)
+    # the keys that are not positions, e.g. a header row, are kept as they are
+    extra = {key: rsid for key, rsid in pos_map.items() if _parse_number(key.rpartition("_")[2]) is None}
+    if extra:
+        logger.warning(f"{len(extra)} keys are not of the form <chr>_<pos>, e.g. {next(iter(extra))}")
+    def entries():
+        for key, rsid in pos_map.items():
+            if key not in extra:
+                chr, _, pos = key.rpartition("_")
+                yield chr, pos, rsid
+    build_pos_store(entries(), out_dir, extra)
+
+
+def load_rsid_map(path):
+    """
+    Open the dbsnp rsid map at path, a rsid store directory or a pickled dict.
+    """
+    if os.path.isdir(path):
+        logger.info(f"Opening dbsnp rsid store {path}")
+        return DbsnpRsidStore(path)
+    logger.info(f"Loading pickled dbsnp rsid map {path}")
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_pos_map(path):
+    """
+    Open the dbsnp position map at path, a position store directory or a pickled dict.
+    """
+    if os.path.isdir(path):
+        logger.info(f"Opening dbsnp position store {path}")
+        return DbsnpPosStore(path)
+    logger.info(f"Loading pickled dbsnp pos map {path}")
+    with open(path, "rb") as f:
+        return pickle.load(f)
@@ -0,0 +1,255 @@
+"""
+Deduplication of the nodes emitted by several adapters (or several times by one adapter).
+
+When deduplication is enabled the adapters don't write their nodes: run_adapter spools them to
+hash-partitioned files under <output>/.dedupe, partitioned on the label and the id as the writer
+outputs it (see BaseWriter.normalize_id, e.g. GO:0001 and go_0001 are the same csv node) so that
+all the copies of a node land in the same partition. The spool files are streams of pickled
+chunks of records, which can be concatenated, so the spools of parallel shards are merged by
+appending like any other output file. After all the adapters ran, dedupe_nodes loads one
+partition at a time, merges the properties of the records of the same node under the conflict
+rules and writes every merged node with the writer into the output directory of the adapter of
+its first record.
+
+Conflict rules, applied when two records of a node hold different non-empty values for a property:
+    first: keep the value of the first record
+    last: keep the value of the last record
+    union: keep the distinct values of all records, as a list
+    min, max: keep the smallest or largest value
+"""
+from collections import Counter, defaultdict
+import json
+import pickle
+import shutil
+import zlib
+
+from biocypher._logger import logger
+
+DEDUPE_SPOOL_DIR = ".dedupe"
+# merged nodes buffered per output directory of the spool, before they are written
+MERGED_SPOOL_DIR = "merged"
+DEDUPE_REPORT = "dedupe_report.json"
+
+RULES = ("first", "last", "union", "min", "max")
+# every contributing dataset is kept, the other properties keep their first value
+DEFAULT_RULES = {"source": "union", "source_url": "union"}
+
+# records of a partition buffered before they are pickled to its spool file
+SPOOL_CHUNK = 1000
+
+
+def partition_of(label, id, partitions):
+    return zlib.crc32(f"{label}\t{id}".encode()) % partitions
+
+
+def partition_file(spool_dir, partition):
+    return spool_dir / f"part-{partition:05d}.pkl"
+
+
+def parse_rules(specs):
+    """
+    :param specs: property=rule strings
+    :return: dict of property -> rule, on top of DEFAULT_RULES
+    """
+    rules = dict(DEFAULT_RULES)
+    for spec in specs or []:
+        prop, sep, rule = spec.partition("=")
+        if not sep or rule not in RULES:
+            raise ValueError(f"Invalid dedupe rule {spec}, expected property=rule with rule one of {', '.join(RULES)}")
+        rules[prop] = rule
+    return rules
+
+
+def spool_nodes(nodes, spool_dir, partitions, outdir, normalize_id=None):
+    """
+    Spool the nodes to the partition files of spool_dir instead of writing them, as
+    (outdir, key, id, label, properties) records.
+    :param outdir: output directory the nodes would have been written to
+    :param normalize_id: the id conversion of the writer, the key of a node is its converted id
+    :return: the node counts and properties per label, as write_nodes of a writer
+    """
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    node_freq = Counter()
+    node_props = defaultdict(set)
+    chunks = defaultdict(list)
+    files = {}
+
+    def flush(partition):
+        if partition not in files:
+            files[partition] = open(partition_file(spool_dir, partition), "ab")
+        pickle.dump(chunks[partition], files[partition], protocol=pickle.HIGHEST_PROTOCOL)
+        chunks[partition] = []
+
+    try:
+        for node in nodes:
+            id, label, properties = node
+            node_freq[label] += 1
+            node_props[label].update(properties.keys())
+            key = id if normalize_id is None else normalize_id(id)
+            partition = partition_of(label, key, partitions)
+            chunk = chunks[partition]
+            chunk.append((outdir, key, id, label, properties))
+            if len(chunk) >= SPOOL_CHUNK:
+                flush(partition)
+        for partition, chunk in list(chunks.items()):
+            if chunk:
+                flush(partition)
+    finally:
+        for f in files.values():
+            f.close()
+    return node_freq, node_props
+
+
+def read_spool(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield from pickle.load(f)
+            except EOFError:
+                return
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def merge_value(current, value, rule):
+    """
+    :return: the value of a property of a node holding current, merged with value under rule
+    """
+    if rule == "last":
+        return value
+    if rule == "union":
+        merged = _as_list(current)
+        for v in _as_list(value):
+            if v not in merged:
+                merged.append(v)
+        return merged
+    if rule in ("min", "max"):
+        try:
+            return min(current, value) if rule == "min" else max(current, value)
+        except TypeError:
+            return current
+    return current
+
+
+def merge_properties(merged, properties, rules, default_rule, conflicts):
+    """
+    Merge the properties of a record into the merged properties of its node, counting in conflicts
+    the properties whose merged value the record changed.
+    """
+    for key, value in properties.items():
+        if value is None or value == "":
+            continue
+        current = merged.get(key)
+        if current is None or current == "":
+            merged[key] = value
+            continue
+        if current == value:
+            continue
+        new = merge_value(current, value, rules.get(key, default_rule))
+        if new != current:
+            merged[key] = new
+            conflicts[key] += 1
+
+
+def merged_nodes(spool_dir, rules, default_rule, stats):
+    """
+    Yield the merged nodes of every partition of spool_dir, in the order their first record was
+    spooled within a partition, as (outdir, node) with the output directory and id of the first record.
+    :param stats: dict filled with the records, unique nodes and conflicts of every label
+    """
+    for path in sorted(spool_dir.glob("part-*.pkl")):
+        nodes = {}
+        for outdir, key, id, label, properties in read_spool(path):
+            label_stats = stats.get(label)
+            if label_stats is None:
+                label_stats = stats[label] = {"records": 0, "unique": 0, "conflicts": Counter()}
+            label_stats["records"] += 1
+            node = nodes.get((label, key))
+            if node is None:
+                nodes[(label, key)] = (outdir, id, dict(properties))
+                label_stats["unique"] += 1
+            else:
+                merge_properties(node[2], properties, rules, default_rule, label_stats["conflicts"])
+        for (label, _), (outdir, id, properties) in nodes.items():
+            yield outdir, (id, label, properties)
+
+
+def _spool_by_outdir(merged, merged_dir):
+    """
+    Buffer the merged nodes to a spool file per output directory of merged_dir.
+    :return: the spool file of every output directory, in the order of their first node
+    """
+    merged_dir.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    chunks = defaultdict(list)
+    files = {}
+
+    def flush(outdir):
+        if outdir not in files:
+            files[outdir] = open(paths[outdir], "ab")
+        pickle.dump(chunks[outdir], files[outdir], protocol=pickle.HIGHEST_PROTOCOL)
+        chunks[outdir] = []
+
+    try:
+        for outdir, node in merged:
+            if outdir not in paths:
+                paths[outdir] = merged_dir / f"{len(paths):05d}.pkl"
+            chunk = chunks[outdir]
+            chunk.append(node)
+            if len(chunk) >= SPOOL_CHUNK:
+                flush(outdir)
+        for outdir, chunk in list(chunks.items()):
+            if chunk:
+                flush(outdir)
+    finally:
+        for f in files.values():
+            f.close()
+    return paths
+
+
+def dedupe_nodes(writer, rules=None, default_rule="first"):
+    """
+    Write the merged nodes of the spool of the writer's output directory with the writer, into the
+    output directory of their first record, and write the dedupe report.
+    :param rules: dict of property -> conflict rule, DEFAULT_RULES if None
+    :param default_rule: conflict rule of the other properties
+    :return: the node counts and properties per label of the merged nodes, and the report
+    """
+    spool_dir = writer.output_path / DEDUPE_SPOOL_DIR
+    rules = DEFAULT_RULES if rules is None else rules
+    spool_dir.mkdir(parents=True, exist_ok=True)
+
+    stats = {}
+    paths = _spool_by_outdir(merged_nodes(spool_dir, rules, default_rule, stats), spool_dir / MERGED_SPOOL_DIR)
+    node_freq = Counter()
+    node_props = defaultdict(set)
+    for outdir, path in paths.items():
+        writer.clear_counts()
+        freq, props = writer.write_nodes(read_spool(path), path_prefix=outdir)
+        node_freq.update(freq)
+        for label, keys in props.items():
+            node_props[label].update(keys)
+
+    labels = {}
+    for label, label_stats in sorted(stats.items()):
+        labels[label] = {
+            "records": label_stats["records"],
+            "unique": label_stats["unique"],
+            "ratio": round(label_stats["records"] / label_stats["unique"], 4),
+            "conflicts": dict(sorted(label_stats["conflicts"].items())),
+        }
+        logger.info(f"Deduplicated {label}: {label_stats['records']} records into {label_stats['unique']} nodes "
+                    f"(ratio {labels[label]['ratio']})")
+    report = {
+        "records": sum(s["records"] for s in labels.values()),
+        "unique": sum(s["unique"] for s in labels.values()),
+        "default_rule": default_rule,
+        "rules": rules,
+        "labels": labels,
+    }
+    with open(writer.output_path / DEDUPE_REPORT, "w") as f:
+        json.dump(report, f, indent=2)
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    return dict(node_freq), dict(node_props), report
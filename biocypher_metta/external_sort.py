@@ -0,0 +1,94 @@
+"""
+Sorting of text files larger than memory.
+
+The lines of the input are sorted in runs of at most `run_lines` lines, every run is written to a
+temporary file and the runs are merged with a k-way merge, so that at most one run is held in
+memory. Lines are compared as strings, which is the byte order of their UTF-8 encoding, the order
+of `LC_ALL=C sort`.
+"""
+import heapq
+import itertools
+import os
+import tempfile
+
+from biocypher_metta.compression import open_text
+
+DEFAULT_RUN_LINES = 1_000_000
+
+# Maximum number of runs merged at once, runs beyond it are merged into intermediate runs first
+MAX_MERGE_FANIN = 256
+
+
+def _write_run(lines, tmp_dir):
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+        f.writelines(lines)
+    return path
+
+
+def _merge_runs(paths, out, unique):
+    """
+    Merge the sorted run files into the text file out.
+    :return: number of lines written
+    """
+    count = 0
+    files = [open(path, encoding="utf-8", newline="") for path in paths]
+    try:
+        merged = heapq.merge(*files)
+        if unique:
+            merged = (line for line, _ in itertools.groupby(merged))
+        for line in merged:
+            out.write(line)
+            count += 1
+    finally:
+        for f in files:
+            f.close()
+    return count
+
+
+def sorted_runs(lines, tmp_dir, run_lines=DEFAULT_RUN_LINES):
+    """
+    Write the lines to sorted run files of at most run_lines lines in tmp_dir.
+    :return: the paths of the run files
+    """
+    runs = []
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, run_lines))
+        if not chunk:
+            break
+        chunk.sort()
+        runs.append(_write_run(chunk, tmp_dir))
+    return runs
+
+
+def external_sort(src, dest, run_lines=DEFAULT_RUN_LINES, unique=False, open_dest=None, tmp_dir=None):
+    """
+    Sort the lines of the (possibly compressed) file src into dest, which may be src itself.
+    :param run_lines: number of lines sorted in memory at once
+    :param unique: drop repeated lines
+    :param open_dest: function opening dest for writing text, open(dest, "w") by default
+    :param tmp_dir: directory of the run files, the directory of dest by default
+    :return: number of lines written
+    """
+    tmp_dir = tmp_dir if tmp_dir is not None else os.path.dirname(os.path.abspath(dest))
+    with tempfile.TemporaryDirectory(prefix=".sort-", dir=tmp_dir) as work_dir:
+        with open_text(src, newline="") as f:
+            # a last line without newline would be merged with the line following it in its run
+            runs = sorted_runs((line if line.endswith("\n") else line + "\n" for line in f), work_dir, run_lines)
+
+        while len(runs) > MAX_MERGE_FANIN:
+            merged = []
+            for i in range(0, len(runs), MAX_MERGE_FANIN):
+                group = runs[i:i + MAX_MERGE_FANIN]
+                fd, path = tempfile.mkstemp(suffix=".run", dir=work_dir)
+                with os.fdopen(fd, "w", encoding="utf-8", newline="") as out:
+                    _merge_runs(group, out, unique)
+                for run in group:
+                    os.remove(run)
+                merged.append(path)
+            runs = merged
+
+        # the merge reads the runs only, so dest can replace src
+        with (open_dest(dest) if open_dest is not None else open(dest, "w", newline="")) as out:
+            return _merge_runs(runs, out, unique)
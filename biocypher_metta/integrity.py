@@ -0,0 +1,387 @@
+"""
+Referential integrity check of the edges: the edges whose source or target id was not emitted as
+a node by any adapter of the build (dangling edges) are reported, and optionally dropped.
+
+The node ids are inserted into a Bloom filter per node label as the nodes are written, sized for
+the expected number of nodes of the label and a false positive rate, so that the check needs a
+bounded amount of memory however many ids the build has (about 1.8 GB for a billion ids at a
+0.1% false positive rate). A dangling endpoint can be missed with the false positive rate, an
+emitted node is never reported.
+
+Every adapter run appends the filters of its nodes to <output>/.integrity/filters/<label>.bloom
+and the endpoints of its edges (the whole edges in drop mode, whose edges are written at the end
+of the build) to <output>/.integrity/edges.pkl. Both are concatenations, so the files of parallel
+shards are merged by appending like any other output file. check_edges ORs the filter blocks
+of every label and tests the endpoints of every edge against the filter of the node type the
+schema gives them. The ids are compared as the writer outputs them (see BaseWriter.normalize_id),
+on both the node and the edge side, so that an edge to GO:0001 finds the node go_0001 of a
+writer that lowercases ids and replaces ':'.
+"""
+from collections import Counter, defaultdict
+import hashlib
+import itertools
+import json
+import pickle
+import shutil
+import struct
+
+import numpy as np
+
+from biocypher._logger import logger
+
+INTEGRITY_DIR = ".integrity"
+FILTERS_DIR = "filters"
+EDGES_SPOOL = "edges.pkl"
+INTEGRITY_REPORT = "integrity_report.json"
+
+DEFAULT_CAPACITY = 10_000_000
+DEFAULT_FP_RATE = 0.001
+
+FILTER_MAGIC = b"BCMBLM01"
+FILTER_HEADER = struct.Struct("<8sQI")
+
+# ids hashed at once, and edges buffered before they are pickled to the spool
+BATCH = 65536
+# dangling ids kept as examples in the report for every edge label
+EXAMPLES = 5
+
+
+def node_label(label):
+    """
+    The label of a node as the writers output it, which the schema types of the edge endpoints match.
+    """
+    if "." in label:
+        label = label.split(".")[1]
+    return label.lower().replace(" ", "_")
+
+
+def endpoint_type(schema_type, id):
+    # the type of an ontology term endpoint is the prefix of its id, as in the writers
+    if schema_type == "ontology_term":
+        return id.replace(":", "_").split("_")[0].lower()
+    return schema_type
+
+
+def _hashes(keys):
+    """
+    :return: two 64-bit hashes of every key, as an (n, 2) array
+    """
+    digests = b"".join(hashlib.blake2b(str(key).encode(), digest_size=16).digest() for key in keys)
+    return np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+
+
+class BloomFilter:
+    """
+    Bloom filter of a power of two number of bits, with the k positions of a key derived from two
+    hashes by double hashing.
+    """
+    def __init__(self, bits, hashes, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = np.zeros(bits // 8, dtype=np.uint8) if data is None else data
+        self._steps = np.arange(hashes, dtype=np.uint64)
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate=DEFAULT_FP_RATE):
+        """
+        :return: a filter holding capacity keys at fp_rate, its size rounded up to a power of two
+        """
+        capacity = max(capacity, 1)
+        optimal = -capacity * np.log(fp_rate) / np.log(2) ** 2
+        bits = max(64, 1 << int(np.ceil(np.log2(optimal))))
+        hashes = max(1, int(round(bits / capacity * np.log(2))))
+        # more hashes than needed for the rounded up size only cost time
+        hashes = min(hashes, max(1, int(np.ceil(-np.log2(fp_rate)))))
+        return cls(bits, hashes)
+
+    def _positions(self, keys):
+        h = _hashes(keys)
+        with np.errstate(over="ignore"):
+            return (h[:, :1] + self._steps * h[:, 1:]) & np.uint64(self.bits - 1)
+
+    def add(self, keys):
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.data, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def contains(self, keys):
+        """
+        :return: a boolean array, whether each key may have been added
+        """
+        positions = self._positions(keys)
+        return ((self.data[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+
+    def update(self, other):
+        np.bitwise_or(self.data, other.data, out=self.data)
+
+    def estimated_fp_rate(self):
+        fill = np.unpackbits(self.data).mean() if self.bits else 0.0
+        return float(fill ** self.hashes)
+
+    def to_bytes(self):
+        return FILTER_HEADER.pack(FILTER_MAGIC, self.bits, self.hashes) + self.data.tobytes()
+
+
+def load_filters(path):
+    """
+    OR the filter blocks of a filter file, grouped by their size, which changes when the expected
+    counts of a later build do.
+    :return: the list of filters of the file
+    """
+    filters = {}
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(FILTER_HEADER.size)
+            if not header:
+                break
+            magic, bits, hashes = FILTER_HEADER.unpack(header)
+            if magic != FILTER_MAGIC:
+                raise ValueError(f"{path} is not a filter file")
+            block = BloomFilter(bits, hashes, np.frombuffer(f.read(bits // 8), dtype=np.uint8).copy())
+            if (bits, hashes) in filters:
+                filters[(bits, hashes)].update(block)
+            else:
+                filters[(bits, hashes)] = block
+    return list(filters.values())
+
+
+def parse_expected(specs):
+    """
+    :param specs: label=count strings
+    :return: dict of node label -> expected count
+    """
+    expected = {}
+    for spec in specs or []:
+        label, sep, count = spec.partition("=")
+        if not sep or not count.isdigit():
+            raise ValueError(f"Invalid expected count {spec}, expected label=count")
+        expected[node_label(label)] = int(count)
+    return expected
+
+
+def previous_counts(output_dir):
+    """
+    :return: the node counts of every label of the previous build of output_dir, from its graph info
+    """
+    try:
+        with open(output_dir / "graph_info.json") as f:
+            graph_info = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {node_label(entity["name"]): entity["count"] for entity in graph_info.get("top_entities", [])}
+
+
+class NodeFilters:
+    """
+    The filters of the node ids of an adapter run.
+    """
+    def __init__(self, settings, normalize_id=None):
+        """
+        :param settings: the integrity settings of run_options
+        :param normalize_id: the id conversion of the writer, the filters hold the converted ids
+        """
+        self.settings = settings
+        self.normalize_id = normalize_id
+        self.filters = {}
+        self.pending = defaultdict(list)
+
+    def watch(self, nodes):
+        """
+        Yield the nodes, adding their ids to the filters of their labels.
+        """
+        for node in nodes:
+            label = node[1]
+            ids = self.pending[label]
+            ids.append(node[0] if self.normalize_id is None else self.normalize_id(str(node[0])))
+            if len(ids) >= BATCH:
+                self.flush(label)
+            yield node
+
+    def flush(self, label):
+        ids = self.pending.pop(label, None)
+        if not ids:
+            return
+        label = node_label(label)
+        bloom = self.filters.get(label)
+        if bloom is None:
+            capacity = self.settings["expected"].get(label, self.settings["capacity"])
+            bloom = self.filters[label] = BloomFilter.for_capacity(capacity, self.settings["fp_rate"])
+        bloom.add(ids)
+
+    def save(self, output_path):
+        """
+        Append the filters to the filter files of output_path.
+        """
+        for label in list(self.pending):
+            self.flush(label)
+        directory = output_path / INTEGRITY_DIR / FILTERS_DIR
+        directory.mkdir(parents=True, exist_ok=True)
+        for label, bloom in self.filters.items():
+            with open(directory / f"{label}.bloom", "ab") as f:
+                f.write(bloom.to_bytes())
+
+
+def spool_edges(edges, output_path, outdir, keep):
+    """
+    Append the edges to the edge spool of output_path.
+    :param outdir: output directory of the edges, where they are written in drop mode
+    :param keep: spool the whole edges, for writing them after the check, instead of their endpoints
+    """
+    directory = output_path / INTEGRITY_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / EDGES_SPOOL, "ab") as f:
+        chunk = []
+        for edge in edges:
+            source_id, target_id, label, properties = edge
+            chunk.append((outdir, source_id, target_id, label, properties if keep else None))
+            if len(chunk) >= BATCH:
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                chunk = []
+            if not keep:
+                yield edge
+        if chunk:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def spooled_edge_counts(edges, output_path, outdir):
+    """
+    Spool the whole edges instead of writing them, for drop mode.
+    :return: the edge counts per label, as write_edges of a writer
+    """
+    edge_freq = Counter()
+    for _ in spool_edges(_counted(edges, edge_freq), output_path, outdir, keep=True):
+        pass
+    return edge_freq
+
+
+def _counted(edges, counts):
+    for edge in edges:
+        counts[edge[2]] += 1
+        yield edge
+
+
+def _read_chunks(path):
+    if not path.exists():
+        return
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+class _Dangling:
+    """
+    Membership test of the endpoints of a chunk of edges against the filters of the node labels.
+    """
+    def __init__(self, filters):
+        self.filters = filters
+        self.any_label = [bloom for blooms in filters.values() for bloom in blooms]
+
+    def missing(self, ids, types):
+        """
+        :return: a boolean array, whether each id is surely not a node of its type; types without
+            any node are checked against the nodes of every label
+        """
+        missing = np.zeros(len(ids), dtype=bool)
+        by_type = defaultdict(list)
+        for i, t in enumerate(types):
+            by_type[t].append(i)
+        for t, positions in by_type.items():
+            blooms = self.filters.get(t) or self.any_label
+            keys = [ids[i] for i in positions]
+            found = np.zeros(len(keys), dtype=bool)
+            for bloom in blooms:
+                found |= bloom.contains(keys)
+            missing[positions] = ~found
+        return missing
+
+
+def _checked_edges(chunks, dangling, schema_dict, stats, normalize_id=None):
+    """
+    Yield the output directory and the edge of every spooled edge that is not dangling, counting
+    the edges and dangling endpoints of every label in stats.
+    :param normalize_id: the id conversion of the writer, applied to the endpoints before the test
+    """
+    normalize = str if normalize_id is None else lambda id: str(normalize_id(str(id)))
+    for chunk in chunks:
+        types = {}
+        for _, _, _, label, _ in chunk:
+            if label not in types:
+                types[label] = schema_dict.get(label.lower())
+        checked = [i for i, (_, _, _, label, _) in enumerate(chunk) if types[label] is not None]
+        missing_source = np.zeros(len(chunk), dtype=bool)
+        missing_target = np.zeros(len(chunk), dtype=bool)
+        if checked:
+            sources = [normalize(chunk[i][1]) for i in checked]
+            targets = [normalize(chunk[i][2]) for i in checked]
+            missing_source[checked] = dangling.missing(
+                sources, [endpoint_type(types[chunk[i][3]]["source"], s) for i, s in zip(checked, sources)])
+            missing_target[checked] = dangling.missing(
+                targets, [endpoint_type(types[chunk[i][3]]["target"], t) for i, t in zip(checked, targets)])
+
+        for i, (outdir, source_id, target_id, label, properties) in enumerate(chunk):
+            label_stats = stats.get(label)
+            if label_stats is None:
+                label_stats = stats[label] = {"edges": 0, "dangling": 0, "dangling_source": 0,
+                                              "dangling_target": 0, "checked": types[label] is not None,
+                                              "examples": []}
+            label_stats["edges"] += 1
+            if missing_source[i] or missing_target[i]:
+                label_stats["dangling"] += 1
+                label_stats["dangling_source"] += int(missing_source[i])
+                label_stats["dangling_target"] += int(missing_target[i])
+                if len(label_stats["examples"]) < EXAMPLES:
+                    label_stats["examples"].append([source_id, target_id])
+            else:
+                yield outdir, (source_id, target_id, label, properties)
+
+
+def check_edges(writer, schema_dict, drop=False):
+    """
+    Test the spooled edge endpoints of the writer's output directory against the node filters,
+    write the integrity report and, in drop mode, write the edges that are not dangling.
+    :param schema_dict: the edges of the compiled schema, lowercased label -> source and target types
+    :return: the edge counts per label of the written edges in drop mode, None otherwise, and the report
+    """
+    root = writer.output_path / INTEGRITY_DIR
+    filters = {}
+    for path in sorted((root / FILTERS_DIR).glob("*.bloom")):
+        filters[path.name[:-len(".bloom")]] = load_filters(path)
+
+    stats = {}
+    edges = _checked_edges(_read_chunks(root / EDGES_SPOOL), _Dangling(filters), schema_dict, stats,
+                           writer.normalize_id)
+    edge_freq = Counter()
+    if drop:
+        # the spool holds the edges of an adapter run contiguously, in the order of the build
+        for outdir, group in itertools.groupby(edges, key=lambda item: item[0]):
+            writer.clear_counts()
+            edge_freq.update(writer.write_edges((edge for _, edge in group), path_prefix=outdir))
+    else:
+        for _ in edges:
+            pass
+
+    labels = {}
+    for label, label_stats in sorted(stats.items()):
+        labels[label] = dict(label_stats, ratio=round(label_stats["dangling"] / label_stats["edges"], 6))
+        if label_stats["dangling"]:
+            logger.warning(f"{label_stats['dangling']} of {label_stats['edges']} {label} edges are dangling"
+                           f"{', dropped' if drop else ''}: {label_stats['dangling_source']} sources and "
+                           f"{label_stats['dangling_target']} targets were not emitted as nodes")
+        if not label_stats["checked"]:
+            logger.warning(f"Edge label {label} is not in the schema, its endpoints were not checked")
+    report = {
+        "edges": sum(s["edges"] for s in labels.values()),
+        "dangling": sum(s["dangling"] for s in labels.values()),
+        "dropped": drop,
+        "filters": {label: [{"bits": bloom.bits, "hashes": bloom.hashes,
+                             "estimated_fp_rate": round(bloom.estimated_fp_rate(), 6)} for bloom in blooms]
+                    for label, blooms in sorted(filters.items())},
+        "labels": labels,
+    }
+    with open(writer.output_path / INTEGRITY_REPORT, "w") as f:
+        json.dump(report, f, indent=2)
+    shutil.rmtree(root, ignore_errors=True)
+    return (dict(edge_freq) if drop else None), report
@@ -1,28 +1,62 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
+from collections import Counter, defaultdict
+import hashlib
+import json
 import pathlib
 import os
+import zlib
 from biocypher._logger import logger
 import networkx as nx
 
 from biocypher_metta import BaseWriter
+from biocypher_metta.output_index import metta_key, write_indexes
+
+# record counts of the shard files of a directory, turned into the shard manifest by finalize
+SHARD_COUNTS_FILE = ".shard_counts.json"
+SHARD_MANIFEST = "shards.json"
+
+
+def shard_of(key, shards):
+    """
+    Shard of a node id or edge source id, stable across runs and machines.
+    """
+    return zlib.crc32(str(key).encode()) % shards
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
 
 class MeTTaWriter(BaseWriter):
 
     def __init__(self, schema_config, biocypher_config,
-                 output_dir):
-        super().__init__(schema_config, biocypher_config, output_dir)
+                 output_dir, batch_lines=100000, compression=None, shards=0, intern_provenance=False, index=False):
+        """
+        :param batch_lines: number of formatted lines joined into a single write to the output file
+        :param shards: number of files the nodes and edges of an output directory are split into,
+            0 or 1 for a single nodes.metta and edges.metta
+        :param index: write the byte-offset index of every output file in finalize, see output_index
+        """
+        super().__init__(schema_config, biocypher_config, output_dir, compression, intern_provenance)
+        if index and self.compression.enabled:
+            raise ValueError("The index holds byte offsets into the output files, which can't be compressed")
+        self.index = index
+        self.batch_lines = batch_lines
+        self.shards = shards
         self.create_type_hierarchy()
 
         #self.excluded_properties = ["license", "version", "source"]
         self.excluded_properties = []
+        self.compile_formatters()
 
     def create_type_hierarchy(self):
-        G = self.ontology._nx_graph
         file_path = f"{self.output_path}/type_defs.metta"
         with open(file_path, "w") as f:
-            for node in G.nodes:
-                if "mixin" in node: continue
-                ancestor = list(self.get_parent(G, node))[-1]
+            for node, ancestor in self.schema["type_hierarchy"]:
                 node = self.convert_input_labels(node)
                 ancestor = self.convert_input_labels(ancestor)
                 if ancestor == node:
@@ -36,7 +70,7 @@ class MeTTaWriter(BaseWriter):
         logger.info("Type hierarchy created successfully.")
 
     def create_data_constructors(self, file):
-        schema = self.bcy._get_ontology_mapping()._extend_schema()
+        schema = self.schema["schema"]
         self.edge_node_types = {}
         def edge_data_constructor(edge_type, source_type, target_type, label):
             return f"(: {label.lower()} (-> {source_type.upper()} {target_type.upper()} {edge_type.upper()}))"
@@ -87,15 +121,9 @@ class MeTTaWriter(BaseWriter):
                     pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(parents=True, exist_ok=True)
         else:
             file_path = f"{self.output_path}/nodes.metta"
-        
-        with open(file_path, "a") as f:
-            for node in nodes:
-                self.extract_node_info(node) # Count nodes and extract node properties
-                out_str = self.write_node(node)
-                for s in out_str:
-                    f.write(s + "\n")
 
-            f.write("\n")
+        # Count nodes and extract node properties, nodes are sharded by their id
+        self.write_records(nodes, file_path, self.extract_node_info, self.write_node)
 
         logger.info("Finished writing out nodes")
         return self.node_freq, self.node_props
@@ -111,44 +139,169 @@ class MeTTaWriter(BaseWriter):
         else:
             file_path = f"{self.output_path}/edges.metta"
 
-        with open(file_path, "a") as f:
-            for edge in edges:
-                self.extract_edge_info(edge) # Count edges
-                out_str = self.write_edge(edge)
-                for s in out_str:
-                    f.write(s + "\n")
-
-            f.write("\n")
+        # Count edges, edges are sharded by their source id
+        self.write_records(edges, file_path, self.extract_edge_info, self.write_edge)
         return self.edge_freq
 
+    def write_records(self, records, file_path, extract_info, write_record):
+        """
+        Write the records to file_path or, when the output is sharded, to the shard files
+        <name>.<i>.metta next to it, every record going to the shard of the hash of its first
+        field (the id of a node, the source id of an edge).
+        """
+        if self.shards <= 1:
+            with self.open_output(file_path) as f:
+                lines = []
+                for record in records:
+                    extract_info(record)
+                    lines.extend(write_record(record))
+                    if len(lines) >= self.batch_lines:
+                        self.write_lines(f, lines)
+                        lines = []
+                self.write_lines(f, lines)
+
+                f.write("\n")
+            return
+
+        base = file_path[:-len(".metta")]
+        files = {}
+        chunks = defaultdict(list)
+        counts = Counter()
+        try:
+            for record in records:
+                extract_info(record)
+                shard = shard_of(record[0], self.shards)
+                lines = chunks[shard]
+                lines.extend(write_record(record))
+                counts[shard] += 1
+                if len(lines) >= self.batch_lines:
+                    if shard not in files:
+                        files[shard] = self.open_output(f"{base}.{shard}.metta")
+                    self.write_lines(files[shard], lines)
+                    chunks[shard] = []
+            for shard, lines in chunks.items():
+                if shard not in files:
+                    files[shard] = self.open_output(f"{base}.{shard}.metta")
+                self.write_lines(files[shard], lines)
+                files[shard].write("\n")
+        finally:
+            for f in files.values():
+                f.close()
+        self.add_shard_counts(pathlib.Path(file_path).parent,
+                              {pathlib.Path(self.output_file(f"{base}.{shard}.metta")).name: count
+                               for shard, count in counts.items()})
+
+    def add_shard_counts(self, directory, counts):
+        """
+        Add the record counts of the shard files of a directory to its shard counts file, from
+        which finalize writes the shard manifest.
+        """
+        path = directory / SHARD_COUNTS_FILE
+        total = Counter()
+        if path.exists():
+            with open(path) as f:
+                total.update(json.load(f))
+        total.update(counts)
+        with open(path, "w") as f:
+            json.dump(dict(total), f)
+
+    def merge_file(self, src, dest, move=False):
+        if src.name == SHARD_COUNTS_FILE and dest.exists():
+            with open(src) as f:
+                self.add_shard_counts(dest.parent, json.load(f))
+            return
+        super().merge_file(src, dest, move)
+
+    def finalize(self):
+        """
+        Write the manifest of the shard files of every output directory with sharded output and
+        the index of every output file.
+        """
+        for counts_path in sorted(self.output_path.rglob(SHARD_COUNTS_FILE)):
+            directory = counts_path.parent
+            if any(part.startswith(".") for part in directory.relative_to(self.output_path).parts):
+                continue
+            with open(counts_path) as f:
+                counts = json.load(f)
+            files = []
+            for name, records in sorted(counts.items(), key=lambda item: (item[0].split(".")[0], int(item[0].split(".")[1]))):
+                path = directory / name
+                files.append({
+                    "file": name,
+                    "kind": name.split(".")[0],
+                    "shard": int(name.split(".")[1]),
+                    "records": records,
+                    "bytes": path.stat().st_size,
+                    "sha256": file_sha256(path),
+                })
+            manifest = {"shard_count": self.shards, "hash": "crc32", "compression": self.compression.codec,
+                        "files": files}
+            with open(directory / SHARD_MANIFEST, "w") as f:
+                json.dump(manifest, f, indent=2)
+            counts_path.unlink()
+            logger.info(f"Wrote the shard manifest of {directory}")
+
+        if self.index:
+            count = write_indexes(self.output_path, ".metta", metta_key, exclude=("type_defs.metta",))
+            logger.info(f"Wrote the index of {count} output files")
+
+    def write_lines(self, file, lines):
+        """
+        Write a chunk of formatted lines with a single call
+        """
+        if lines:
+            file.write("\n".join(lines) + "\n")
+
     def write_node(self, node):
         id, label, properties = node
-        if "." in label:
-            label = label.split(".")[1]
-        def_out = f"({self.convert_input_labels(label)} {id})"
-        return self.write_property(def_out, properties)
+        return (self.node_formatters.get(label) or self.node_formatter(label))(id, properties)
 
     def write_edge(self, edge):
         source_id, target_id, label, properties = edge
+        return (self.edge_formatters.get(label) or self.edge_formatter(label))(source_id, target_id, properties)
+
+    def compile_node_formatter(self, label):
+        if "." in label:
+            label = label.split(".")[1]
+        head = self.convert_input_labels(label)
+        write_property = self.write_property
+
+        def format_node(id, properties):
+            return write_property(f"({head} {id})", properties)
+        return format_node
+
+    def compile_edge_formatter(self, label):
         label = label.lower()
         source_type = self.edge_node_types[label]["source"]
         target_type = self.edge_node_types[label]["target"]
         output_label = self.edge_node_types[label]["output_label"]
         if output_label is not None:
             label = output_label
-        if source_type == "ontology_term":
-            source_type = source_id.replace(':', '_').split('_')[0].lower()
-        if target_type == "ontology_term":
-            target_type = target_id.replace(':', '_').split('_')[0].lower()
-        def_out = f"({label} ({source_type} {source_id}) ({target_type} {target_id}))"
-        return self.write_property(def_out, properties)
+        source_is_term = source_type == "ontology_term"
+        target_is_term = target_type == "ontology_term"
+        write_property = self.write_property
 
+        def format_edge(source_id, target_id, properties):
+            source = source_id.replace(':', '_').split('_')[0].lower() if source_is_term else source_type
+            target = target_id.replace(':', '_').split('_')[0].lower() if target_is_term else target_type
+            return write_property(f"({label} ({source} {source_id}) ({target} {target_id}))", properties)
+        return format_edge
 
     def write_property(self, def_out, property):
         out_str = [def_out]
+        excluded = self.excluded_properties
+        escape = self.ESCAPE_TABLE
         for k, v in property.items():
-            if k in self.excluded_properties or v is None or v == "": continue
-            if k == 'biological_context':
+            if k in excluded or v is None or v == "": continue
+            # the exact types first, the most common by far, subclasses go through the checks below
+            kind = type(v)
+            if kind is str and k != 'biological_context':
+                if " " in v:
+                    v = v.replace(" ", "_").strip("_")
+                out_str.append(f'({k} {def_out} {v.translate(escape)})')
+            elif (kind is int or kind is float) and k != 'biological_context':
+                out_str.append(f'({k} {def_out} {v})')
+            elif k == 'biological_context':
                 try:
                     ontology_id = self.check_property(v).upper().replace('_', ':')
                     ontology_name = ontology_id.split(':')[0].lower()
@@ -157,12 +310,7 @@ class MeTTaWriter(BaseWriter):
                     print(f"An error occurred while processing the biological context '{v}': {e}.")
                     continue
             elif isinstance(v, list):
-                prop = "("
-                for i, e in enumerate(v):
-                    prop += f'{self.check_property(e)}'
-                    if i != len(v) - 1: prop += " "
-                prop += ")"
-                out_str.append(f'({k} {def_out} {prop})')
+                out_str.append(f'({k} {def_out} ({" ".join([f"{self.check_property(e)}" for e in v])}))')
             elif isinstance(v, dict):
                 prop = f"({k} {def_out})"
                 out_str.extend(self.write_property(prop, v))
@@ -170,14 +318,15 @@ class MeTTaWriter(BaseWriter):
                 out_str.append(f'({k} {def_out} {self.check_property(v)})')
         return out_str
 
+    # escape the parentheses and the escape character itself
+    ESCAPE_TABLE = str.maketrans({"(": "\\(", ")": "\\)", "\\": "\\\\"})
+
     def check_property(self, prop):
         if isinstance(prop, str):
             if " " in prop:
                 prop = prop.replace(" ", "_").strip("_")
 
-            special_chars = ["(", ")"]
-            escape_char = "\\"
-            return "".join(escape_char + c if c in special_chars or c == escape_char else c for c in prop)
+            return prop.translate(self.ESCAPE_TABLE)
 
         return prop
 
@@ -0,0 +1,327 @@
+"""
+Output for the offline bulk import of neo4j-admin (`neo4j-admin database import full`).
+
+Every node label gets a header file and a data file in each output directory, and every
+(edge label, source type, target type) group of edges gets one as well, since edges to
+ontology terms point to the ID space of the ontology the term belongs to. The header files
+hold the typed columns, the data files only rows, so that the data files of a label written
+by several adapters are imported together with one header. The columns are typed from the
+schema, inherited properties included, and the properties missing from the schema get a column
+typed after their first value. finalize writes
+neo4j-admin-import-call.sh, which imports every file of the output directory.
+"""
+from collections import Counter, defaultdict
+import csv
+import json
+import os
+import pathlib
+import stat
+
+from biocypher._logger import logger
+
+from biocypher_metta.compression import strip_suffix
+from biocypher_metta.neo4j_csv_writer import Neo4jCSVWriter
+from biocypher_metta.schema_cache import resolve_properties, schema_type_of
+
+IMPORT_SCRIPT = "neo4j-admin-import-call.sh"
+HEADER_SUFFIX = "-header.csv"
+
+# schema property type -> neo4j-admin column type
+COLUMN_TYPES = {
+    "str": "string",
+    "int": "long",
+    "float": "double",
+    "bool": "boolean",
+    "str[]": "string[]",
+    "int[]": "long[]",
+    "float[]": "double[]",
+}
+
+
+class Neo4jAdminWriter(Neo4jCSVWriter):
+    # the header of a data file is in its header file
+    header_row = False
+
+    def __init__(self, schema_config, biocypher_config, output_dir, compression=None, intern_provenance=False):
+        super().__init__(schema_config, biocypher_config, output_dir, compression, intern_provenance)
+        if self.compression.codec not in ("none", "gzip"):
+            raise ValueError("neo4j-admin import only reads plain or gzip compressed files")
+
+    def create_headers(self):
+        super().create_headers()
+        self.create_column_types()
+
+    def create_column_types(self):
+        """
+        neo4j-admin type of the property columns of every node and edge label, from the same
+        properties as the columns, strings for the properties the schema gives no type or a type
+        neo4j-admin has no column for.
+        """
+        self.node_types = {}
+        self.edge_types = {}
+        schema_properties = resolve_properties(self.schema["schema"])
+        for k, v in self.schema["schema"].items():
+            labels = v["input_label"] if isinstance(v["input_label"], list) else [v["input_label"]]
+            types = {prop: COLUMN_TYPES.get(str(t), "string") for prop, t in schema_properties[k].items()}
+            for label in labels:
+                label = self.convert_input_labels(label)
+                # a dict per label, columns_of adds the types of the properties missing from the schema
+                if v["represented_as"] == "node":
+                    self.node_types[label] = dict(types)
+                elif v["represented_as"] == "edge":
+                    self.edge_types[label] = dict(types)
+
+    def columns_of(self, headers, label, kind):
+        """
+        See Neo4jCSVWriter.columns_of, the columns added for the properties missing from the schema
+        are typed after their first value.
+        """
+        columns_for = super().columns_of(headers, label, kind)
+        types = (self.node_types if headers is self.node_headers else self.edge_types).setdefault(label, {})
+        typed = len(headers[label])
+
+        def typed_columns_for(properties):
+            nonlocal typed
+            columns = columns_for(properties)
+            if len(columns) != typed:
+                for column in columns[typed:]:
+                    types.setdefault(column, COLUMN_TYPES[schema_type_of(properties.get(column))])
+                typed = len(columns)
+            return columns
+        return typed_columns_for
+
+    def header_path(self, path):
+        """
+        Path of the header file of a data file.
+        """
+        name = pathlib.Path(strip_suffix(path)).name
+        return pathlib.Path(path).with_name(f"{name[:-len('.csv')]}{HEADER_SUFFIX}")
+
+    def read_header(self, path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0 or not self.header_path(path).exists():
+            return None
+        with open(self.header_path(path), newline='') as f:
+            return next(csv.reader(f, delimiter=self.csv_delimiter), None)
+
+    def write_header(self, path, header, writerow):
+        """
+        Write the header of the data file path to its header file.
+        """
+        with open(self.header_path(path), 'w', newline='') as f:
+            csv.writer(f, delimiter=self.csv_delimiter).writerow(header)
+
+    def remove_csv(self, path):
+        os.remove(path)
+        os.remove(self.header_path(path))
+
+    def column_header(self, column, types):
+        return f"{column}:{types.get(column, 'string')}"
+
+    def format_value(self, value, column_type):
+        if value is None or value == "":
+            return ""
+        if column_type.endswith("[]"):
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            return self.array_delimiter.join(str(self.format_value(e, column_type[:-2])) for e in values)
+        if column_type in ("long", "double"):
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return ""
+            return int(number) if column_type == "long" and number.is_integer() else number
+        if column_type == "boolean":
+            return str(value).lower() if isinstance(value, (bool, str)) else str(bool(value)).lower()
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return self.preprocess_value(value)
+
+    def node_header(self, label):
+        """
+        :return: function returning the current header of the nodes of label
+        """
+        columns = self.node_headers[label]
+        types = self.node_types[label]
+        return lambda: [f"id:ID({label})", *[self.column_header(column, types) for column in columns]]
+
+    def edge_header(self, label, source_type, target_type):
+        """
+        :return: function returning the current header of a (label, source type, target type) group of edges
+        """
+        columns = self.edge_headers[label]
+        types = self.edge_types[label]
+        return lambda: [f":START_ID({source_type})", f":END_ID({target_type})", ":TYPE",
+                        *[self.column_header(column, types) for column in columns]]
+
+    def compile_node_formatter(self, label):
+        """
+        :return: a function of the id and properties of a node returning its label and typed csv row
+        """
+        if "." in label:
+            label = label.split(".")[1]
+        label = label.lower()
+        columns_for = self.columns_of(self.node_headers, label, "Node")
+        column_type = self.node_types[label].get
+        preprocess_id = self.preprocess_id
+        format_value = self.format_value
+
+        def format_node(id, properties):
+            return label, [preprocess_id(id),
+                           *[format_value(properties.get(column), column_type(column, "string"))
+                             for column in columns_for(properties)]]
+        return format_node
+
+    def compile_edge_formatter(self, label):
+        """
+        :return: a function of the source id, target id and properties of an edge returning its
+            (label, source type, target type) group and typed csv row
+        """
+        label = label.lower()
+        source_type = self.edge_node_types[label]["source"]
+        target_type = self.edge_node_types[label]["target"]
+        output_label = self.edge_node_types[label]["output_label"] or label
+        source_is_term = source_type == 'ontology_term'
+        target_is_term = target_type == 'ontology_term'
+        group = (label, source_type, target_type)
+        columns_for = self.columns_of(self.edge_headers, label, "Edge")
+        column_type = self.edge_types[label].get
+        preprocess_id = self.preprocess_id
+        format_value = self.format_value
+
+        def format_edge(source_id, target_id, properties):
+            source_id = preprocess_id(source_id)
+            target_id = preprocess_id(target_id)
+            row = [source_id, target_id, output_label,
+                   *[format_value(properties.get(column), column_type(column, "string"))
+                     for column in columns_for(properties)]]
+            if not source_is_term and not target_is_term:
+                return group, row
+            return (label, source_id.split('_')[0] if source_is_term else source_type,
+                    target_id.split('_')[0] if target_is_term else target_type), row
+        return format_edge
+
+    def write_nodes(self, nodes, path_prefix=None, adapter_name=None):
+        if path_prefix:
+            output_dir = self.output_path / path_prefix
+        elif adapter_name:
+            output_dir = self.output_path / adapter_name
+        else:
+            output_dir = self.output_path
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        # label -> CSVOutput of its data file, opened at the first node of the label
+        files = {}
+        node_freq = Counter()
+        node_props = defaultdict(set)
+        formatters = self.node_formatters
+        try:
+            for node in nodes:
+                id, label, properties = node
+                label, row = (formatters.get(label) or self.node_formatter(label))(id, properties)
+                node_freq[label] += 1
+                node_props[label].update(properties.keys())
+
+                output = files.get(label)
+                if output is None:
+                    files[label] = output = self.open_csv(output_dir / f"nodes_{label}.csv", self.node_header(label))
+                output.writerow(row)
+        finally:
+            for output in files.values():
+                output.close()
+
+        logger.info(f"Finished writing out nodes for neo4j-admin import: {output_dir}")
+        return node_freq, node_props
+
+    def write_edges(self, edges, path_prefix=None, adapter_name=None):
+        if path_prefix:
+            output_dir = self.output_path / path_prefix
+        elif adapter_name:
+            output_dir = self.output_path / adapter_name
+        else:
+            output_dir = self.output_path
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        # (label, source type, target type) -> CSVOutput of its data file
+        files = {}
+        edges_freq = Counter()
+        formatters = self.edge_formatters
+        try:
+            for edge in edges:
+                source_id, target_id, label, properties = edge
+                group, row = (formatters.get(label) or self.edge_formatter(label))(source_id, target_id, properties)
+                edges_freq[group[0]] += 1
+
+                output = files.get(group)
+                if output is None:
+                    label, source_type, target_type = group
+                    files[group] = output = self.open_csv(output_dir / f"edges_{label}_{source_type}_{target_type}.csv",
+                                                          self.edge_header(*group))
+                output.writerow(row)
+        finally:
+            for output in files.values():
+                output.close()
+
+        logger.info(f"Finished writing out edges for neo4j-admin import: {output_dir}")
+        return edges_freq
+
+    def merge_file(self, src, dest, move=False):
+        # keep the header file of the first shard, the data files are merged by column name
+        if src.name.endswith(HEADER_SUFFIX):
+            # a header file is merged before its data file, the header of a data file of a previous
+            # build is replaced along with the data file
+            data = dest.with_name(self.output_file(dest.name[:-len(HEADER_SUFFIX)] + ".csv"))
+            if os.path.abspath(data) not in self.started_csv and dest.exists():
+                os.remove(dest)
+            if not dest.exists():
+                super(Neo4jCSVWriter, self).merge_file(src, dest, move)
+            return
+        super().merge_file(src, dest, move)
+
+    def import_groups(self):
+        """
+        :return: the node and edge groups of the output directory, as dicts of
+            name -> (header file, [data files]), with paths relative to the output directory
+        """
+        groups = {"nodes": {}, "edges": {}}
+        for header in sorted(self.output_path.rglob(f"*{HEADER_SUFFIX}")):
+            name = header.name[:-len(HEADER_SUFFIX)]
+            kind = name.split("_")[0]
+            if kind not in groups or any(part.startswith(".") for part in header.relative_to(self.output_path).parts):
+                continue
+            group = groups[kind].setdefault(name, [header.relative_to(self.output_path), []])
+            data = header.parent / f"{name}.csv{self.compression.suffix}"
+            if data.exists():
+                group[1].append(data.relative_to(self.output_path))
+        return groups
+
+    def finalize(self):
+        """
+        Write the neo4j-admin import command for every file of the output directory.
+        """
+        groups = self.import_groups()
+        lines = [
+            "#!/bin/bash",
+            "# Generated by biocypher_metta.neo4j_admin_writer, imports the output of the build",
+            "# into the database given as first argument (neo4j by default), replacing its content",
+            'cd "$(dirname "$0")"',
+            "neo4j-admin database import full \\",
+            f"    --delimiter='{self.csv_delimiter}' --array-delimiter='{self.array_delimiter}' --quote='\"' \\",
+            "    --skip-duplicate-nodes=true --skip-bad-relationships=true --multiline-fields=true \\",
+            "    --overwrite-destination=true \\",
+        ]
+        for kind, option in (("nodes", "--nodes"), ("edges", "--relationships")):
+            for name, (header, data) in sorted(groups[kind].items()):
+                if not data:
+                    continue
+                files = ",".join(path.as_posix() for path in [header, *data])
+                labels = ""
+                if kind == "nodes":
+                    label = name[len("nodes_"):]
+                    labels = f"{label}:ontology_term=" if label in self.ontologies else f"{label}="
+                lines.append(f"    {option}={labels}'{files}' \\")
+        lines.append('    "${1:-neo4j}"')
+
+        script = self.output_path / IMPORT_SCRIPT
+        with open(script, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        script.chmod(script.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        logger.info(f"Wrote the neo4j-admin import command to {script}")
@@ -1,29 +1,94 @@
 from collections import Counter, defaultdict
 import json
 import csv
+import os
+import pathlib
 from biocypher._logger import logger
 import networkx as nx
 import rdflib
 
-from biocypher_metta import BaseWriter
+from biocypher_metta import BaseWriter, DATASET_LABEL, DATASET_PROPERTIES
+from biocypher_metta.compression import open_text
+from biocypher_metta.schema_cache import resolve_properties
+
+# rows are read back when a csv file is rewritten or merged, property values can be long
+csv.field_size_limit(2 ** 31 - 1)
+
+
+def temporary_path(path, kind="tmp"):
+    """
+    Hidden sibling of an output file, with the same extensions.
+    """
+    return path.with_name(f".{kind}-{path.name}")
+
+
+class CSVOutput:
+    """
+    A csv file of a label opened for appending rows. The first CSVOutput of a file in a run replaces
+    the file of a previous build, the next ones (e.g. of adapters sharing an outdir) append to it.
+    The property columns of a label grow when a record has a property missing from the schema (see
+    Neo4jCSVWriter.columns_of), so close writes the final header and pads the rows written before
+    the columns grew. When the file already exists with its columns in another order, the rows are
+    written to a temporary file and merged into it by column name on close.
+    """
+    def __init__(self, writer, path, header):
+        """
+        :param path: path of the file, without the extension of the compression codec
+        :param header: function returning the current header of the label
+        """
+        self.writer = writer
+        self.header = header
+        self.path = pathlib.Path(writer.output_file(path))
+        self.target = None
+        written = None if writer.start_csv(self.path) else writer.read_header(self.path)
+        current = header()
+        if written is not None and written != current[:len(written)]:
+            self.target = self.path
+            self.path = temporary_path(self.path, "rows")
+            written = None
+        self.file = writer.compression.open(self.path, 'w' if written is None else 'a', newline='')
+        self.writerow = csv.writer(self.file, delimiter=writer.csv_delimiter).writerow
+        if written is None:
+            written = current
+            writer.write_header(self.path, written, self.writerow)
+        self.written = list(written)
+
+    def close(self):
+        self.file.close()
+        header = self.header()
+        if header != self.written:
+            logger.warning(f"The columns of {self.path} grew while it was written, rewriting it with the columns "
+                           f"{header[len(self.written):]}")
+            self.writer.rewrite_csv(self.path, header)
+        if self.target is not None:
+            self.writer.merge_csv(self.path, self.target)
+            self.writer.remove_csv(self.path)
+
 
 class Neo4jCSVWriter(BaseWriter):
-    def __init__(self, schema_config, biocypher_config, output_dir):
-        super().__init__(schema_config, biocypher_config, output_dir)
+    # the csv files start with their header row
+    header_row = True
+
+    def __init__(self, schema_config, biocypher_config, output_dir, compression=None, intern_provenance=False):
+        super().__init__(schema_config, biocypher_config, output_dir, compression, intern_provenance)
         self.csv_delimiter = '|'
         self.array_delimiter = ';'
 
         self.create_edge_types()
+        self.create_headers()
 
         self.excluded_properties = []
+        # absolute paths of the csv files written in this run, see start_csv
+        self.started_csv = set()
         self.translation_table = str.maketrans({self.csv_delimiter: '', 
                                                 self.array_delimiter: ' ', 
                                                 "'": "",
                                                 '"': ""})
         self.ontologies = set(['go', 'bto', 'efo', 'cl', 'clo', 'uberon'])
+        self.compile_formatters()
 
     def create_edge_types(self):
-        schema = self.bcy._get_ontology_mapping()._extend_schema()
+        schema = self.schema["schema"]
         self.edge_node_types = {}
 
         for k, v in schema.items():
@@ -51,6 +116,31 @@ class Neo4jCSVWriter(BaseWriter):
                         ),
                     }
     
+    def create_headers(self):
+        """
+        Property columns of the csv file of every node and edge label, from the properties the
+        schema declares for the label and the ones it inherits, so that the header is known before
+        the first row.
+        """
+        self.node_headers = {}
+        self.edge_headers = {}
+        schema_properties = resolve_properties(self.schema["schema"])
+        for k, v in self.schema["schema"].items():
+            labels = v["input_label"] if isinstance(v["input_label"], list) else [v["input_label"]]
+            properties = list(schema_properties[k])
+            for provenance in ("source", "source_url"):
+                if provenance not in properties:
+                    properties.append(provenance)
+            for label in labels:
+                label = self.convert_input_labels(label)
+                # a list per label, columns_of appends to it
+                if v["represented_as"] == "node":
+                    self.node_headers[label] = list(properties)
+                elif v["represented_as"] == "edge":
+                    self.edge_headers[label] = list(properties)
+        # the dataset nodes of interned provenance, see BaseWriter.write_datasets
+        self.node_headers.setdefault(DATASET_LABEL, list(DATASET_PROPERTIES))
+
     def preprocess_value(self, value):
         value_type = type(value)
         
@@ -69,32 +159,180 @@ class Neo4jCSVWriter(BaseWriter):
         """Convert input labels to a standard format."""
         return label.lower().replace(" ", "_")
 
+    ID_TABLE = str.maketrans({' ': '_', ':':'_'})
+
     def preprocess_id(self, prev_id):
-        replace_map = str.maketrans({' ': '_', ':':'_'})
-        id = prev_id.lower().strip().translate(replace_map)
+        id = prev_id.lower().strip().translate(self.ID_TABLE)
         return id
+
+    def normalize_id(self, id):
+        return self.preprocess_id(id)
     
-    def write_chunk(self, chunk, headers, file_path, csv_delimiter, preprocess_value):
-        with open(file_path, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=csv_delimiter)
-            for row in chunk:
-                processed_row = [preprocess_value(row.get(header, '')) for header in headers]
-                writer.writerow(processed_row)
-            csvfile.flush()
-
-    def write_to_csv(self, data, file_path, chunk_size=1000):
-        headers = list(data[0].keys())
-        
-        # Write headers
-        with open(file_path, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=self.csv_delimiter)
-            writer.writerow(headers)
-            csvfile.flush()  # Ensure headers are written to disk
-        
-        # Process and write data in chunks
-        for i in range(0, len(data), chunk_size):
-            chunk = data[i:i+chunk_size]
-            self.write_chunk(chunk, headers, file_path, self.csv_delimiter, self.preprocess_value)
+    def merge_file(self, src, dest, move=False):
+        # The cypher queries reference the csv file by its absolute path, point them to the merged file
+        if src.suffix == '.cypher':
+            query = src.read_text().replace(src.parent.resolve().as_posix(), dest.parent.resolve().as_posix())
+            with open(dest, 'w') as f:
+                f.write(query)
+            return
+
+        # the first shard merged into a csv file in this run replaces the file of a previous build
+        if '.csv' in src.suffixes and self.start_csv(dest) and dest.exists():
+            os.remove(dest)
+
+        if move and not dest.exists():
+            os.replace(src, dest)
+            return
+
+        # Only keep the header row of the first shard written to a csv file, matching the columns by name
+        if '.csv' in src.suffixes and self.read_header(dest) is not None:
+            self.merge_csv(src, dest)
+            return
+        super().merge_file(src, dest, move)
+
+    def open_csv(self, file_path, header):
+        """
+        Open the csv file for appending rows, writing the header row if the file is new.
+        :param header: function returning the current header of the label
+        :return: CSVOutput of the file
+        """
+        return CSVOutput(self, file_path, header)
+
+    def start_csv(self, path):
+        """
+        Record that the csv file path is written in this run.
+        :return: True at the first write of the file in this run, which replaces the file of a
+            previous build into the same output directory
+        """
+        key = os.path.abspath(path)
+        if key in self.started_csv:
+            return False
+        self.started_csv.add(key)
+        return True
+
+    def read_header(self, path):
+        """
+        :return: the header of a csv output file, None if the file is missing or empty
+        """
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open_text(path, newline='') as f:
+            return next(csv.reader(f, delimiter=self.csv_delimiter), None)
+
+    def write_header(self, path, header, writerow):
+        """
+        Write the header of the csv file path, as its first row.
+        """
+        writerow(header)
+
+    def remove_csv(self, path):
+        os.remove(path)
+
+    def csv_rows(self, f):
+        """
+        The data rows of an open csv file.
+        """
+        reader = csv.reader(f, delimiter=self.csv_delimiter)
+        if self.header_row:
+            next(reader, None)
+        return reader
+
+    def rewrite_csv(self, path, header):
+        """
+        Rewrite the csv file path under header, whose columns extend the columns of its rows.
+        """
+        tmp_path = temporary_path(path)
+        with open_text(path, newline='') as fin, self.compression.open(tmp_path, 'w', newline='') as fout:
+            writerow = csv.writer(fout, delimiter=self.csv_delimiter).writerow
+            self.write_header(path, header, writerow)
+            for row in self.csv_rows(fin):
+                writerow(row + [''] * (len(header) - len(row)))
+        os.replace(tmp_path, path)
+
+    def merge_csv(self, src, dest):
+        """
+        Append the rows of the csv file src to the csv file dest, matching their columns by name
+        when the headers of the files differ. The columns only src has are added to dest.
+        """
+        src_header = self.read_header(src) or []
+        dest_header = self.read_header(dest)
+        header = dest_header + [column for column in src_header if column not in dest_header]
+        if header != dest_header:
+            self.rewrite_csv(dest, header)
+        with open_text(src, newline='') as fin, self.compression.open(dest, 'a', newline='') as fout:
+            if src_header == header:
+                # the same columns, copy the lines
+                if self.header_row:
+                    next(fin, None)
+                for line in fin:
+                    fout.write(line)
+                return
+            index = {column: i for i, column in enumerate(src_header)}
+            positions = [index.get(column) for column in header]
+            writerow = csv.writer(fout, delimiter=self.csv_delimiter).writerow
+            for row in self.csv_rows(fin):
+                writerow(['' if i is None or i >= len(row) else row[i] for i in positions])
+
+    def columns_of(self, headers, label, kind):
+        """
+        :return: a function of the properties of a record of the label returning the property columns
+            of the label. The properties missing from the schema are added as columns, so the columns
+            of a label only grow, see CSVOutput.
+        """
+        columns = headers.get(label)
+        if columns is None:
+            logger.warning(f"{kind} label {label} is not in the schema, using the properties of its records as columns")
+            columns = headers[label] = []
+        known = set(columns)
+
+        def columns_for(properties):
+            if not known.issuperset(properties):
+                for key in properties:
+                    if key not in known:
+                        known.add(key)
+                        columns.append(key)
+                        logger.warning(f"Property {key} of {label} is not in the schema, adding it as a column")
+            return columns
+        return columns_for
+
+    def compile_node_formatter(self, label):
+        """
+        :return: a function of the id and properties of a node returning its label and csv row
+        """
+        if "." in label:
+            label = label.split(".")[1]
+        label = label.lower()
+        columns_for = self.columns_of(self.node_headers, label, "Node")
+        preprocess_id = self.preprocess_id
+        preprocess_value = self.preprocess_value
+
+        def format_node(id, properties):
+            return label, [preprocess_id(id), label,
+                           *[preprocess_value(properties.get(column, '')) for column in columns_for(properties)]]
+        return format_node
+
+    def compile_edge_formatter(self, label):
+        """
+        :return: a function of the source id, target id and properties of an edge returning its
+            label and csv row
+        """
+        label = label.lower()
+        source_type = self.edge_node_types[label]["source"]
+        target_type = self.edge_node_types[label]["target"]
+        output_label = self.edge_node_types[label]["output_label"] or label
+        source_is_term = source_type == 'ontology_term'
+        target_is_term = target_type == 'ontology_term'
+        columns_for = self.columns_of(self.edge_headers, label, "Edge")
+        preprocess_id = self.preprocess_id
+        preprocess_value = self.preprocess_value
+
+        def format_edge(source_id, target_id, properties):
+            source_id = preprocess_id(source_id)
+            target_id = preprocess_id(target_id)
+            return label, [source_id.split('_')[0] if source_is_term else source_type, source_id,
+                           target_id.split('_')[0] if target_is_term else target_type, target_id, output_label,
+                           *[preprocess_value(properties.get(column, '')) for column in columns_for(properties)]]
+        return format_edge
 
     def write_nodes(self, nodes, path_prefix=None, adapter_name=None):
         # Determine the output directory based on the given parameters
@@ -108,34 +346,38 @@ class Neo4jCSVWriter(BaseWriter):
         # Ensure the output directory exists
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        # Prepare node data for CSV
-        node_groups = {}
+        # label -> CSVOutput, opened at the first node of the label
+        files = {}
         node_freq = Counter()
         node_props = defaultdict(set)
-        for node in nodes:
-            id, label, properties = node
-            if "." in label:
-                label = label.split(".")[1]
-            label = label.lower()
-            node_freq[label] += 1
-            node_props[label] = node_props[label].union(properties.keys())
-                 
-            if label not in node_groups:
-                node_groups[label] = []
-            id = self.preprocess_id(id)
-            node_groups[label].append({'id': id, 'label': label, **properties})
-
-        # Write node data to CSV and generate Cypher queries
-        for label, node_data in node_groups.items():
-            csv_file_path = output_dir / f"nodes_{label}.csv"
-            cypher_file_path = output_dir / f"nodes_{label}.cypher"
-            self.write_to_csv(node_data, csv_file_path)
-
-            # Generate Cypher query for loading nodes
-            absolute_path = csv_file_path.resolve().as_posix()
-            additional_label = ":ontology_term" if label in self.ontologies else ""
-            with open(cypher_file_path, 'w') as f:
-                cypher_query = f"""
+        formatters = self.node_formatters
+        try:
+            for node in nodes:
+                id, label, properties = node
+                label, row = (formatters.get(label) or self.node_formatter(label))(id, properties)
+                node_freq[label] += 1
+                node_props[label].update(properties.keys())
+
+                output = files.get(label)
+                if output is None:
+                    csv_file_path = output_dir / f"nodes_{label}.csv"
+                    columns = self.node_headers[label]
+                    files[label] = output = self.open_csv(csv_file_path, lambda columns=columns: ['id', 'label', *columns])
+                    self.write_node_query(label, csv_file_path, output_dir / f"nodes_{label}.cypher")
+                output.writerow(row)
+        finally:
+            for output in files.values():
+                output.close()
+
+        logger.info(f"Finished writing out all node import queries for: {output_dir}")
+        return node_freq, node_props
+
+    def write_node_query(self, label, csv_file_path, cypher_file_path):
+        # Generate Cypher query for loading nodes
+        absolute_path = pathlib.Path(self.output_file(csv_file_path)).resolve().as_posix()
+        additional_label = ":ontology_term" if label in self.ontologies else ""
+        with open(cypher_file_path, 'w') as f:
+            cypher_query = f"""
 CREATE CONSTRAINT IF NOT EXISTS FOR (n:{label}) REQUIRE n.id IS UNIQUE;
 
 CALL apoc.periodic.iterate(
@@ -147,10 +389,7 @@ CALL apoc.periodic.iterate(
 YIELD batches, total
 RETURN batches, total;
                 """
-                f.write(cypher_query)
-
-        logger.info(f"Finished writing out all node import queries for: {output_dir}")
-        return node_freq, node_props
+            f.write(cypher_query)
 
     def write_edges(self, edges, path_prefix=None, adapter_name=None):
         # Determine the output directory based on the given parameters
@@ -164,49 +403,38 @@ RETURN batches, total;
         # Ensure the output directory exists
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        # Group edges by their label
-        edge_groups = {}
+        # label -> CSVOutput, opened at the first edge of the label
+        files = {}
         edges_freq = Counter()
-        for edge in edges:
-            source_id, target_id, label, properties = edge
-            label = label.lower()
-            edges_freq[label] += 1
-            source_type = self.edge_node_types[label]["source"]
-            target_type = self.edge_node_types[label]["target"]
-            if source_type == 'ontology_term':
-                source_type = self.preprocess_id(source_id).split('_')[0]
-            if target_type == 'ontology_term':
-                target_type = self.preprocess_id(target_id).split('_')[0]
-            output_label = self.edge_node_types[label]["output_label"]
-            if output_label is None:
-                output_label = label
-            if label not in edge_groups:
-                edge_groups[label] = []
-            edge_groups[label].append({
-                'source_type': source_type,
-                'source_id': self.preprocess_id(source_id),
-                'target_type': target_type,
-                'target_id': self.preprocess_id(target_id),
-                'label': output_label,
-                **properties
-            })
-
-        # Process each edge type separately
-        for label, edge_data in edge_groups.items():
-            # File paths for CSV and Cypher files
-            csv_file_path = output_dir / f"edges_{label}.csv"
-            cypher_file_path = output_dir / f"edges_{label}.cypher"
-
-            output_label = self.edge_node_types[label]["output_label"]
-            if output_label is not None:
-                label = output_label
-            # Write edge data to CSV
-            self.write_to_csv(edge_data, csv_file_path)
-
-            # Generate Cypher query to load edges from the CSV file using the absolute path
-            absolute_path = csv_file_path.resolve().as_posix()
-            with open(cypher_file_path, 'w') as f:
-                cypher_query = f"""
+        formatters = self.edge_formatters
+        try:
+            for edge in edges:
+                source_id, target_id, label, properties = edge
+                label, row = (formatters.get(label) or self.edge_formatter(label))(source_id, target_id, properties)
+                edges_freq[label] += 1
+
+                output = files.get(label)
+                if output is None:
+                    csv_file_path = output_dir / f"edges_{label}.csv"
+                    columns = self.edge_headers[label]
+                    files[label] = output = self.open_csv(
+                        csv_file_path,
+                        lambda columns=columns: ['source_type', 'source_id', 'target_type', 'target_id', 'label', *columns])
+                    output_label = self.edge_node_types[label]["output_label"] or label
+                    self.write_edge_query(output_label, csv_file_path, output_dir / f"edges_{label}.cypher")
+                output.writerow(row)
+        finally:
+            for output in files.values():
+                output.close()
+
+        logger.info(f"Finished writing out all edge import queries for: {output_dir}")
+        return edges_freq
+
+    def write_edge_query(self, label, csv_file_path, cypher_file_path):
+        # Generate Cypher query to load edges from the CSV file using the absolute path
+        absolute_path = pathlib.Path(self.output_file(csv_file_path)).resolve().as_posix()
+        with open(cypher_file_path, 'w') as f:
+            cypher_query = f"""
 CALL apoc.periodic.iterate(
     "LOAD CSV WITH HEADERS FROM 'file:///{absolute_path}' AS row FIELDTERMINATOR '{self.csv_delimiter}' RETURN row",
     "MATCH (source:row.source_type {{id: row.source_id}})
@@ -218,7 +446,4 @@ CALL apoc.periodic.iterate(
 YIELD batches, total
 RETURN batches, total;
                 """
-                f.write(cypher_query)
-
-        logger.info(f"Finished writing out all edge import queries for: {output_dir}")
-        return edges_freq
\ No newline at end of file
+            f.write(cypher_query)
@@ -1,22 +1,70 @@
-import pathlib
-import os
+import json
 from biocypher._logger import logger
 import networkx as nx
 
 from biocypher_metta import BaseWriter
 
+PARAMS_SUFFIX = ".jsonl"
+
+
+class BatchFiles:
+    """
+    The batches of rows of the groups of statements written by a Neo4jWriter call. Every group has
+    a .cypher file holding its statements, which read the rows of a batch as $rows, and a .jsonl
+    file holding the parameters of one batch per line.
+    """
+    def __init__(self, writer, output_dir):
+        self.writer = writer
+        self.output_dir = output_dir
+        # group name -> (params file, rows of the current batch)
+        self.groups = {}
+
+    def add(self, name, write_query, query_args, row):
+        group = self.groups.get(name)
+        if group is None:
+            with open(self.output_dir / f"{name}.cypher", "w") as f:
+                write_query(f, query_args)
+            group = (self.writer.open_output(self.output_dir / f"{name}{PARAMS_SUFFIX}"), [])
+            self.groups[name] = group
+        file, rows = group
+        rows.append(row)
+        if len(rows) >= self.writer.batch_size:
+            self.flush(file, rows)
+
+    def flush(self, file, rows):
+        if rows:
+            file.write(json.dumps({"rows": rows}, default=str) + "\n")
+            rows.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for file, rows in self.groups.values():
+            try:
+                if exc_type is None:
+                    self.flush(file, rows)
+            finally:
+                file.close()
+
 
 class Neo4jWriter(BaseWriter):
 
-    def __init__(self, schema_config, biocypher_config, output_dir):
-        super().__init__(schema_config, biocypher_config, output_dir)
+    def __init__(self, schema_config, biocypher_config, output_dir, compression=None, batch_size=10000,
+                 intern_provenance=False):
+        """
+        :param batch_size: number of rows in the parameters of a batched statement
+        """
+        super().__init__(schema_config, biocypher_config, output_dir, compression, intern_provenance)
+        self.batch_size = batch_size
 
         self.create_edge_types()
 
         self.excluded_properties = []
+        self.compile_formatters()
 
     def create_edge_types(self):
-        schema = self.bcy._get_ontology_mapping()._extend_schema()
+        schema = self.schema["schema"]
         self.edge_node_types = {}
 
         for k, v in schema.items():
@@ -48,107 +96,136 @@ class Neo4jWriter(BaseWriter):
                     }
 
     def write_nodes(self, nodes, path_prefix=None, create_dir=True):
-        if path_prefix is not None:
-            file_path = f"{self.output_path}/{path_prefix}/nodes.cypher"
-            if create_dir:
-                if not os.path.exists(f"{self.output_path}/{path_prefix}"):
-                    pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(
-                        parents=True, exist_ok=True
-                    )
-        else:
-            file_path = f"{self.output_path}/nodes.cypher"
-
-        with open(file_path, "a") as f:
+        output_dir = self.output_dir_for(path_prefix, create_dir)
+        with BatchFiles(self, output_dir) as batches:
             for node in nodes:
                 self.extract_node_info(node)
-                    
-                query = self.write_node(node)
-                f.write(query + "\n")
+                id, label, properties = node
+                batches.add(*(self.node_formatters.get(label) or self.node_formatter(label))(id, properties))
 
         logger.info("Finished writing out nodes")
         return self.node_freq, self.node_props
 
     def write_edges(self, edges, path_prefix=None, create_dir=True):
-        if path_prefix is not None:
-            file_path = f"{self.output_path}/{path_prefix}/edges.cypher"
-            if create_dir:
-                if not os.path.exists(f"{self.output_path}/{path_prefix}"):
-                    pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(
-                        parents=True, exist_ok=True
-                    )
-        else:
-            file_path = f"{self.output_path}/edges.cypher"
-
-        with open(file_path, "a") as f:
+        output_dir = self.output_dir_for(path_prefix, create_dir)
+        with BatchFiles(self, output_dir) as batches:
             for edge in edges:
                 self.extract_edge_info(edge)
-                query = self.write_edge(edge)
-                f.write(query + "\n")
+                source_id, target_id, label, properties = edge
+                batches.add(*(self.edge_formatters.get(label) or self.edge_formatter(label))(
+                    source_id, target_id, properties))
 
         logger.info("Finished writing out edges")
         return self.edge_freq
-    
-    def write_node(self, node):
-        id, label, properties = node
+
+    def normalize_id(self, id):
+        return id.lower()
+
+    def compile_node_formatter(self, label):
+        """
+        :return: a function of the id and properties of a node returning the arguments of BatchFiles.add
+        """
         if "." in label:
             label = label.split(".")[1]
         label = label.lower()
-        id = id.lower()
-        properties_str = self._format_properties(properties)
-        return f'MERGE (:{label} {{id: "{id}", {properties_str}}})'
+        name = f"nodes_{label}"
+        write_query = self.write_node_query
+        convert_properties = self._convert_properties
+
+        def format_node(id, properties):
+            return name, write_query, label, {"id": id.lower(), "properties": convert_properties(properties)}
+        return format_node
 
-    def write_edge(self, edge):
-        source_id, target_id, label, properties = edge
+    def compile_edge_formatter(self, label):
+        """
+        :return: a function of the source id, target id and properties of an edge returning the
+            arguments of BatchFiles.add
+        """
         label = label.lower()
-        source_id = source_id.lower()
-        target_id = target_id.lower()
         source_type = self.edge_node_types[label]["source"]
         target_type = self.edge_node_types[label]["target"]
-        output_label = self.edge_node_types[label]["output_label"]
-        if output_label is not None:
-            label = output_label
-        properties_str = self._format_properties(properties)
-        return (
-            f"MATCH (a:{source_type}) "
-            f"WITH a "
-            f"MATCH (b:{target_type}) "
-            f'WHERE a.id = "{source_id}" AND b.id = "{target_id}" '
-            f"MERGE (a)-[:{label} {{ {properties_str} }}]->(b);"
+        output_label = self.edge_node_types[label]["output_label"] or label
+        source_is_term = source_type == "ontology_term"
+        target_is_term = target_type == "ontology_term"
+        name = f"edges_{label}_{source_type}_{target_type}"
+        query_args = (output_label, source_type, target_type)
+        write_query = self.write_edge_query
+        convert_properties = self._convert_properties
+        ontology_of = self.ontology_of
+
+        def format_edge(source_id, target_id, properties):
+            source_id = source_id.lower()
+            target_id = target_id.lower()
+            row = {"source_id": source_id, "target_id": target_id, "properties": convert_properties(properties)}
+            if not source_is_term and not target_is_term:
+                return name, write_query, query_args, row
+            source = ontology_of(source_id) if source_is_term else source_type
+            target = ontology_of(target_id) if target_is_term else target_type
+            return f"edges_{label}_{source}_{target}", write_query, (output_label, source, target), row
+        return format_edge
+
+    def output_dir_for(self, path_prefix, create_dir=True):
+        if path_prefix is None:
+            return self.output_path
+        output_dir = self.output_path / path_prefix
+        if create_dir:
+            output_dir.mkdir(parents=True, exist_ok=True)
+        return output_dir
+
+    def ontology_of(self, id):
+        """
+        The ontology, i.e. the node label, of an ontology term id such as go:0008150.
+        """
+        return id.replace(":", "_").split("_")[0]
+
+    def write_node_query(self, file, label):
+        file.write(f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:`{label}`) REQUIRE n.id IS UNIQUE;\n")
+        file.write(
+            f"UNWIND $rows AS row "
+            f"MERGE (n:`{label}` {{id: row.id}}) "
+            f"SET n += row.properties;\n"
         )
 
-    def _format_properties(self, properties):
+    def write_edge_query(self, file, group):
+        label, source_type, target_type = group
+        # the relationship of a source, target and label is merged as in the csv writers, the
+        # properties of a later edge are set on it instead of creating another relationship
+        file.write(
+            f"UNWIND $rows AS row "
+            f"MATCH (a:`{source_type}` {{id: row.source_id}}) "
+            f"MATCH (b:`{target_type}` {{id: row.target_id}}) "
+            f"CALL apoc.merge.relationship(a, '{label}', {{}}, row.properties, b, row.properties) YIELD rel "
+            f"RETURN count(rel) AS total;\n"
+        )
+
+    def _convert_properties(self, properties):
         """
-        Format properties into a Cypher string.
-        :param properties: Dictionary of properties
-        :return: Cypher formatted properties string
+        The properties of a node or edge as a parameter map. Neo4j properties can't hold maps, so
+        nested dicts are stored as JSON strings.
         """
-        out_str = []
+        out = {}
+        excluded = self.excluded_properties
         for k, v in properties.items():
-            if k in self.excluded_properties or v is None or v == "":
+            if k in excluded or v is None or v == "":
                 continue
-            
-            if isinstance(v, list):
-                formatted_list = []
-                for e in v:
-                    if isinstance(e, str):
-                        cleaned_str = e.replace('"', '').replace("'", "")
-                        formatted_list.append(f'"{cleaned_str}"')
-                    else:
-                        formatted_list.append(str(e))
-                prop = "[" + ", ".join(formatted_list) + "]"
-            elif isinstance(v, dict):
-                prop = "{" + self._format_properties(v) + "}"
-            elif isinstance(v, str):
-                cleaned_str = v.replace('"', '').replace("'", "")
-                prop = f'"{cleaned_str}"'
-            elif isinstance(v, int) or isinstance(v, float):
-                prop = v
-            else:
-                prop = v
-        
-            out_str.append(f"{k}: {prop}")
-        
-        return ", ".join(out_str)
+            kind = type(v)
+            out[k] = v if kind is str or kind is int or kind is float else self._convert_value(v)
+        return out
+
+    def _convert_value(self, value):
+        if isinstance(value, dict):
+            return json.dumps(value, default=str)
+        if isinstance(value, (list, tuple, set)):
+            return [self._convert_value(e) for e in value]
+        if isinstance(value, (str, bool, int, float)):
+            return value
+        return str(value)
+
+    def merge_file(self, src, dest, move=False):
+        # every shard writes the same statements for a group, keep the first one
+        if src.suffix == ".cypher" and dest.exists():
+            return
+        super().merge_file(src, dest, move)
 
     def convert_input_labels(self, label, replace_char="_"):
         """
@@ -0,0 +1,304 @@
+"""
+Byte-offset sidecar indexes of the MeTTa and Prolog output, for point lookups of the atoms or
+clauses of an entity without loading or grepping the whole output.
+
+The index of an output file, <file>.idx, maps every node id (for the lines of a node and of its
+properties) and every edge source id (for the lines of an edge and of its properties) to the byte
+ranges of its lines in the file. It is a sorted array, searched with a binary search over a
+memory map of the index:
+
+    header: magic, number of keys, number of ranges
+    keys: for every key and a final sentinel, the offset of the key in the key data and the index
+        of its first range, little-endian unsigned 64-bit integers
+    ranges: offset and length in the output file of every run of consecutive lines of a key
+    key data: the UTF-8 keys, in byte order
+
+The entries are sorted with an external sort, so building the index of a file larger than memory
+keeps memory bounded.
+"""
+import mmap
+import os
+import pathlib
+import re
+import shutil
+import struct
+import tempfile
+
+from biocypher_metta.external_sort import DEFAULT_RUN_LINES, external_sort
+
+INDEX_SUFFIX = ".idx"
+MAGIC = b"BCMIDX01"
+HEADER = struct.Struct("<8sQQ")
+ENTRY = struct.Struct("<QQ")
+
+# keys can't hold the separator of the sorted entries or characters sorting before it
+UNINDEXABLE = re.compile(rb"[\x00-\x09]")
+
+
+def _innermost_group(line):
+    """
+    The first innermost parenthesized group of a line, which holds the node of a node line, the
+    node of a property line and the source of an edge line, e.g. gene x for (name (gene x) y).
+    """
+    end = line.find(b")")
+    if end < 0:
+        return None
+    start = line.rfind(b"(", 0, end)
+    return line[start + 1:end] if start >= 0 else None
+
+
+def metta_key(line):
+    """
+    :return: the id of the node or edge source of a MeTTa line, None for lines without one
+    """
+    group = _innermost_group(line)
+    if group is None:
+        return None
+    _, sep, key = group.partition(b" ")
+    if not sep or not key or UNINDEXABLE.search(key):
+        return None
+    return key.decode("utf-8")
+
+
+def prolog_key(line):
+    """
+    :return: the id of the node or edge source of a Prolog clause, None for lines without one
+    """
+    key = _innermost_group(line)
+    if not key or UNINDEXABLE.search(key):
+        return None
+    return key.decode("utf-8")
+
+
+def prolog_query(id):
+    """
+    The key of an id in the Prolog output, which sanitizes the ids.
+    """
+    # prolog_writer imports this module
+    from biocypher_metta.prolog_writer import sanitize_string
+    return sanitize_string(id.lower())
+
+
+def index_path(path):
+    path = pathlib.Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def build_index(path, key_of, run_lines=DEFAULT_RUN_LINES):
+    """
+    Write the sidecar index of an uncompressed output file.
+    :param key_of: function of a line of the file, as bytes, returning its key or None
+    :return: number of keys of the index
+    """
+    path = pathlib.Path(path)
+    with tempfile.TemporaryDirectory(prefix=".index-", dir=path.parent) as work_dir:
+        work_dir = pathlib.Path(work_dir)
+        entries = work_dir / "entries"
+        with open(path, "rb") as f, open(entries, "w", encoding="utf-8", newline="") as out:
+            offset = 0
+            for line in f:
+                key = key_of(line)
+                if key is not None:
+                    out.write(f"{key}\t{offset:016x}\t{len(line):x}\n")
+                offset += len(line)
+        # sorted on the key, then on the zero-padded offset
+        external_sort(entries, entries, run_lines)
+
+        key_count = 0
+        range_count = 0
+        blob_size = 0
+        with open(entries, encoding="utf-8", newline="") as f, \
+                open(work_dir / "keys", "wb") as keys, \
+                open(work_dir / "ranges", "wb") as ranges, \
+                open(work_dir / "blob", "wb") as blob:
+            last_key = None
+            start = end = None
+            for line in f:
+                key, offset, length = line.rstrip("\n").split("\t")
+                offset = int(offset, 16)
+                length = int(length, 16)
+                if key == last_key and offset == end:
+                    end += length
+                    continue
+                if start is not None:
+                    ranges.write(ENTRY.pack(start, end - start))
+                    range_count += 1
+                if key != last_key:
+                    data = key.encode("utf-8")
+                    keys.write(ENTRY.pack(blob_size, range_count))
+                    blob.write(data)
+                    blob_size += len(data)
+                    key_count += 1
+                    last_key = key
+                start, end = offset, offset + length
+            if start is not None:
+                ranges.write(ENTRY.pack(start, end - start))
+                range_count += 1
+            keys.write(ENTRY.pack(blob_size, range_count))
+
+        tmp_path = work_dir / "index"
+        with open(tmp_path, "wb") as out:
+            out.write(HEADER.pack(MAGIC, key_count, range_count))
+            for part in ("keys", "ranges", "blob"):
+                with open(work_dir / part, "rb") as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+        os.replace(tmp_path, index_path(path))
+    return key_count
+
+
+def write_indexes(output_dir, suffix, key_of, exclude=()):
+    """
+    Write the sidecar index of every output file with suffix under output_dir, skipping the hidden
+    directories (the shards of the build) and the files named in exclude.
+    :return: number of indexed files
+    """
+    output_dir = pathlib.Path(output_dir)
+    count = 0
+    for path in sorted(output_dir.rglob(f"*{suffix}")):
+        relative = path.relative_to(output_dir)
+        if path.name in exclude or any(part.startswith(".") for part in relative.parts[:-1]):
+            continue
+        build_index(path, key_of)
+        count += 1
+    return count
+
+
+class OutputIndex:
+    """
+    Reader of the sidecar index of an output file.
+
+    with OutputIndex("output/gencode/nodes.metta") as index:
+        lines = index.lines("ENSG00000290825")
+    """
+    def __init__(self, path, query=None):
+        """
+        :param path: path of the output file, whose index is <path>.idx
+        :param query: function turning an id into the key of the file, prolog_query for the Prolog
+            output, by default for .pl files
+        """
+        self.path = pathlib.Path(path)
+        self.query = query if query is not None else (prolog_query if self.path.suffix == ".pl" else None)
+        self._output = None
+        self._index = open(index_path(self.path), "rb")
+        self._map = mmap.mmap(self._index.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.key_count, self.range_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{index_path(self.path)} is not an output index")
+        self._keys_at = HEADER.size
+        self._ranges_at = self._keys_at + (self.key_count + 1) * ENTRY.size
+        self._blob_at = self._ranges_at + self.range_count * ENTRY.size
+
+    def __len__(self):
+        return self.key_count
+
+    def __contains__(self, id):
+        return self.find(id) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._index.close()
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._map, self._keys_at + i * ENTRY.size)
+
+    def key(self, i):
+        start, _ = self._entry(i)
+        end, _ = self._entry(i + 1)
+        return self._map[self._blob_at + start:self._blob_at + end]
+
+    def keys(self):
+        for i in range(self.key_count):
+            yield self.key(i).decode("utf-8")
+
+    def find(self, id):
+        """
+        :return: the position of the key of id in the index, None if it has no lines
+        """
+        key = self.query(id) if self.query is not None else id
+        if not key:
+            return None
+        key = key.encode("utf-8")
+        lo, hi = 0, self.key_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.key_count and self.key(lo) == key else None
+
+    def ranges(self, id):
+        """
+        :return: the (offset, length) byte ranges of the lines of id in the output file
+        """
+        i = self.find(id)
+        if i is None:
+            return []
+        _, first = self._entry(i)
+        _, last = self._entry(i + 1)
+        return [ENTRY.unpack_from(self._map, self._ranges_at + r * ENTRY.size) for r in range(first, last)]
+
+    def lines(self, id):
+        """
+        :return: the lines of id in the output file, the atoms or clauses of a node or of the edges
+            it is the source of
+        """
+        if self._output is None:
+            self._output = open(self.path, "rb")
+        lines = []
+        for offset, length in self.ranges(id):
+            self._output.seek(offset)
+            lines.extend(self._output.read(length).decode("utf-8").splitlines())
+        return lines
+
+
+class GraphIndex:
+    """
+    Reader of the sidecar indexes of every output file of an output directory.
+    """
+    def __init__(self, output_dir):
+        output_dir = pathlib.Path(output_dir)
+        self.indexes = []
+        for path in sorted(output_dir.rglob(f"*{INDEX_SUFFIX}")):
+            if any(part.startswith(".") for part in path.relative_to(output_dir).parts[:-1]):
+                continue
+            self.indexes.append(OutputIndex(path.with_suffix("")))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for index in self.indexes:
+            index.close()
+
+    def lines(self, id):
+        """
+        :return: the lines of id in every output file
+        """
+        return [line for index in self.indexes for line in index.lines(id)]
+
+    def extract(self, ids, out):
+        """
+        Write the lines of the nodes and edge sources ids to the text file out, a subgraph of the
+        output that can be loaded on its own.
+        :return: number of lines written
+        """
+        count = 0
+        for id in ids:
+            for line in self.lines(id):
+                out.write(line + "\n")
+                count += 1
+        return count
@@ -0,0 +1,453 @@
+"""
+Columnar output of the knowledge graph as Parquet files, for analytics that filter by column
+instead of parsing the text formats.
+
+Every node label and every edge label of an output directory gets a series of part files,
+nodes_<label>-<part>.parquet and edges_<label>-<part>.parquet, a new part being started every
+`rows_per_file` rows. The property columns and their types come from the schema, inherited
+properties included: ints, floats, booleans, lists for the [] types and strings for everything
+else, with low-cardinality strings (sources, chromosomes, biological contexts, node types)
+dictionary encoded. Values that don't convert to the type of their column are written as nulls.
+The properties missing from the schema are added as columns typed after their first value, a
+label that gains a column starts a new part file.
+
+The part files of a label can therefore have different columns, and so can the parts that the
+shards of a parallel build add to a label when they are merged. A column keeps its type across
+the parts of a label, the merge converts the columns of a shard part to the types of the parts
+already in the output, but readers must fill in the columns missing from a part, e.g.
+pyarrow.concat_tables(tables, promote_options="default") or a pyarrow.dataset with the unified
+schema of the parts (pyarrow.unify_schemas).
+
+Requires the pyarrow package.
+"""
+from collections import Counter, defaultdict
+import json
+import os
+import pathlib
+import re
+
+from biocypher._logger import logger
+
+from biocypher_metta import BaseWriter, DATASET_LABEL, DATASET_PROPERTIES
+from biocypher_metta.schema_cache import resolve_properties, schema_type_of
+
+DEFAULT_ROWS_PER_FILE = 1_000_000
+DEFAULT_BATCH_ROWS = 65536
+
+# string columns written as arrow dictionaries and parquet dictionary pages
+DICTIONARY_COLUMNS = {"source", "source_url", "chr", "biological_context", "source_type", "target_type", "label"}
+
+# parquet codec of the codecs of --compression
+PARQUET_CODECS = {"none": "none", "gzip": "gzip", "zstd": "zstd"}
+
+PART_FILE = re.compile(r"^(.+)-(\d+)\.parquet$")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The parquet writer requires the pyarrow package: pip install pyarrow")
+    return pyarrow
+
+
+def arrow_type(schema_type):
+    pa = _pyarrow()
+    types = {
+        "str": pa.string(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+        "str[]": pa.list_(pa.string()),
+        "int[]": pa.list_(pa.int64()),
+        "float[]": pa.list_(pa.float64()),
+    }
+    return types.get(str(schema_type), pa.string())
+
+
+def to_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list, tuple, set)):
+        return json.dumps(value if not isinstance(value, set) else sorted(value), default=str)
+    return str(value)
+
+
+def to_int(value):
+    if value is None or value == "" or type(value) is int:
+        return None if value == "" else value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        return int(number) if number.is_integer() else None
+
+
+def to_float(value):
+    if value is None or value == "" or type(value) is float:
+        return None if value == "" else value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bool(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None if value == "" else value
+    if isinstance(value, str):
+        return {"true": True, "false": False, "1": True, "0": False}.get(value.lower())
+    return bool(value)
+
+
+def list_of(convert):
+    def to_list(value):
+        if value is None:
+            return None
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        return [convert(v) for v in values]
+    return to_list
+
+
+CONVERTERS = {
+    "str": to_str,
+    "int": to_int,
+    "float": to_float,
+    "bool": to_bool,
+    "str[]": list_of(to_str),
+    "int[]": list_of(to_int),
+    "float[]": list_of(to_float),
+}
+
+
+def part_files(directory, stem):
+    """
+    The part files of stem in directory, in the order of their numbers.
+    """
+    parts = [(int(match.group(2)), directory / name)
+             for match, name in ((PART_FILE.match(name), name) for name in os.listdir(directory))
+             if match is not None and match.group(1) == stem]
+    return [path for _, path in sorted(parts)]
+
+
+def next_part(directory, stem):
+    """
+    Number of the next part file of stem in directory.
+    """
+    parts = part_files(directory, stem)
+    return int(PART_FILE.match(parts[-1].name).group(2)) + 1 if parts else 0
+
+
+def merge_order(path):
+    """
+    Sort key of the files of a shard, the part files of a label in the order of their numbers.
+    """
+    match = PART_FILE.match(path.name)
+    if match is None:
+        return str(path.parent), path.name, -1
+    return str(path.parent), match.group(1), int(match.group(2))
+
+
+def schema_type_of_arrow(arrow):
+    """
+    Schema type of the values of an arrow column type, the inverse of arrow_type.
+    """
+    pa = _pyarrow()
+    if pa.types.is_dictionary(arrow):
+        arrow = arrow.value_type
+    return next((t for t in CONVERTERS if arrow_type(t) == arrow), "str")
+
+
+class PartWriter:
+    """
+    Rows of one node or edge label, buffered into record batches and written to part files of at
+    most rows_per_file rows.
+    """
+    def __init__(self, writer, directory, stem, columns):
+        """
+        :param columns: function returning the current list of (column name, schema type) of the label
+        """
+        self.writer = writer
+        self.directory = directory
+        self.stem = stem
+        self.columns = columns
+        self.rows = []
+        self.file = None
+        self.file_rows = 0
+        self.set_schema()
+
+    def set_schema(self):
+        pa = _pyarrow()
+        columns = self.columns()
+        self.names = [name for name, _ in columns]
+        self.types = [pa.dictionary(pa.int32(), pa.string()) if name in DICTIONARY_COLUMNS and arrow_type(t) == pa.string()
+                      else arrow_type(t) for name, t in columns]
+        self.schema = pa.schema(list(zip(self.names, self.types)))
+
+    def add(self, row):
+        if len(row) != len(self.names):
+            # the label gained a column, the next rows go to a new part file
+            self.close()
+            self.set_schema()
+        self.rows.append(row)
+        if len(self.rows) >= self.writer.batch_rows:
+            self.flush()
+
+    def flush(self):
+        pa = _pyarrow()
+        while self.rows:
+            if self.file is None:
+                self.open()
+            take = min(len(self.rows), self.writer.rows_per_file - self.file_rows)
+            rows, self.rows = self.rows[:take], self.rows[take:]
+            arrays = []
+            for values, arrow in zip(zip(*rows), self.types):
+                if pa.types.is_dictionary(arrow):
+                    arrays.append(pa.array(values, pa.string()).dictionary_encode())
+                else:
+                    arrays.append(pa.array(values, arrow))
+            self.file.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+            self.file_rows += take
+            if self.file_rows >= self.writer.rows_per_file:
+                self.file.close()
+                self.file = None
+
+    def open(self):
+        pq = _pyarrow().parquet
+        path = self.directory / f"{self.stem}-{next_part(self.directory, self.stem):05d}.parquet"
+        self.file = pq.ParquetWriter(path, self.schema, **self.writer.file_options(self.schema))
+        self.file_rows = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class ParquetWriter(BaseWriter):
+
+    def __init__(self, schema_config, biocypher_config, output_dir, compression=None, intern_provenance=False,
+                 rows_per_file=DEFAULT_ROWS_PER_FILE, batch_rows=DEFAULT_BATCH_ROWS):
+        """
+        :param rows_per_file: number of rows after which a new part file of a label is started
+        :param batch_rows: number of rows of a label buffered into one record batch
+        """
+        super().__init__(schema_config, biocypher_config, output_dir, compression, intern_provenance)
+        _pyarrow()
+        self.rows_per_file = rows_per_file
+        self.batch_rows = batch_rows
+        self.edge_node_types = dict(self.schema["edges"])
+        self.create_columns()
+        self.compile_formatters()
+
+    def convert_input_labels(self, label):
+        return label.lower().replace(" ", "_")
+
+    def file_options(self, schema):
+        """
+        :return: the options of the parquet files of the given arrow schema
+        """
+        compression = self.compression
+        return {"compression": PARQUET_CODECS[compression.codec], "compression_level": compression.level,
+                "use_dictionary": [field.name for field in schema if _pyarrow().types.is_dictionary(field.type)]}
+
+    def create_columns(self):
+        """
+        (name, schema type) of the property columns of every node and edge label, from the schema.
+        """
+        self.node_columns = {}
+        self.edge_columns = {}
+        schema_properties = resolve_properties(self.schema["schema"])
+        for k, v in self.schema["schema"].items():
+            labels = v["input_label"] if isinstance(v["input_label"], list) else [v["input_label"]]
+            columns = [(prop, str(t)) for prop, t in schema_properties[k].items()]
+            for provenance in ("source", "source_url"):
+                if provenance not in dict(columns):
+                    columns.append((provenance, "str"))
+            for label in labels:
+                label = self.convert_input_labels(label)
+                # a list per label, row_formatter appends to it
+                if v["represented_as"] == "node":
+                    self.node_columns[label] = list(columns)
+                elif v["represented_as"] == "edge":
+                    self.edge_columns[label] = list(columns)
+        # the dataset nodes of interned provenance, see BaseWriter.write_datasets
+        self.node_columns.setdefault(DATASET_LABEL, [(prop, "str") for prop in DATASET_PROPERTIES])
+
+    def row_formatter(self, columns, label, kind):
+        """
+        :return: a function of the properties of a record returning its property values converted to
+            the types of the columns of the label. The properties missing from the schema are added
+            to the columns of the label, typed after their first value.
+        """
+        label_columns = columns.get(label)
+        if label_columns is None:
+            logger.warning(f"{kind} label {label} is not in the schema, using the properties of its records as columns")
+            label_columns = columns[label] = []
+        names = [name for name, _ in label_columns]
+        converters = [CONVERTERS.get(t, to_str) for _, t in label_columns]
+        known = set(names)
+
+        def format_properties(properties):
+            if not known.issuperset(properties):
+                for key, value in properties.items():
+                    if key not in known:
+                        schema_type = schema_type_of(value)
+                        known.add(key)
+                        names.append(key)
+                        converters.append(CONVERTERS[schema_type])
+                        label_columns.append((key, schema_type))
+                        logger.warning(f"Property {key} of {label} is not in the schema, adding it as a {schema_type} column")
+            return [convert(properties.get(name)) for name, convert in zip(names, converters)]
+        return format_properties
+
+    def compile_node_formatter(self, label):
+        """
+        :return: a function of the id and properties of a node returning its label and row
+        """
+        if "." in label:
+            label = label.split(".")[1]
+        label = label.lower()
+        format_properties = self.row_formatter(self.node_columns, label, "Node")
+
+        def format_node(id, properties):
+            return label, (id, *format_properties(properties))
+        return format_node
+
+    def compile_edge_formatter(self, label):
+        """
+        :return: a function of the source id, target id and properties of an edge returning its label
+            and row
+        """
+        label = label.lower()
+        source_type = self.edge_node_types[label]["source"]
+        target_type = self.edge_node_types[label]["target"]
+        output_label = self.edge_node_types[label]["output_label"] or label
+        source_is_term = source_type == "ontology_term"
+        target_is_term = target_type == "ontology_term"
+        format_properties = self.row_formatter(self.edge_columns, label, "Edge")
+
+        def format_edge(source_id, target_id, properties):
+            source = source_id.replace(":", "_").split("_")[0].lower() if source_is_term else source_type
+            target = target_id.replace(":", "_").split("_")[0].lower() if target_is_term else target_type
+            return label, (source_id, target_id, source, target, output_label, *format_properties(properties))
+        return format_edge
+
+    def output_dir(self, path_prefix):
+        output_dir = self.output_path / path_prefix if path_prefix else self.output_path
+        output_dir.mkdir(parents=True, exist_ok=True)
+        return output_dir
+
+    def write_nodes(self, nodes, path_prefix=None, create_dir=True):
+        output_dir = self.output_dir(path_prefix)
+        parts = {}
+        node_freq = Counter()
+        node_props = defaultdict(set)
+        formatters = self.node_formatters
+        try:
+            for node in nodes:
+                id, label, properties = node
+                label, row = (formatters.get(label) or self.node_formatter(label))(id, properties)
+                node_freq[label] += 1
+                node_props[label].update(properties.keys())
+                part = parts.get(label)
+                if part is None:
+                    columns = self.node_columns[label]
+                    part = parts[label] = PartWriter(self, output_dir, f"nodes_{label}",
+                                                     lambda columns=columns: [("id", "str"), *columns])
+                part.add(row)
+        finally:
+            for part in parts.values():
+                part.close()
+
+        logger.info(f"Finished writing out nodes to parquet: {output_dir}")
+        return node_freq, node_props
+
+    def write_edges(self, edges, path_prefix=None, create_dir=True):
+        output_dir = self.output_dir(path_prefix)
+        parts = {}
+        edges_freq = Counter()
+        formatters = self.edge_formatters
+        try:
+            for edge in edges:
+                source_id, target_id, label, properties = edge
+                label, row = (formatters.get(label) or self.edge_formatter(label))(source_id, target_id, properties)
+                edges_freq[label] += 1
+                part = parts.get(label)
+                if part is None:
+                    columns = self.edge_columns[label]
+                    part = parts[label] = PartWriter(
+                        self, output_dir, f"edges_{label}",
+                        lambda columns=columns: [("source_id", "str"), ("target_id", "str"), ("source_type", "str"),
+                                                 ("target_type", "str"), ("label", "str"), *columns])
+                part.add(row)
+        finally:
+            for part in parts.values():
+                part.close()
+
+        logger.info(f"Finished writing out edges to parquet: {output_dir}")
+        return edges_freq
+
+    def merge_shard(self, shard_dir, move=False):
+        """
+        Add the part files of a shard after the parts of their labels in the output, in the order of
+        their numbers rather than of their names.
+        """
+        shard_dir = pathlib.Path(shard_dir)
+        if not shard_dir.exists():
+            return
+        for src in sorted((p for p in shard_dir.rglob("*") if p.is_file()), key=merge_order):
+            dest = self.output_path / src.relative_to(shard_dir)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            self.merge_file(src, dest, move)
+
+    def merge_file(self, src, dest, move=False):
+        # parquet files can't be appended to, a part file of a shard becomes the next part of its label
+        match = PART_FILE.match(dest.name)
+        if match is None:
+            super().merge_file(src, dest, move)
+            return
+        stem = match.group(1)
+        parts = part_files(dest.parent, stem)
+        dest = dest.parent / f"{stem}-{next_part(dest.parent, stem):05d}.parquet"
+        if not self.convert_part(src, dest, parts):
+            super().merge_file(src, dest, move)
+
+    def convert_part(self, src, dest, parts):
+        """
+        Write the part file src to dest with its columns converted to their types in the given
+        parts of the same label, the first part holding a column deciding its type.
+        :return: False if the columns of src already have these types and src was not written
+        """
+        pa = _pyarrow()
+        pq = pa.parquet
+        types = {}
+        for path in parts:
+            for field in pq.read_schema(path):
+                types.setdefault(field.name, field.type)
+        schema = pq.read_schema(src)
+        if all(types.get(field.name, field.type) == field.type for field in schema):
+            return False
+
+        table = pq.read_table(src)
+        for i, field in enumerate(schema):
+            arrow = types.get(field.name, field.type)
+            if arrow == field.type:
+                continue
+            logger.warning(f"Converting column {field.name} of {src} from {field.type} to {arrow}")
+            convert = CONVERTERS[schema_type_of_arrow(arrow)]
+            values = [convert(value) for value in table.column(i).to_pylist()]
+            if pa.types.is_dictionary(arrow):
+                column = pa.array(values, pa.string()).dictionary_encode()
+            else:
+                column = pa.array(values, arrow)
+            table = table.set_column(i, pa.field(field.name, column.type), column)
+        pq.write_table(table, dest, **self.file_options(table.schema))
+        return True
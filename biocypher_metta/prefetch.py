@@ -0,0 +1,93 @@
+"""
+Producer/consumer pipeline between an adapter's generator and a writer.
+
+A Prefetcher runs the adapter generator (decompression and parsing) on a producer thread that
+hands batches of records to the writer thread through a bounded queue, so the writer formats and
+writes one batch while the next one is produced. Records come out in the order the generator
+yields them. The producer runs in a copy of the caller's context, so open_input still finds the
+shared scan streams attached by the caller.
+"""
+import contextvars
+import queue
+import threading
+import time
+
+_END = object()
+
+
+class Prefetcher:
+    def __init__(self, records, batch_size=1000, queue_depth=4, name="prefetch"):
+        """
+        :param records: iterable of records, only ever iterated on the producer thread
+        :param batch_size: number of records handed to the consumer at once
+        :param queue_depth: number of batches the producer can get ahead of the consumer
+        """
+        self.records = records
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_depth)
+        # CPU time of the producer thread, set when it finishes
+        self.cpu_time = 0.0
+        self._stop = threading.Event()
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._produce,), name=name, daemon=True)
+        self._started = False
+
+    def __iter__(self):
+        self._thread.start()
+        self._started = True
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is _END:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop the producer, e.g. when the consumer stopped early, and wait for it.
+        """
+        if not self._started:
+            return
+        self._stop.set()
+        # unblock a producer waiting for space in the queue
+        while self._thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        start = time.thread_time()
+        try:
+            batch = []
+            for record in self.records:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    if not self._put(batch):
+                        return
+                    batch = []
+            if batch and not self._put(batch):
+                return
+            self._put(_END)
+        except BaseException as e:
+            self._put(e)
+        finally:
+            # close the generator on this thread, it may hold open files
+            close = getattr(self.records, "close", None)
+            if close is not None:
+                close()
+            self.cpu_time = time.thread_time() - start
@@ -1,4 +1,6 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
+from collections import defaultdict
+from functools import lru_cache
 import pathlib
 import os
 from biocypher._logger import logger
@@ -6,19 +8,106 @@ import networkx as nx
 import re
 
 from biocypher_metta import BaseWriter
+from biocypher_metta.external_sort import external_sort
+from biocypher_metta.output_index import prolog_key, write_indexes
+
+# file of the clauses of a predicate in the clustered layout, <name>.<arity>.pl
+PREDICATE_FILE = re.compile(r"^(.+)\.(\d+)\.pl$")
+LOADER_FILE = "load.pl"
+# innermost parenthesized or bracketed group, see predicate_of
+NESTED_GROUP = re.compile(r"\([^()\[\]]*\)|\[[^()\[\]]*\]")
+
+# characters replaced in prolog atoms, applied after lowercasing: replacing ':' first would change
+# the lowercasing of a preceding capital sigma, ':' being case-ignorable and '_' not
+SANITIZE_TABLE = str.maketrans({
+    " ": "_",
+    "-": "_",
+    ":": "_",
+    "/": "_",
+    "–": "_",  # en dash
+    "—": "_",  # em dash
+    "&": "_",
+    ";": ",",
+})
+SPECIAL_CHARS = re.compile(r'[^\w_,]')
+UNDERSCORES = re.compile(r"_+")
+
+
+def _sanitize_atom(prop):
+    """
+    Sanitize a lowercased and translated string without commas.
+    """
+    prop = SPECIAL_CHARS.sub('', prop) # removes special characters except for underscores "_" and comma ","
+    prop = UNDERSCORES.sub("_", prop) # removes multiple adjacent under scores '_'
+    if prop == "":
+        return None
+    try:
+        float(prop)
+        return prop # It's a numeric string, return as is
+    except ValueError:
+        # Check if the first character is a digit
+        if prop[0].isdigit():
+            return f"'{prop}'"
+    return prop
+
+
+@lru_cache(maxsize=1 << 16)
+def sanitize_string(prop):
+    """
+    Sanitize a string into a prolog term, None if nothing is left of it. Cached since sources,
+    urls, biological contexts and ids repeat across records.
+    """
+    prop = prop.lower().translate(SANITIZE_TABLE)
+    if "," not in prop:
+        return _sanitize_atom(prop)
+    # sanitizes each string separated by comma ','
+    parts = [_sanitize_atom(p) for p in prop.split(',')]
+    prop = ",".join([p for p in parts if p is not None])
+    return prop if prop != "" else None
+
+
+def predicate_of(clause):
+    """
+    :return: the name and arity of the predicate of a clause, e.g. ("name", 2) for name(gene(x), y).
+    """
+    start = clause.find("(")
+    if start < 0:
+        return clause.rstrip("."), 0
+    args = clause[start + 1:clause.rfind(")")]
+    # drop the nested terms and lists, the commas left separate the arguments
+    while "(" in args or "[" in args:
+        flat = NESTED_GROUP.sub("", args)
+        if flat == args:
+            break
+        args = flat
+    return clause[:start], args.count(",") + 1
+
 
 class PrologWriter(BaseWriter):
 
     def __init__(self, schema_config, biocypher_config,
-                 output_dir):
-        super().__init__(schema_config, biocypher_config, output_dir)
+                 output_dir, compression=None, clustered=False, intern_provenance=False, index=False):
+        """
+        :param clustered: write the clauses of every predicate of an output directory to a file of
+            its own, <name>.<arity>.pl, which finalize sorts and lists in load.pl, instead of
+            interleaving them in nodes.pl and edges.pl
+        :param index: write the byte-offset index of every output file in finalize, see output_index
+        """
+        super().__init__(schema_config, biocypher_config, output_dir, compression, intern_provenance)
+        if clustered and self.compression.enabled:
+            raise ValueError("The clustered prolog output is consulted as is and can't be compressed")
+        if index and self.compression.enabled:
+            raise ValueError("The index holds byte offsets into the output files, which can't be compressed")
+        self.clustered = clustered
+        self.index = index
         self.create_edge_types()
         #self.excluded_properties = ["license", "version", "source"]
         self.excluded_properties = []
+        self.compile_formatters()
 
 
     def create_edge_types(self):
-        schema = self.bcy._get_ontology_mapping()._extend_schema()
+        schema = self.schema["schema"]
         self.edge_node_types = {}
 
         for k, v in schema.items():
@@ -47,8 +136,13 @@ class PrologWriter(BaseWriter):
                     pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(parents=True, exist_ok=True)
         else:
             file_path = f"{self.output_path}/nodes.pl"
-        
-        with open(file_path, "a") as f:
+
+        if self.clustered:
+            self.write_clauses(nodes, os.path.dirname(file_path), self.extract_node_info, self.write_node)
+            logger.info("Finished writing out nodes")
+            return self.node_freq, self.node_props
+
+        with self.open_output(file_path) as f:
             for node in nodes:
                 self.extract_node_info(node)
                   
@@ -70,7 +164,11 @@ class PrologWriter(BaseWriter):
         else:
             file_path = f"{self.output_path}/edges.pl"
 
-        with open(file_path, "a") as f:
+        if self.clustered:
+            self.write_clauses(edges, os.path.dirname(file_path), self.extract_edge_info, self.write_edge)
+            return self.edge_freq
+
+        with self.open_output(file_path) as f:
             for edge in edges:
                 self.extract_edge_info(edge)
                 out_str = self.write_edge(edge)
@@ -80,34 +178,110 @@ class PrologWriter(BaseWriter):
             f.write("\n")
         return self.edge_freq
 
+    def write_clauses(self, records, directory, extract_info, write_record):
+        """
+        Append the clauses of the records to the files of their predicates in directory.
+        """
+        files = {}
+        try:
+            for record in records:
+                extract_info(record)
+                for clause in write_record(record):
+                    predicate = predicate_of(clause)
+                    f = files.get(predicate)
+                    if f is None:
+                        f = files[predicate] = self.open_output(f"{directory}/{predicate[0]}.{predicate[1]}.pl")
+                    f.write(clause + "\n")
+        finally:
+            for f in files.values():
+                f.close()
+
+    def finalize(self):
+        """
+        Write load.pl for the clustered layout, see write_loader, and the index of every output file.
+        """
+        if self.clustered:
+            self.write_loader()
+        if self.index:
+            count = write_indexes(self.output_path, ".pl", prolog_key, exclude=(LOADER_FILE,))
+            logger.info(f"Wrote the index of {count} output files")
+
+    def write_loader(self):
+        """
+        Sort the predicate files of the clustered layout on disk and write load.pl, which declares
+        every predicate and consults its files, in the output directory.
+        """
+        predicates = defaultdict(list)
+        for path in sorted(self.output_path.rglob("*.pl")):
+            match = PREDICATE_FILE.match(path.name)
+            relative = path.relative_to(self.output_path)
+            if match is None or any(part.startswith(".") for part in relative.parts[:-1]):
+                continue
+            # sorted on the whole clause, which sorts the clauses of a file on their first argument
+            count = external_sort(path, path)
+            predicates[(match.group(1), int(match.group(2)))].append((relative, count))
+
+        lines = [
+            "% Generated by biocypher_metta.prolog_writer, consult this file to load the output.",
+            "% The clauses of every predicate are in files of their own, sorted on their first argument,",
+            "% the argument SWI-Prolog indexes first. The predicates are multifile since several output",
+            "% directories hold clauses of the same predicate.",
+        ]
+        for name, arity in sorted(predicates):
+            lines.append(f":- multifile {name}/{arity}.")
+            lines.append(f":- discontiguous {name}/{arity}.")
+        for (name, arity), files in sorted(predicates.items()):
+            lines.append(f"% {name}/{arity}: {sum(count for _, count in files)} clauses, first argument sorted")
+            for relative, _ in files:
+                lines.append(f":- consult('{relative.as_posix()}').")
+
+        with open(self.output_path / LOADER_FILE, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        logger.info(f"Sorted {sum(len(files) for files in predicates.values())} predicate files and wrote "
+                    f"{self.output_path / LOADER_FILE}")
+
+    def normalize_id(self, id):
+        return self.sanitize_text(id.lower())
+
     def write_node(self, node):
         id, label, properties = node
-        if "." in label:
-            label = label.split(".")[1]
-        label = label.lower()
-        id = self.sanitize_text(id.lower())
-        def_out = f"{self.sanitize_text(label)}({id})"
-        return self.write_property(def_out, properties)
+        return (self.node_formatters.get(label) or self.node_formatter(label))(id, properties)
 
     def write_edge(self, edge):
         source_id, target_id, label, properties = edge
+        return (self.edge_formatters.get(label) or self.edge_formatter(label))(source_id, target_id, properties)
+
+    def compile_node_formatter(self, label):
+        if "." in label:
+            label = label.split(".")[1]
+        label = self.sanitize_text(label.lower())
+        sanitize_text = self.sanitize_text
+        write_property = self.write_property
+
+        def format_node(id, properties):
+            return write_property(f"{label}({sanitize_text(id.lower())})", properties)
+        return format_node
+
+    def compile_edge_formatter(self, label):
         label = label.lower()
-        source_id = source_id.lower()
-        target_id = target_id.lower()
         source_type = self.edge_node_types[label]["source"]
         target_type = self.edge_node_types[label]["target"]
         output_label = self.edge_node_types[label]["output_label"]
         if output_label is not None:
             label = output_label.lower()
-        source_id = self.sanitize_text(source_id)
-        target_id = self.sanitize_text(target_id)
         label = self.sanitize_text(label)
-        if source_type == "ontology_term":
-            source_type = source_id.split('_')[0]
-        if target_type == "ontology_term":
-            target_type = target_id.split('_')[0]
-        def_out = f"{label}({source_type}({source_id}), {target_type}({target_id}))"
-        return self.write_property(def_out, properties)
+        source_is_term = source_type == "ontology_term"
+        target_is_term = target_type == "ontology_term"
+        sanitize_text = self.sanitize_text
+        write_property = self.write_property
+
+        def format_edge(source_id, target_id, properties):
+            source_id = sanitize_text(source_id.lower())
+            target_id = sanitize_text(target_id.lower())
+            source = source_id.split('_')[0] if source_is_term else source_type
+            target = target_id.split('_')[0] if target_is_term else target_type
+            return write_property(f"{label}({source}({source_id}), {target}({target_id}))", properties)
+        return format_edge
 
 
     def write_property(self, def_out, property):
@@ -139,38 +313,11 @@ class PrologWriter(BaseWriter):
         return out_str
 
     def sanitize_text(self, prop):
-        replace_chars = {
-            " ": "_",
-            "-": "_",
-            ":": "_",
-            "/": "_",
-            "–": "_",  # en dash
-            "—": "_",  # em dash
-            "&": "_",
-            ";": ","
-        }
-        
-        if isinstance(prop, str):        
-            for char, replacement in replace_chars.items():
-                prop = prop.replace(char, replacement).lower()     
-
-            # sanitizes each string separated by comma ','
-            if "," in prop:
-                prop = ",".join([self.sanitize_text(p) for p in prop.split(',') if self.sanitize_text(p) not in ["", None]])
-                return prop if prop != "" else None
-            
-            prop = re.sub(r'[^\w_,]', '', prop) # removes special characters except for underscores "_" and comma ","
-            prop = re.sub(r"_+", "_", prop) # removes multiple adjacent under scores '_'
-            prop.strip("_")
-            if prop == "":
-                return None
-            try:
-                float(prop)
-                return prop # It's a numeric string, return as is
-            except ValueError:
-                # Check if the first character is a digit
-                if prop[0].isdigit():
-                    return f"'{prop}'"
+        if type(prop) is str:
+            return sanitize_string(prop)
+        if isinstance(prop, str):
+            # subclasses of str (e.g. rdflib literals) bypass the cache of sanitize_string
+            return sanitize_string.__wrapped__(prop)
         elif isinstance(prop, list):
             for i in range(len(prop)):
                 prop[i] = self.sanitize_text(prop[i])
@@ -0,0 +1,187 @@
+"""
+Region-scoped builds.
+
+The regions given to the build script (--chr/--start/--end or --regions-bed) are pushed into the
+chr/start/end args of every region-aware adapter, i.e. every adapter whose constructor takes a
+`chr` argument, and set as the active regions of the process, which check_genomic_location
+consults for every record of a region-aware adapter. Adapters without positional filtering are
+either skipped or fully included, depending on the region policy.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from contextvars import ContextVar
+import importlib
+import inspect
+
+from biocypher._logger import logger
+
+REGION_POLICIES = ("skip", "include")
+
+_active_regions = None
+# whether the adapter running in the current context is region-aware, see region_scope
+_region_aware = ContextVar("region_aware", default=True)
+
+
+class RegionSet:
+    def __init__(self, regions):
+        """
+        :param regions: iterable of (chr, start, end), with 1-based inclusive positions;
+            a start or end of None leaves that side of the region open
+        """
+        intervals = defaultdict(list)
+        for chr, start, end in regions:
+            intervals[chr].append((start or 0, end if end is not None else float("inf")))
+        # merge the overlapping intervals of each chromosome so that a position is in at most one
+        self.intervals = {}
+        for chr, chr_intervals in intervals.items():
+            merged = []
+            for start, end in sorted(chr_intervals):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            self.intervals[chr] = merged
+        self._starts = {chr: [start for start, _ in merged] for chr, merged in self.intervals.items()}
+
+    @property
+    def chromosomes(self):
+        return set(self.intervals)
+
+    def contains(self, chr, start, end):
+        """
+        Whether [start, end] lies within one of the regions, the same test as check_genomic_location.
+        A record missing its start or end can't be placed and is never within the regions.
+        """
+        starts = self._starts.get(chr)
+        if starts is None or start in (None, "") or end in (None, ""):
+            return False
+        i = bisect_right(starts, int(start)) - 1
+        return i >= 0 and int(end) <= self.intervals[chr][i][1]
+
+    def overlaps(self, chr, start, end):
+        """
+        Whether [start, end] overlaps one of the regions, a start or end of None leaving that side open.
+        """
+        start = start or 0
+        end = end if end is not None else float("inf")
+        return any(region_start <= end and start <= region_end
+                   for region_start, region_end in self.intervals.get(chr, ()))
+
+    def single(self):
+        """
+        :return: the (chr, start, end) of the region if the set holds a single region, otherwise None
+        """
+        if len(self.intervals) != 1:
+            return None
+        (chr, merged), = self.intervals.items()
+        if len(merged) != 1:
+            return None
+        start, end = merged[0]
+        return chr, (start or None), (None if end == float("inf") else end)
+
+    def to_list(self):
+        return [[chr, start or None, None if end == float("inf") else end]
+                for chr, merged in sorted(self.intervals.items()) for start, end in merged]
+
+    def __repr__(self):
+        return f"RegionSet({self.to_list()})"
+
+
+def load_bed(path):
+    """
+    Read the regions of a BED file (0-based, end-exclusive) as 1-based inclusive regions.
+    """
+    regions = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            data = line.split()
+            regions.append((data[0], int(data[1]) + 1, int(data[2])))
+    return RegionSet(regions)
+
+
+def set_active_regions(regions):
+    global _active_regions
+    _active_regions = regions
+
+
+def active_regions():
+    """
+    The regions the records of the adapter running in the current context must lie within, None
+    if the build is not region-scoped or the adapter is not region-aware.
+    """
+    return _active_regions if _region_aware.get() else None
+
+
+class region_scope:
+    """
+    Run the adapter of an entry in the current context, so that check_genomic_location only
+    applies the active regions to the records of a region-aware adapter:
+
+        with region_scope(type(adapter)):
+            writer.write_nodes(adapter.get_nodes())
+    """
+    def __init__(self, adapter_cls):
+        self.region_aware = is_region_aware(adapter_cls)
+
+    def __enter__(self):
+        self._token = _region_aware.set(self.region_aware)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _region_aware.reset(self._token)
+
+
+def is_region_aware(adapter_cls):
+    return "chr" in inspect.signature(adapter_cls.__init__).parameters
+
+
+def _adapter_cls(config):
+    adapter_config = config["adapter"]
+    return getattr(importlib.import_module(adapter_config["module"]), adapter_config["cls"])
+
+
+def region_args(adapter_cls, regions, args):
+    """
+    The chr/start/end args to pass to a region-aware adapter for the given regions, the
+    intersection of the region with the chr/start/end the entry is configured with in `args`.
+    Several regions can't be expressed through the args of an adapter and are only applied
+    through the active regions.
+    """
+    if regions is None or not is_region_aware(adapter_cls):
+        return {}
+    region = regions.single()
+    if region is None:
+        return {}
+    chr, start, end = region
+    if args.get("chr") not in (None, chr):
+        # the entry is outside the region, see select_entries
+        return {}
+    starts = [s for s in (start, args.get("start")) if s is not None]
+    ends = [e for e in (end, args.get("end")) if e is not None]
+    return {"chr": chr, "start": max(starts) if starts else None, "end": min(ends) if ends else None}
+
+
+def select_entries(adapters_dict, regions, policy):
+    """
+    Drop the entries that can't produce records in the regions: region-aware entries configured
+    for a chromosome or range outside the regions, and entries without positional filtering when the
+    policy is "skip".
+    """
+    if regions is None:
+        return adapters_dict
+    selected = {}
+    for name, config in adapters_dict.items():
+        if not is_region_aware(_adapter_cls(config)):
+            if policy == "skip":
+                logger.info(f"Skipping adapter {name}, it does not filter by region")
+                continue
+        else:
+            args = config["adapter"]["args"]
+            if args.get("chr") is not None and not regions.overlaps(args["chr"], args.get("start"), args.get("end")):
+                logger.info(f"Skipping adapter {name}, its region {args['chr']}:{args.get('start')}-{args.get('end')} "
+                            f"is outside the regions")
+                continue
+        selected[name] = config
+    return selected
@@ -0,0 +1,209 @@
+"""
+Compiled schema shared by the build script and the writers.
+
+Extending the schema config and loading the head ontology through BioCypher takes from
+several seconds to tens of seconds. The parts of it the writers use are compiled once into
+a JSON file keyed by the hash of the schema and biocypher configs, the installed BioCypher
+version and the ontologies the biocypher config loads (their content for local files), and
+loaded from there by every later writer or build.
+"""
+import hashlib
+import json
+import os
+import pathlib
+
+import biocypher
+from biocypher import BioCypher
+from biocypher._config import module_data
+from biocypher._logger import logger
+import networkx as nx
+import yaml
+
+SCHEMA_CACHE_VERSION = 2
+# under the repository root, whatever the working directory of the build
+SCHEMA_CACHE_DIR = pathlib.Path(__file__).resolve().parent.parent / ".cache" / "compiled_schema"
+
+# key -> compiled schema, so that writers created in the same process share one copy
+_loaded = {}
+
+
+def convert_input_labels(label, replace_char="_"):
+    return label.replace(" ", replace_char)
+
+
+def ontologies(biocypher_config):
+    """
+    The head and tail ontologies BioCypher loads for a biocypher config, the defaults of the
+    installed BioCypher for the ones the config doesn't set.
+    """
+    with open(biocypher_config) as f:
+        config = (yaml.safe_load(f) or {}).get("biocypher") or {}
+    defaults = (module_data("biocypher_config") or {}).get("biocypher") or {}
+    return {key: config.get(key, defaults.get(key)) for key in ("head_ontology", "tail_ontologies")}
+
+
+def _ontology_files(value):
+    """
+    The url or path of every ontology of the ontologies config.
+    """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "url" and isinstance(item, str):
+                yield item
+            else:
+                yield from _ontology_files(item)
+
+
+def schema_key(schema_config, biocypher_config):
+    sha = hashlib.sha256(f"compiled-schema-v{SCHEMA_CACHE_VERSION}\nbiocypher-{biocypher.__version__}\n".encode())
+    for path in (schema_config, biocypher_config):
+        with open(path, "rb") as f:
+            sha.update(f.read())
+    config = ontologies(biocypher_config)
+    sha.update(json.dumps(config, sort_keys=True).encode())
+    # the urls of remote ontologies are versioned, local files can change under the same path
+    for url in _ontology_files(config):
+        if os.path.isfile(url):
+            with open(url, "rb") as f:
+                sha.update(hashlib.sha256(f.read()).digest())
+    return sha.hexdigest()
+
+
+def _first(value):
+    return value[0] if isinstance(value, list) else value
+
+
+def resolve_properties(schema):
+    """
+    Properties of every entry of the schema, with the properties inherited from the entries up its
+    is_a chain for as long as the entries set inherit_properties. The entry's own properties come
+    first and keep their type.
+    :param schema: the schema entries, as in the schema config or the compiled schema
+    :return: dict of entry -> properties
+    """
+    resolved = {}
+
+    def properties_of(key, seen):
+        if key in resolved:
+            return resolved[key]
+        entry = schema.get(key) or {}
+        properties = dict(entry.get("properties") or {})
+        parent = _first(entry.get("is_a"))
+        if entry.get("inherit_properties") and parent in schema and parent not in seen:
+            for prop, prop_type in properties_of(parent, seen | {key}).items():
+                properties.setdefault(prop, prop_type)
+        resolved[key] = properties
+        return properties
+
+    for key in schema:
+        properties_of(key, frozenset())
+    return resolved
+
+
+def schema_type_of(value):
+    """
+    Schema type of a property value, for the properties missing from the schema.
+    """
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, (list, tuple, set)):
+        return "str[]"
+    return "str"
+
+
+def compile_entries(extended_schema):
+    """
+    Reduce the extended schema entries to the fields the writers use.
+    :return: a dict with
+        schema: the schema entries
+        edges: lowercased edge input label -> source type, target type and output label
+        node_labels: the input labels of the nodes
+    """
+    schema = {}
+    edges = {}
+    node_labels = []
+    for k, v in extended_schema.items():
+        schema[k] = {
+            "represented_as": v.get("represented_as"),
+            "input_label": v.get("input_label"),
+            "source": v.get("source"),
+            "target": v.get("target"),
+            "output_label": v.get("output_label"),
+            "properties": v.get("properties") or {},
+            "is_a": v.get("is_a"),
+            "inherit_properties": bool(v.get("inherit_properties")),
+        }
+        if v.get("represented_as") == "edge":
+            source_type = v.get("source", None)
+            target_type = v.get("target", None)
+            if source_type is not None and target_type is not None:
+                label = convert_input_labels(_first(v["input_label"]))
+                output_label = v.get("output_label", None)
+                edges[label.lower()] = {
+                    "source": convert_input_labels(_first(source_type)).lower(),
+                    "target": convert_input_labels(_first(target_type)).lower(),
+                    "output_label": output_label.lower() if output_label is not None else None,
+                }
+        elif v.get("represented_as") == "node":
+            node_labels.append(convert_input_labels(_first(v["input_label"])))
+    return {"schema": schema, "edges": edges, "node_labels": node_labels}
+
+
+def compile_schema(schema_config, biocypher_config):
+    """
+    Build the compiled schema with BioCypher.
+    :return: the dict of compile_entries for the extended schema, with
+        type_hierarchy: [node, parent] pairs of the ontology, mixins excluded
+    """
+    bcy = BioCypher(schema_config_path=schema_config, biocypher_config_path=biocypher_config)
+    compiled = compile_entries(bcy._get_ontology_mapping()._extend_schema())
+
+    G = bcy._get_ontology()._nx_graph
+    type_hierarchy = []
+    for node in G.nodes:
+        if "mixin" in node: continue
+        # the immediate parent of the node in the ontology
+        ancestor = list(nx.dfs_preorder_nodes(G, node, depth_limit=2))[-1]
+        type_hierarchy.append([node, ancestor])
+
+    return {
+        "version": SCHEMA_CACHE_VERSION,
+        **compiled,
+        "type_hierarchy": type_hierarchy,
+    }
+
+
+def load_schema(schema_config="config/schema_config.yaml", biocypher_config="config/biocypher_config.yaml",
+                cache_dir=SCHEMA_CACHE_DIR):
+    """
+    Load the compiled schema for the given configs, compiling and caching it on the first use.
+    """
+    key = schema_key(schema_config, biocypher_config)
+    if key in _loaded:
+        return _loaded[key]
+
+    cache_path = pathlib.Path(cache_dir) / f"{key}.json"
+    compiled = None
+    if cache_path.exists():
+        try:
+            with open(cache_path) as f:
+                compiled = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable compiled schema {cache_path}: {e}")
+
+    if compiled is None or compiled.get("version") != SCHEMA_CACHE_VERSION:
+        logger.info(f"Compiling schema {schema_config}")
+        compiled = compile_schema(schema_config, biocypher_config)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a unique temporary file first, several worker processes may compile at once
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(compiled, f)
+        os.replace(tmp_path, cache_path)
+
+    _loaded[key] = compiled
+    return compiled
@@ -0,0 +1,268 @@
+"""
+Single-pass scans of input files that are read by several adapter entries.
+
+A SharedScan decompresses and splits its file into lines once, on a reader thread, and
+hands the batches of lines to every consumer through a bounded queue. Adapters open their
+input with open_input(), which returns the stream attached to the calling consumer if the
+file is being scanned and opens the file from disk otherwise, so they work unchanged when
+run on their own.
+"""
+from contextvars import ContextVar
+import gzip
+import io
+import os
+import queue
+import threading
+
+from biocypher._logger import logger
+
+# realpath -> stream of the consumer running in the current context
+_attached_streams = ContextVar("attached_streams", default=None)
+# handles opened by open_input in the current context, collected for the build metrics
+_input_reads = ContextVar("input_reads", default=None)
+
+_END = object()
+
+
+def open_input(filepath, mode="rt"):
+    """
+    Open an adapter input file for reading, decompressing it if it is gzipped.
+    Returns the shared scan stream of the file if one is attached to the calling consumer.
+    """
+    reads = _input_reads.get()
+    streams = _attached_streams.get()
+    if streams and "b" not in mode:
+        stream = streams.pop(os.path.realpath(filepath), None)
+        if stream is not None:
+            if reads is not None:
+                reads.append(stream)
+            return stream
+
+    if reads is not None and "b" not in mode:
+        f = CountedTextFile(filepath)
+        reads.append(f)
+        return f
+
+    if _is_gzip(filepath):
+        return gzip.open(filepath, mode)
+    return open(filepath, mode)
+
+
+def _is_gzip(filepath):
+    with open(filepath, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+class track_input_reads:
+    """
+    Collect the files opened with open_input in the current context:
+
+        with track_input_reads() as reads:
+            ...
+        sum(handle.input_counts()[0] for handle in reads)
+    """
+    def __enter__(self):
+        self.reads = []
+        self._token = _input_reads.set(self.reads)
+        return self.reads
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _input_reads.reset(self._token)
+
+
+class CountedTextFile(io.TextIOWrapper):
+    """
+    Text file that reports how many bytes were read from disk and after decompression.
+    """
+    def __init__(self, filepath):
+        if _is_gzip(filepath):
+            super().__init__(gzip.GzipFile(filepath, "rb"))
+        else:
+            super().__init__(open(filepath, "rb"))
+        self.counts = (0, 0)
+
+    def _positions(self):
+        decompressed = self.buffer.tell()
+        if isinstance(self.buffer, gzip.GzipFile):
+            return self.buffer.fileobj.tell(), decompressed
+        return decompressed, decompressed
+
+    def input_counts(self):
+        """
+        :return: (bytes read from disk, bytes read after decompression)
+        """
+        # the file may be read and closed by another thread (the reader of a SharedScan)
+        try:
+            if not self.closed:
+                return self._positions()
+        except (AttributeError, ValueError):
+            pass
+        return self.counts
+
+    def close(self):
+        if not self.closed:
+            self.counts = self._positions()
+        super().close()
+
+
+class ScanStream:
+    """
+    Read-only text stream over the lines a SharedScan hands to one consumer.
+    """
+    def __init__(self, scan, queue_depth):
+        self.scan = scan
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.closed = False
+        self._lines = iter(())
+        self._done = False
+        # rest of a line partially returned by read(size) or readline(size)
+        self._rest = ""
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def _next_line(self):
+        """
+        :return: the next line handed by the scan, "" at the end of the file
+        """
+        while True:
+            for line in self._lines:
+                return line
+            if self._done:
+                return ""
+            batch = self.queue.get()
+            if batch is _END:
+                self._done = True
+                return ""
+            if isinstance(batch, BaseException):
+                self._done = True
+                raise batch
+            self._lines = iter(batch)
+
+    def readline(self, size=-1):
+        line = self._rest or self._next_line()
+        self._rest = ""
+        if size is not None and 0 <= size < len(line):
+            line, self._rest = line[:size], line[size:]
+        return line
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return "".join(self)
+        parts = []
+        while size > 0:
+            line = self.readline(size)
+            if not line:
+                break
+            parts.append(line)
+            size -= len(line)
+        return "".join(parts)
+
+    def readable(self):
+        return True
+
+    def input_counts(self):
+        # the file is read once for all the consumers of the scan
+        return self.scan.input_counts()
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SharedScan:
+    def __init__(self, filepath, batch_bytes=1 << 20, queue_depth=16):
+        """
+        :param filepath: input file read by all the consumers
+        :param batch_bytes: approximate size of the batches of lines handed to the consumers
+        :param queue_depth: number of batches a consumer can fall behind the reader
+        """
+        self.filepath = filepath
+        self.batch_bytes = batch_bytes
+        self.queue_depth = queue_depth
+        self.streams = []
+        self._thread = None
+        self._file = None
+
+    def add_consumer(self):
+        stream = ScanStream(self, self.queue_depth)
+        self.streams.append(stream)
+        return stream
+
+    def attach(self, stream):
+        """
+        Make open_input() return `stream` for this scan's file in the calling thread.
+        """
+        return _Attachment(os.path.realpath(self.filepath), stream)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._read, name=f"scan:{os.path.basename(self.filepath)}",
+                                        daemon=True)
+        self._thread.start()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def input_counts(self):
+        if self._file is None:
+            return 0, 0
+        return self._file.input_counts()
+
+    def _put(self, stream, item):
+        # A consumer that closed its stream (or finished without reading it) is skipped
+        while not stream.closed:
+            try:
+                stream.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _read(self):
+        logger.info(f"Scanning {self.filepath} once for {len(self.streams)} consumers")
+        try:
+            with CountedTextFile(self.filepath) as f:
+                self._file = f
+                while any(not stream.closed for stream in self.streams):
+                    batch = f.readlines(self.batch_bytes)
+                    if not batch:
+                        break
+                    for stream in self.streams:
+                        self._put(stream, batch)
+            end = _END
+        except Exception as e:
+            end = e
+        for stream in self.streams:
+            self._put(stream, end)
+
+
+class _Attachment:
+    def __init__(self, path, stream):
+        self.path = path
+        self.stream = stream
+
+    def __enter__(self):
+        streams = _attached_streams.get()
+        if streams is None:
+            streams = {}
+            _attached_streams.set(streams)
+        streams[self.path] = self.stream
+        return self.stream
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        streams = _attached_streams.get()
+        if streams is not None:
+            streams.pop(self.path, None)
+        # Let the reader move on if the consumer stopped early or never opened the file
+        self.stream.close()
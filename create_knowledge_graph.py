@@ -1,69 +1,74 @@
 """
 Knowledge graph generation through BioCypher script
 """
-from datetime import date
+from functools import partial
 from pathlib import Path
 
-from biocypher import BioCypher
 from biocypher_metta.metta_writer import *
 from biocypher_metta.prolog_writer import PrologWriter
 from biocypher_metta.neo4j_csv_writer import *
+from biocypher_metta.neo4j_admin_writer import Neo4jAdminWriter
+from biocypher_metta.neo4j_writer import Neo4jWriter
+from biocypher_metta.parquet_writer import ParquetWriter, DEFAULT_ROWS_PER_FILE
+from biocypher_metta.adapter_runner import run_sequential, run_parallel, run_incremental, run_options, SHARDS_DIR
+from biocypher_metta.build_metrics import write_metrics
+from biocypher_metta.compression import Compression, CODECS
+from biocypher_metta.regions import RegionSet, load_bed, select_entries, set_active_regions, REGION_POLICIES
+from biocypher_metta.build_manifest import BuildManifest
+from biocypher_metta.dedupe import DEDUPE_SPOOL_DIR, RULES, dedupe_nodes, parse_rules
+from biocypher_metta.integrity import (INTEGRITY_DIR, DEFAULT_CAPACITY, DEFAULT_FP_RATE, check_edges,
+                                       parse_expected, previous_counts)
+from biocypher_metta.schema_cache import load_schema
 from biocypher._logger import logger
 import typer
 import yaml
-import importlib  #for reflection
+from typing import List
 from typing_extensions import Annotated
 import pickle
 import json
+import shutil
+import time
 from collections import Counter, defaultdict
 
 app = typer.Typer()
 
 # Function to choose the writer class based on user input
-def get_writer(writer_type: str, output_dir: Path):
+def get_writer(writer_type: str, output_dir: Path, compression: Compression = None, cypher_batch_size: int = 10000,
+               metta_shards: int = 0, prolog_clustered: bool = False, intern_provenance: bool = False,
+               parquet_rows_per_file: int = DEFAULT_ROWS_PER_FILE, index: bool = False):
     if writer_type == 'metta':
         return MeTTaWriter(schema_config="config/schema_config.yaml",
                            biocypher_config="config/biocypher_config.yaml",
-                           output_dir=output_dir)
+                           output_dir=output_dir, compression=compression, shards=metta_shards,
+                           intern_provenance=intern_provenance, index=index)
     elif writer_type == 'prolog':
         return PrologWriter(schema_config="config/schema_config.yaml",
                             biocypher_config="config/biocypher_config.yaml",
-                            output_dir=output_dir)
+                            output_dir=output_dir, compression=compression, clustered=prolog_clustered,
+                            intern_provenance=intern_provenance, index=index)
     elif writer_type == 'neo4j':
         return Neo4jCSVWriter(schema_config="config/schema_config.yaml",
                                biocypher_config="config/biocypher_config.yaml",
-                               output_dir=output_dir)
+                               output_dir=output_dir, compression=compression, intern_provenance=intern_provenance)
+    elif writer_type == 'cypher':
+        return Neo4jWriter(schema_config="config/schema_config.yaml",
+                           biocypher_config="config/biocypher_config.yaml",
+                           output_dir=output_dir, compression=compression, batch_size=cypher_batch_size,
+                           intern_provenance=intern_provenance)
+    elif writer_type == 'neo4j-admin':
+        return Neo4jAdminWriter(schema_config="config/schema_config.yaml",
+                                biocypher_config="config/biocypher_config.yaml",
+                                output_dir=output_dir, compression=compression, intern_provenance=intern_provenance)
+    elif writer_type == 'parquet':
+        return ParquetWriter(schema_config="config/schema_config.yaml",
+                             biocypher_config="config/biocypher_config.yaml",
+                             output_dir=output_dir, compression=compression, intern_provenance=intern_provenance,
+                             rows_per_file=parquet_rows_per_file)
     else:
         raise ValueError(f"Unknown writer type: {writer_type}")
 
 def preprocess_schema():
-    def convert_input_labels(label, replace_char="_"):
-        return label.replace(" ", replace_char)
-
-    bcy = BioCypher(
-        schema_config_path="config/schema_config.yaml", biocypher_config_path="config/biocypher_config.yaml"
-    )
-    schema = bcy._get_ontology_mapping()._extend_schema()
-    edge_node_types = {}
-
-    for k, v in schema.items():
-        if v["represented_as"] == "edge":
-            source_type = v.get("source", None)
-            target_type = v.get("target", None)
-
-            if source_type is not None and target_type is not None:
-                label = convert_input_labels(v["input_label"])
-                source_type = convert_input_labels(source_type)
-                target_type = convert_input_labels(target_type)
-                output_label = v.get("output_label", None)
-
-                edge_node_types[label.lower()] = {
-                    "source": source_type.lower(),
-                    "target": target_type.lower(),
-                    "output_label": output_label.lower() if output_label else None,
-                }
-
-    return edge_node_types
+    return load_schema(schema_config="config/schema_config.yaml", biocypher_config="config/biocypher_config.yaml")["edges"]
 
 def gather_graph_info(nodes_count, nodes_props, edges_count, schema_dict, output_dir):
     graph_info = {
@@ -100,98 +105,123 @@ def gather_graph_info(nodes_count, nodes_props, edges_count, schema_dict, output
         source, target = conn.split('|')
         graph_info['schema']['edges'].append({'data': {'source': source, 'target': target, 'possible_connections': list(pos_connections)}})
 
-    total_size = sum(file.stat().st_size for file in Path(output_dir).rglob('*') if file.is_file())
+    total_size = sum(file.stat().st_size for file in Path(output_dir).rglob('*')
+                     if file.is_file() and SHARDS_DIR not in file.relative_to(output_dir).parts)
     total_size_gb = total_size / (1024 ** 3)  # 1GB == 1024^3
     graph_info['data_size'] = f"{total_size_gb:.2f} GB"
 
     return graph_info
 
-def process_adapters(adapters_dict, dbsnp_rsids_dict, dbsnp_pos_dict, writer, write_properties, add_provenance, schema_dict):
-    nodes_count = Counter()
-    nodes_props = defaultdict(set)
-    edges_count = Counter()
-    datasets_dict = {}
-
-    for c in adapters_dict:
-        writer.clear_counts() # Reset counter for this adapter
-        logger.info(f"Running adapter: {c}")
-        adapter_config = adapters_dict[c]["adapter"]
-        adapter_module = importlib.import_module(adapter_config["module"])
-        adapter_cls = getattr(adapter_module, adapter_config["cls"])
-        ctr_args = adapter_config["args"]
-
-        if "dbsnp_rsid_map" in ctr_args: #this for dbs that use grch37 assembly and to map grch37 to grch38
-            ctr_args["dbsnp_rsid_map"] = dbsnp_rsids_dict
-        if "dbsnp_pos_map" in ctr_args:
-            ctr_args["dbsnp_pos_map"] = dbsnp_pos_dict
-        ctr_args["write_properties"] = write_properties
-        ctr_args["add_provenance"] = add_provenance
-
-        adapter = adapter_cls(**ctr_args)
-        write_nodes = adapters_dict[c]["nodes"]
-        write_edges = adapters_dict[c]["edges"]
-        outdir = adapters_dict[c]["outdir"]
-
-        dataset_name = getattr(adapter, 'source', None)
-        version = getattr(adapter, 'version', None)
-        source_url = getattr(adapter, 'source_url', None)
-        
-        if dataset_name is None:
-            logger.warning(f"Dataset name is None for adapter: {c}. Ensure 'source' is defined in the adapter constructor.")
-        else:
-            if dataset_name not in datasets_dict:
-                datasets_dict[dataset_name] = {
-                    "name": dataset_name,
-                    "version": version,
-                    "url": source_url,
-                    "nodes": set(),
-                    "edges": set(),
-                    "imported_on": str(date.today())
-                }
-
-        if write_nodes:
-            nodes = adapter.get_nodes()
-            freq, props = writer.write_nodes(nodes, path_prefix=outdir)
-            for node_label in freq:
-                nodes_count[node_label] += freq[node_label]
-                if dataset_name is not None:
-                    datasets_dict[dataset_name]['nodes'].add(node_label)
-            for node_label in props:
-                nodes_props[node_label] = nodes_props[node_label].union(props[node_label])
-
-        if write_edges:
-            edges = adapter.get_edges()
-            freq = writer.write_edges(edges, path_prefix=outdir)
-            for edge_label in freq:
-                edges_count[edge_label] += freq[edge_label]
-                label = schema_dict[edge_label]['output_label'] or edge_label
-                if dataset_name is not None:
-                    datasets_dict[dataset_name]['edges'].add(label)
-
-    return nodes_count, nodes_props, edges_count, datasets_dict
+def process_adapters(adapters_dict, dbsnp_rsids, dbsnp_pos, writer, write_properties, add_provenance, schema_dict,
+                     workers=1, writer_type="metta", manifest=None, writer_options=None):
+    writer_factory = partial(get_writer, writer_type, **(writer_options or {}))
+    if manifest is not None:
+        totals = run_incremental(adapters_dict, writer, writer_factory, workers, manifest,
+                                 dbsnp_rsids, dbsnp_pos, write_properties, add_provenance, schema_dict)
+    elif workers > 1:
+        logger.info(f"Running {len(adapters_dict)} adapters with {workers} workers")
+        totals = run_parallel(adapters_dict, writer, writer_factory, workers,
+                              dbsnp_rsids, dbsnp_pos, write_properties, add_provenance, schema_dict)
+    else:
+        totals = run_sequential(adapters_dict, writer, dbsnp_rsids, dbsnp_pos,
+                                write_properties, add_provenance, schema_dict)
+
+    return totals["nodes_count"], totals["nodes_props"], totals["edges_count"], totals["datasets"], totals["metrics"]
 
 # Run build
 @app.command()
 def main(output_dir: Annotated[Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
          adapters_config: Annotated[Path, typer.Option(exists=True, file_okay=True, dir_okay=False)],
-         dbsnp_rsids: Annotated[Path, typer.Option(exists=True, file_okay=True, dir_okay=False)],
-         dbsnp_pos: Annotated[Path, typer.Option(exists=True, file_okay=True, dir_okay=False)],
-         writer_type: str = typer.Option(default="metta", help="Choose writer type: metta, prolog, neo4j"),
+         dbsnp_rsids: Annotated[Path, typer.Option(exists=True, file_okay=True, dir_okay=True,
+                                                    help="dbSNP rsid store directory or pickled rsid map")],
+         dbsnp_pos: Annotated[Path, typer.Option(exists=True, file_okay=True, dir_okay=True,
+                                                  help="dbSNP position store directory or pickled position map")],
+         writer_type: str = typer.Option(default="metta", help="Choose writer type: metta, prolog, neo4j, neo4j-admin, cypher, parquet"),
          write_properties: bool = typer.Option(True, help="Write properties to nodes and edges"),
-         add_provenance: bool = typer.Option(True, help="Add provenance to nodes and edges")):
+         add_provenance: bool = typer.Option(True, help="Add provenance to nodes and edges"),
+         workers: int = typer.Option(1, min=1, help="Number of processes used to run the adapters in parallel"),
+         incremental: bool = typer.Option(False, help="Only re-run adapters whose inputs, config or code changed since the last build"),
+         log_every: int = typer.Option(0, min=0, help="Log the progress of every adapter each N records, 0 to disable"),
+         chr: str = typer.Option(None, help="Only build the records on this chromosome, e.g. chr22"),
+         start: int = typer.Option(None, min=1, help="Only build the records starting at or after this position of --chr"),
+         end: int = typer.Option(None, min=1, help="Only build the records ending at or before this position of --chr"),
+         regions_bed: Annotated[Path, typer.Option(exists=True, file_okay=True, dir_okay=False,
+                                                   help="Only build the records within the regions of this BED file")] = None,
+         region_policy: str = typer.Option("include", help="Adapters without positional filtering in a region-scoped build: skip or include"),
+         prefetch_batch_size: int = typer.Option(0, min=0, help="Run each adapter on a producer thread handing batches of this many records to the writer, 0 to disable"),
+         prefetch_queue_depth: int = typer.Option(4, min=1, help="Number of batches an adapter can get ahead of the writer"),
+         compression: str = typer.Option("none", help="Compression of the output files: none, gzip or zstd"),
+         compression_level: int = typer.Option(None, help="Compression level, defaults to 6 for gzip and 3 for zstd"),
+         compression_threads: int = typer.Option(0, min=0, help="Number of compression threads per output file (zstd only)"),
+         cypher_batch_size: int = typer.Option(10000, min=1, help="Number of rows per batched statement of the cypher writer"),
+         metta_shards: int = typer.Option(0, min=0, help="Split the nodes and edges of every MeTTa output directory into this many files, 0 for a single file"),
+         prolog_clustered: bool = typer.Option(False, help="Write every Prolog predicate to a sorted file of its own, loaded through load.pl"),
+         intern_provenance: bool = typer.Option(False, help="Write every dataset once and reference it from the records instead of repeating their source and source_url"),
+         parquet_rows_per_file: int = typer.Option(DEFAULT_ROWS_PER_FILE, min=1, help="Number of rows after which the parquet writer starts a new file for a label"),
+         dedupe_partitions: int = typer.Option(0, min=0, help="Merge the nodes with the same label and id across all adapters, spooling them to this many on-disk partitions, 0 to disable"),
+         dedupe_rule: Annotated[List[str], typer.Option(help="Conflict rule of a property of the merged nodes, as property=rule with rule one of first, last, union, min, max")] = [],
+         dedupe_default_rule: str = typer.Option("first", help="Conflict rule of the properties of the merged nodes without a --dedupe-rule"),
+         index: bool = typer.Option(False, help="Write a byte-offset index of every MeTTa or Prolog output file for point lookups of ids"),
+         check_integrity: bool = typer.Option(False, help="Report the edges whose source or target was not emitted as a node"),
+         drop_dangling: bool = typer.Option(False, help="Check the integrity of the edges and drop the dangling ones"),
+         integrity_fp_rate: float = typer.Option(DEFAULT_FP_RATE, min=1e-9, max=0.5, help="False positive rate of the node filters of the integrity check"),
+         integrity_capacity: int = typer.Option(DEFAULT_CAPACITY, min=1, help="Expected number of nodes of the labels without a count from --integrity-expected or the previous build"),
+         integrity_expected: Annotated[List[str], typer.Option(help="Expected number of nodes of a label, as label=count")] = []):
     """
     Main function. Call individual adapters to download and process data. Build
     via BioCypher from node and edge data.
     """
 
-    # Start biocypher
-    logger.info("Loading dbsnp rsids map")
-    dbsnp_rsids_dict = pickle.load(open(dbsnp_rsids, 'rb'))
-    logger.info("Loading dbsnp pos map")
-    dbsnp_pos_dict = pickle.load(open(dbsnp_pos, 'rb'))
+    build_start = time.perf_counter()
+    run_options["log_every"] = log_every
+    run_options["prefetch_batch_size"] = prefetch_batch_size
+    run_options["prefetch_queue_depth"] = prefetch_queue_depth
+    run_options["dedupe_partitions"] = dedupe_partitions
+
+    if (start is not None or end is not None) and chr is None:
+        raise typer.BadParameter("--start and --end require --chr")
+    if chr is not None and regions_bed is not None:
+        raise typer.BadParameter("--chr and --regions-bed can't be used together")
+    if region_policy not in REGION_POLICIES:
+        raise typer.BadParameter(f"--region-policy must be one of {', '.join(REGION_POLICIES)}")
+    regions = None
+    if chr is not None:
+        regions = RegionSet([(chr, start, end)])
+    elif regions_bed is not None:
+        regions = load_bed(regions_bed)
+    if regions is not None:
+        logger.info(f"Building the regions {regions.to_list()}")
+    run_options["regions"] = regions
+    set_active_regions(regions)
+
+    if index and writer_type not in ('metta', 'prolog'):
+        raise typer.BadParameter("--index is only supported by the metta and prolog writers")
+    if compression not in CODECS:
+        raise typer.BadParameter(f"--compression must be one of {', '.join(CODECS)}")
+    compression = Compression(compression, compression_level, compression_threads)
+
+    if dedupe_default_rule not in RULES:
+        raise typer.BadParameter(f"--dedupe-default-rule must be one of {', '.join(RULES)}")
+    try:
+        dedupe_rules = parse_rules(dedupe_rule)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    integrity = None
+    if check_integrity or drop_dangling:
+        try:
+            expected = {**previous_counts(output_dir), **parse_expected(integrity_expected)}
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+        integrity = {"capacity": integrity_capacity, "expected": expected, "fp_rate": integrity_fp_rate,
+                     "drop": drop_dangling}
+    run_options["integrity"] = integrity
 
     # Choose the writer based on user input or default to 'metta'
-    bc = get_writer(writer_type, output_dir)
+    writer_options = {"compression": compression, "cypher_batch_size": cypher_batch_size, "metta_shards": metta_shards,
+                      "prolog_clustered": prolog_clustered, "intern_provenance": intern_provenance,
+                      "parquet_rows_per_file": parquet_rows_per_file, "index": index}
+    bc = get_writer(writer_type, output_dir, **writer_options)
     logger.info(f"Using {writer_type} writer")
 
     schema_dict = preprocess_schema()
@@ -203,11 +233,43 @@ def main(output_dir: Annotated[Path, typer.Option(exists=True, file_okay=False,
             logger.error("Error while trying to load adapter config")
             logger.error(e)
 
+    adapters_dict = select_entries(adapters_dict, regions, region_policy)
+
+    manifest = None
+    if incremental:
+        manifest = BuildManifest(output_dir, writer_type, write_properties, add_provenance,
+                                 shared_inputs={"dbsnp_rsid_map": dbsnp_rsids, "dbsnp_pos_map": dbsnp_pos},
+                                 regions=regions.to_list() if regions is not None else None,
+                                 compression=compression.settings(),
+                                 shards=metta_shards if writer_type == 'metta' else None,
+                                 clustered=prolog_clustered if writer_type == 'prolog' else None,
+                                 intern_provenance=intern_provenance,
+                                 dedupe=dedupe_partitions or None,
+                                 integrity=("drop" if drop_dangling else "report") if integrity else None,
+                                 writer_class=type(bc))
+
+    # the spools of an interrupted build, an incremental build rebuilds them from the shards
+    if dedupe_partitions:
+        shutil.rmtree(output_dir / DEDUPE_SPOOL_DIR, ignore_errors=True)
+    if integrity:
+        shutil.rmtree(output_dir / INTEGRITY_DIR, ignore_errors=True)
+
     # Run adapters
-    nodes_count, nodes_props, edges_count, datasets_dict = process_adapters(
-        adapters_dict, dbsnp_rsids_dict, dbsnp_pos_dict, bc, write_properties, add_provenance, schema_dict
+    nodes_count, nodes_props, edges_count, datasets_dict, metrics = process_adapters(
+        adapters_dict, dbsnp_rsids, dbsnp_pos, bc, write_properties, add_provenance, schema_dict,
+        workers=workers, writer_type=writer_type, manifest=manifest, writer_options=writer_options
     )
 
+    if intern_provenance:
+        bc.write_datasets(datasets_dict)
+    if dedupe_partitions:
+        nodes_count, nodes_props, _ = dedupe_nodes(bc, dedupe_rules, dedupe_default_rule)
+    if integrity:
+        kept_count, _ = check_edges(bc, schema_dict, drop=drop_dangling)
+        if kept_count is not None:
+            edges_count = kept_count
+    bc.finalize()
+
     # Gather graph info
     graph_info = gather_graph_info(nodes_count, nodes_props, edges_count, schema_dict, output_dir)
 
@@ -224,6 +286,9 @@ def main(output_dir: Annotated[Path, typer.Option(exists=True, file_okay=False,
     with open(file_path, "w") as f:
         f.write(graph_info_json)
 
+    write_metrics(output_dir, metrics, writer_type=writer_type, workers=workers, incremental=incremental,
+                  compression=compression.settings(), wall_s=round(time.perf_counter() - build_start, 3))
+
     logger.info("Done")
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""
+Benchmark the per-record cost of the writers on synthetic records of every label of the schema.
+
+The records are generated from the property types of the compiled schema and held in memory,
+so that only the formatting and writing of the records is timed. Run it on two checkouts to
+compare the per-record cost before and after a change to the writers.
+
+python scripts/benchmark_formatters.py --writer metta --writer neo4j --records 200000
+"""
+import pathlib
+import sys
+import tempfile
+import time
+from typing import List
+
+import typer
+from typing_extensions import Annotated
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from create_knowledge_graph import get_writer
+from biocypher_metta.schema_cache import load_schema
+
+app = typer.Typer()
+
+WRITERS = ["metta", "prolog", "neo4j", "cypher", "neo4j-admin"]
+
+
+def synthetic_value(prop_type, i):
+    if prop_type == "int":
+        return i
+    if prop_type == "float":
+        return i / 7
+    if prop_type == "bool":
+        return i % 2 == 0
+    if str(prop_type).endswith("[]"):
+        return [f"item {i}", f"item {i + 1}"]
+    return f"value ({i}) of {prop_type}"
+
+
+def synthetic_id(node_type, i):
+    if node_type == "ontology_term":
+        return f"GO:{i:07d}"
+    return f"{node_type.upper()}{i:011d}"
+
+
+def synthetic_records(schema, n):
+    """
+    :return: n nodes and n edges, spread evenly over the node and edge labels of the schema
+    """
+    node_labels = []
+    edge_labels = []
+    for v in schema["schema"].values():
+        label = v["input_label"][0] if isinstance(v["input_label"], list) else v["input_label"]
+        properties = v.get("properties") or {}
+        if v["represented_as"] == "node":
+            node_labels.append((label.replace(" ", "_"), properties))
+        elif v["represented_as"] == "edge" and label.replace(" ", "_").lower() in schema["edges"]:
+            edge_labels.append((label.replace(" ", "_"), properties))
+
+    nodes = []
+    for i in range(n):
+        label, properties = node_labels[i % len(node_labels)]
+        props = {k: synthetic_value(t, i) for k, t in properties.items()}
+        props["source"] = "benchmark"
+        nodes.append((synthetic_id(label, i), label, props))
+
+    edges = []
+    for i in range(n):
+        label, properties = edge_labels[i % len(edge_labels)]
+        types = schema["edges"][label.lower()]
+        props = {k: synthetic_value(t, i) for k, t in properties.items()}
+        props["source"] = "benchmark"
+        edges.append((synthetic_id(types["source"], i), synthetic_id(types["target"], i), label, props))
+    return nodes, edges
+
+
+def time_write(writer, records, kind):
+    start = time.perf_counter()
+    if kind == "nodes":
+        writer.write_nodes(records, path_prefix="bench")
+    else:
+        writer.write_edges(records, path_prefix="bench")
+    return time.perf_counter() - start
+
+
+@app.command()
+def main(writer: Annotated[List[str], typer.Option(help=f"Writer to benchmark, one of {', '.join(WRITERS)}")] = WRITERS,
+         records: int = typer.Option(100000, min=1, help="Number of nodes and of edges written"),
+         repeat: int = typer.Option(3, min=1, help="Number of timed runs of each writer, the best is reported")):
+    schema = load_schema("config/schema_config.yaml", "config/biocypher_config.yaml")
+    nodes, edges = synthetic_records(schema, records)
+
+    for writer_type in writer:
+        if writer_type not in WRITERS:
+            raise typer.BadParameter(f"Unknown writer type {writer_type}")
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind, items in (("nodes", nodes), ("edges", edges)):
+                best = None
+                for i in range(repeat):
+                    w = get_writer(writer_type, pathlib.Path(tmp) / kind / str(i))
+                    elapsed = time_write(w, items, kind)
+                    best = elapsed if best is None else min(best, elapsed)
+                print(f"{writer_type} {kind}: {len(items)} records in {best:.3f}s "
+                      f"({best / len(items) * 1e6:.2f} us/record)")
+
+
+if __name__ == "__main__":
+    app()
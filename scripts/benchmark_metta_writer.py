@@ -0,0 +1,114 @@
+"""
+Benchmark the batched MeTTaWriter against the line-by-line write path it replaced.
+
+The records of the selected adapter entries are loaded into memory first, so that only the
+formatting and writing of the records is timed, and both paths must produce identical files.
+
+python scripts/benchmark_metta_writer.py --adapters-config config/adapters_config_sample.yaml \
+    --entry gencode_gene --entry dbsnp_snps
+"""
+import filecmp
+import pathlib
+import sys
+import tempfile
+import time
+from typing import List
+
+import typer
+import yaml
+from typing_extensions import Annotated
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from biocypher_metta.adapter_runner import create_adapter
+from biocypher_metta.metta_writer import MeTTaWriter
+
+app = typer.Typer()
+
+
+class LegacyMeTTaWriter(MeTTaWriter):
+    """
+    The write path of MeTTaWriter before batching: one write call per line and a per-character
+    generator to escape the properties.
+    """
+    def write_nodes(self, nodes, path_prefix=None, create_dir=True):
+        file_path = f"{self.output_path}/{path_prefix}/nodes.metta"
+        pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(parents=True, exist_ok=True)
+        with open(file_path, "a") as f:
+            for node in nodes:
+                self.extract_node_info(node)
+                out_str = self.write_node(node)
+                for s in out_str:
+                    f.write(s + "\n")
+            f.write("\n")
+        return self.node_freq, self.node_props
+
+    def write_edges(self, edges, path_prefix=None, create_dir=True):
+        file_path = f"{self.output_path}/{path_prefix}/edges.metta"
+        pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(parents=True, exist_ok=True)
+        with open(file_path, "a") as f:
+            for edge in edges:
+                self.extract_edge_info(edge)
+                out_str = self.write_edge(edge)
+                for s in out_str:
+                    f.write(s + "\n")
+            f.write("\n")
+        return self.edge_freq
+
+    def check_property(self, prop):
+        if isinstance(prop, str):
+            if " " in prop:
+                prop = prop.replace(" ", "_").strip("_")
+
+            special_chars = ["(", ")"]
+            escape_char = "\\"
+            return "".join(escape_char + c if c in special_chars or c == escape_char else c for c in prop)
+
+        return prop
+
+
+def time_write(writer, records, kind):
+    start = time.perf_counter()
+    if kind == "nodes":
+        writer.write_nodes(records, path_prefix="bench")
+    else:
+        writer.write_edges(records, path_prefix="bench")
+    return time.perf_counter() - start
+
+
+@app.command()
+def main(adapters_config: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=True, dir_okay=False)],
+         entry: Annotated[List[str], typer.Option(help="Adapter entry of the config to benchmark")] = ["gencode_gene", "dbsnp_snps"],
+         repeat: int = typer.Option(3, min=1, help="Number of timed runs of each path, the best is reported"),
+         batch_lines: int = typer.Option(100000, min=1, help="batch_lines of the batched writer")):
+    with open(adapters_config) as f:
+        adapters_dict = yaml.safe_load(f)
+
+    for name in entry:
+        config = adapters_dict[name]
+        adapter = create_adapter(config, None, None, True, True)
+        for kind in ("nodes", "edges"):
+            if not config[kind]:
+                continue
+            records = list(adapter.get_nodes() if kind == "nodes" else adapter.get_edges())
+            timings = {}
+            with tempfile.TemporaryDirectory() as tmp:
+                for label, cls, kwargs in (("legacy", LegacyMeTTaWriter, {}),
+                                           ("batched", MeTTaWriter, {"batch_lines": batch_lines})):
+                    best = None
+                    for i in range(repeat):
+                        out = pathlib.Path(tmp) / label / str(i)
+                        writer = cls(schema_config="config/schema_config.yaml",
+                                     biocypher_config="config/biocypher_config.yaml", output_dir=out, **kwargs)
+                        elapsed = time_write(writer, records, kind)
+                        best = elapsed if best is None else min(best, elapsed)
+                    size = (out / "bench" / f"{kind}.metta").stat().st_size
+                    timings[label] = best
+                    print(f"{name} {kind} {label}: {len(records)} records in {best:.3f}s "
+                          f"({len(records) / best:.0f} records/s, {size / best / 2**20:.1f} MB/s)")
+                same = filecmp.cmp(pathlib.Path(tmp) / "legacy" / "0" / "bench" / f"{kind}.metta",
+                                   pathlib.Path(tmp) / "batched" / "0" / "bench" / f"{kind}.metta", shallow=False)
+            print(f"{name} {kind}: speedup {timings['legacy'] / timings['batched']:.2f}x, identical output: {same}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,42 @@
+"""
+Convert the pickled dbSNP maps into the memory-mapped stores read by create_knowledge_graph.py
+"""
+import pathlib
+import sys
+
+import typer
+from typing_extensions import Annotated
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from biocypher_metta.dbsnp_store import convert_rsid_pickle, convert_pos_pickle
+
+app = typer.Typer()
+
+
+@app.callback()
+def main():
+    """
+    Convert the pickled dbSNP maps into memory-mapped stores.
+    """
+
+
+@app.command()
+def rsids(pickle_path: Annotated[pathlib.Path, typer.Argument(exists=True, file_okay=True, dir_okay=False)],
+          output_dir: Annotated[pathlib.Path, typer.Argument(file_okay=False, dir_okay=True)]):
+    """
+    Convert a pickled rsid -> {"chr", "pos"} map into a rsid store.
+    """
+    convert_rsid_pickle(pickle_path, output_dir)
+
+
+@app.command()
+def pos(pickle_path: Annotated[pathlib.Path, typer.Argument(exists=True, file_okay=True, dir_okay=False)],
+        output_dir: Annotated[pathlib.Path, typer.Argument(file_okay=False, dir_okay=True)]):
+    """
+    Convert a pickled "<chr>_<pos>" -> rsid map into a position store.
+    """
+    convert_pos_pickle(pickle_path, output_dir)
+
+
+if __name__ == "__main__":
+    app()
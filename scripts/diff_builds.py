@@ -0,0 +1,34 @@
+"""
+Write the delta between a previous and a new build of the knowledge graph, with the load scripts
+applying only the changes to a database loaded with the previous build.
+
+python scripts/diff_builds.py --old-build output/previous --new-build output/current --delta-dir output/delta
+"""
+import pathlib
+import sys
+
+import typer
+from typing_extensions import Annotated
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from biocypher_metta.build_diff import DELTA_REPORT, diff_builds
+
+app = typer.Typer()
+
+
+@app.command()
+def main(old_build: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True,
+                                                         help="Output directory of the previous build")],
+         new_build: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True,
+                                                         help="Output directory of the new build")],
+         delta_dir: Annotated[pathlib.Path, typer.Option(file_okay=False, dir_okay=True,
+                                                         help="Directory the delta is written to")]):
+    report = diff_builds(old_build, new_build, delta_dir)
+    print(f"{report['added']} added, {report['removed']} removed and {report['changed']} changed entities "
+          f"in {len(report['files'])} files, see {delta_dir / DELTA_REPORT}")
+    if report["unsupported"]:
+        print(f"Not compared: {', '.join(report['unsupported'])}")
+
+
+if __name__ == "__main__":
+    app()
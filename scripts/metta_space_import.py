@@ -1,5 +1,6 @@
 from hyperon import *
 import typer
+from typing import Optional
 from typing_extensions import Annotated
 import pathlib
 import os
@@ -7,6 +8,14 @@ import time
 import datetime
 import resource
 import logging
+import json
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from biocypher_metta.compression import codec_of, open_binary
+from biocypher_metta.metta_writer import SHARD_MANIFEST, file_sha256
 
 app = typer.Typer()
 
@@ -46,12 +55,85 @@ def setup_logger(logger_name, log_file, level=logging.INFO):
 
     return logger
 
+def import_metta_file(metta, path):
+    """
+    Import a .metta file, decompressing it into a temporary file first if it is compressed.
+    """
+    if codec_of(path) == "none":
+        metta.import_file(str(path))
+        return
+    with tempfile.NamedTemporaryFile(suffix=".metta") as tmp:
+        with open_binary(path) as f:
+            shutil.copyfileobj(f, tmp, 1 << 20)
+        tmp.flush()
+        metta.import_file(tmp.name)
+
+
+def select_files(input_dir, shard_index=0, shard_count=1, verify=False):
+    """
+    The .metta files of input_dir the process `shard_index` out of `shard_count` imports: the
+    shard files listed in a shards.json whose shard number falls to it, and every
+    `shard_count`-th of the other files.
+    :param verify: check the shard files against the checksums of their manifest
+    """
+    sharded = {}
+    for manifest_path in input_dir.rglob(SHARD_MANIFEST):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        for entry in manifest["files"]:
+            sharded[manifest_path.parent / entry["file"]] = entry
+
+    selected = []
+    others = 0
+    for path in sorted(input_dir.rglob("*.metta*")):
+        if not path.name.endswith((".metta", ".metta.gz", ".metta.zst")):
+            continue
+        entry = sharded.get(path)
+        if entry is None:
+            mine = others % shard_count == shard_index
+            others += 1
+        else:
+            mine = entry["shard"] % shard_count == shard_index
+            if mine and verify and file_sha256(path) != entry["sha256"]:
+                raise ValueError(f"Checksum mismatch for shard file {path}")
+        if mine:
+            selected.append(path)
+    return selected
+
+
+def select_delta_files(delta_dir, input_dir, selected, shard_index=0):
+    """
+    The files of a delta written by scripts/diff_builds.py to apply on top of input_dir, the
+    removals before the additions: the delta files of the selected files of input_dir, and for the
+    first process the ones of files input_dir doesn't have.
+    """
+    selected = set(selected)
+    files = []
+    for kind in ("removed", "added"):
+        for path in sorted(delta_dir.rglob(f"*.{kind}.metta")):
+            relative = path.relative_to(delta_dir)
+            stem = relative.name[:-len(f".{kind}.metta")]
+            original = [input_dir / relative.parent / f"{stem}{suffix}" for suffix in (".metta", ".metta.gz", ".metta.zst")]
+            existing = [p for p in original if p.exists()]
+            if any(p in selected for p in existing) or (not existing and shard_index == 0):
+                files.append(path)
+    return files
+
+
 @app.command()
 def load_metta_space(input_dir: Annotated[pathlib.Path,
                         typer.Option(exists=True, file_okay=False, dir_okay=True)],
                      type_def_path: Annotated[pathlib.Path,
                         typer.Option(exists=True, file_okay=True, dir_okay=False)],
-                     log = None):
+                     log = None,
+                     shard_index: int = typer.Option(0, min=0, help="Index of this process among the processes importing the output"),
+                     shard_count: int = typer.Option(1, min=1, help="Number of processes importing the output"),
+                     verify: bool = typer.Option(False, help="Check the shard files against the checksums of shards.json"),
+                     delta_dir: Annotated[Optional[pathlib.Path],
+                        typer.Option(exists=True, file_okay=False, dir_okay=True,
+                                     help="Delta written by scripts/diff_builds.py from the build in input_dir, applied after loading it")] = None):
+    if shard_index >= shard_count:
+        raise typer.BadParameter("--shard-index must be lower than --shard-count")
 
     if log and os.path.exists(log):
         os.remove(log)
@@ -61,13 +143,20 @@ def load_metta_space(input_dir: Annotated[pathlib.Path,
     with Timer("Loading MeTTa space...", logger_name="metta_space_import"):
         metta = MeTTa(env_builder=Environment.test_env())
         logger.info(f"Loading type definitions ...")
-        metta.import_file(str(type_def_path.resolve()))
+        import_metta_file(metta, type_def_path.resolve())
         logger.debug(memory_usage("After loading type definitions"))
-        for path in input_dir.rglob("*.metta"):
+        selected = select_files(input_dir, shard_index, shard_count, verify)
+        for path in selected:
             full_path = str(path.resolve())
             logger.info(f"Loading {full_path} ...")
-            metta.import_file(full_path)
+            import_metta_file(metta, full_path)
             logger.debug(memory_usage(f"After loading {full_path}"))
+        if delta_dir is not None:
+            # the remove-atoms of the .removed.metta files run when they are imported
+            for path in select_delta_files(delta_dir, input_dir, selected, shard_index):
+                logger.info(f"Applying {path} ...")
+                import_metta_file(metta, path.resolve())
+            logger.debug(memory_usage("After applying the delta"))
 
         # get properties of (gene ENSG00000290825)
         prog1 = '''
@@ -3,8 +3,14 @@ from pathlib import Path
 import logging
 import getpass
 import argparse
+import json
+import re
+import shutil
 import sys
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from biocypher_metta.compression import open_binary, open_text, strip_suffix
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -63,8 +69,70 @@ class Neo4jLoader:
             logger.error(f"Error loading data: {str(e)}")
             return False
 
-    def process_cypher_file(self, file_path):
+    def decompress_csv(self, query):
+        """
+        LOAD CSV reads plain and gzip compressed files, decompress the zstd compressed csv files a
+        query reads next to them and point the query to the decompressed files.
+        :return: the query and the paths of the decompressed files, to remove once the query ran
+        """
+        decompressed = []
+
+        def decompress(match):
+            path = '/' + match.group(1)
+            plain = strip_suffix(path)
+            with open_binary(path) as fin, open(plain, 'wb') as fout:
+                shutil.copyfileobj(fin, fout, 1 << 20)
+            decompressed.append(Path(plain))
+            return f"file://{plain}'"
+
+        query = re.sub(r"file:///+(\S+?\.csv\.zst)'", decompress, query)
+        return query, decompressed
+
+    def params_file(self, file_path):
+        """
+        The file holding the batches of rows of the statements of a cypher file written by
+        Neo4jWriter, None for the LOAD CSV queries of Neo4jCSVWriter.
+        """
+        for suffix in ('', '.gz', '.zst'):
+            path = Path(file_path).with_suffix(f'.jsonl{suffix}')
+            if path.exists():
+                return path
+        return None
+
+    def execute_batches(self, file_path, params_path):
+        """
+        Run the statements of the file once per batch of rows of the params file, the ones not
+        reading $rows once.
+        """
         with open(file_path, 'r') as f:
+            queries = [line.strip().rstrip(';') for line in f if line.strip()]
+        batched = [query for query in queries if '$rows' in query]
+        for query in queries:
+            if query not in batched:
+                self.session.run(query).consume()
+
+        batches = rows = 0
+        with open_text(params_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                params = json.loads(line)
+                for query in batched:
+                    self.session.run(query, params).consume()
+                batches += 1
+                rows += len(params['rows'])
+        logger.info(f"Data loaded successfully. Batches: {batches}, Total rows: {rows}")
+
+    def process_cypher_file(self, file_path):
+        params_path = self.params_file(file_path)
+        if params_path is not None:
+            try:
+                self.execute_batches(file_path, params_path)
+            except Exception as e:
+                logger.error(f"Error loading data from {file_path}: {str(e)}")
+            return
+
+        with open_text(file_path) as f:
             content = f.read()
 
         queries = []
@@ -89,8 +157,13 @@ class Neo4jLoader:
                 if not self.execute_constraint_query(query):
                     logger.error(f"Failed to create constraint from {file_path}")
             elif "LOAD CSV" in query:
-                if not self.execute_load_query(query):
-                    logger.error(f"Failed to load data from {file_path}")
+                query, decompressed = self.decompress_csv(query)
+                try:
+                    if not self.execute_load_query(query):
+                        logger.error(f"Failed to load data from {file_path}")
+                finally:
+                    for path in decompressed:
+                        path.unlink(missing_ok=True)
 
     def process_all_files(self, file_paths):
         for file_path in file_paths:
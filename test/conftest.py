@@ -1,4 +1,32 @@
+import pathlib
+
+import pytest
+import yaml
+
+from biocypher_metta import schema_cache
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SCHEMA_CONFIG = str(ROOT / "config" / "schema_config.yaml")
+BIOCYPHER_CONFIG = str(ROOT / "config" / "biocypher_config.yaml")
+
+
 def pytest_addoption(parser):
     parser.addoption("--adapters-config", action="store", default="config/adapters_config_sample.yaml", help="Path to the adapter config file")
     parser.addoption("--dbsnp-rsids", action="store", help="Path to the dbsnp rsids file")
-    parser.addoption("--dbsnp-pos", action="store", help="Path to the dbsnp pos file")
\ No newline at end of file
+    parser.addoption("--dbsnp-pos", action="store", help="Path to the dbsnp pos file")
+
+
+@pytest.fixture
+def writer_schema(monkeypatch):
+    """
+    Compiled schema of the schema config for the writer tests, built from the config alone
+    instead of the ontology, which needs network access.
+    :return: the schema and biocypher config paths to create the writers with
+    """
+    with open(SCHEMA_CONFIG) as f:
+        config = yaml.safe_load(f)
+    entries = {k: v for k, v in config.items() if isinstance(v, dict) and "represented_as" in v}
+    compiled = {"version": schema_cache.SCHEMA_CACHE_VERSION, **schema_cache.compile_entries(entries),
+                "type_hierarchy": []}
+    monkeypatch.setitem(schema_cache._loaded, schema_cache.schema_key(SCHEMA_CONFIG, BIOCYPHER_CONFIG), compiled)
+    return SCHEMA_CONFIG, BIOCYPHER_CONFIG
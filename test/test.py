@@ -1,5 +1,5 @@
-import pickle
-from biocypher import BioCypher
+from biocypher_metta.dbsnp_store import load_rsid_map, load_pos_map
+from biocypher_metta.schema_cache import load_schema, convert_input_labels
 import pytest
 import yaml
 import importlib
@@ -10,51 +10,18 @@ import sys
 
 logging.basicConfig(level=logging.INFO)
 
-def convert_input_labels(label, replace_char="_"):
-    return label.replace(" ", replace_char)
-
-def parse_schema(bcy):
-    schema = bcy._get_ontology_mapping()._extend_schema()
-    edges_schema = {}
-    node_labels = set()
-
-    for k, v in schema.items():
-        if v["represented_as"] == "edge": 
-            edge_type = convert_input_labels(k)
-            source_type = v.get("source", None)
-            target_type = v.get("target", None)
-            if source_type is not None and target_type is not None:
-                if isinstance(v["input_label"], list):
-                    label = convert_input_labels(v["input_label"][0])
-                    source_type = convert_input_labels(source_type[0])
-                    target_type = convert_input_labels(target_type[0])
-                else:
-                    label = convert_input_labels(v["input_label"])
-                    source_type = convert_input_labels(source_type)
-                    target_type = convert_input_labels(target_type)
-
-                output_label = v.get("output_label", None)
-                edges_schema[label.lower()] = {"source": source_type.lower(), "target":
-                    target_type.lower(), "output_label": output_label.lower() if output_label is not None else None}
-
-        elif v["represented_as"] == "node":
-            label = v["input_label"]
-            if isinstance(label, list):
-                label = label[0]
-            label = convert_input_labels(label)
-            node_labels.add(label)
-
-    return node_labels, edges_schema
+def parse_schema(compiled_schema):
+    return set(compiled_schema["node_labels"]), compiled_schema["edges"]
     
 
 @pytest.fixture(scope="session")
 def setup_class(request):
     try:
-        bcy = BioCypher(
-            schema_config_path='config/schema_config.yaml',
-            biocypher_config_path='config/biocypher_config.yaml'
+        compiled_schema = load_schema(
+            schema_config='config/schema_config.yaml',
+            biocypher_config='config/biocypher_config.yaml'
         )
-        node_labels, edges_schema = parse_schema(bcy) 
+        node_labels, edges_schema = parse_schema(compiled_schema)
     except FileNotFoundError as e:
         pytest.fail(f"Configuration file not found: {e}")
     except yaml.YAMLError as e:
@@ -68,11 +35,11 @@ def setup_class(request):
     dbsnp_pos = request.config.getoption("--dbsnp-pos")
     if dbsnp_rsids:
         logging.info("Loading dbsnp rsids map")
-        dbsnp_rsids_dict = pickle.load(open(dbsnp_rsids, 'rb'))
+        dbsnp_rsids_dict = load_rsid_map(dbsnp_rsids)
     else:
         logging.warning("--dbsnp-rsids not provided, skipping dbsnp rsids map loading")
         dbsnp_rsids_dict = None
-    dbsnp_pos_dict = pickle.load(open(dbsnp_pos, 'rb'))
+    dbsnp_pos_dict = load_pos_map(dbsnp_pos)
    
     # Load adapters config
     with open(adapters_config_path, 'r') as f:
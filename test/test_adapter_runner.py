@@ -0,0 +1,65 @@
+"""
+Tests of the parallel runs of the adapters against the sequential run they replace.
+"""
+import pytest
+
+from biocypher_metta.adapter_runner import SHARDS_DIR, run_parallel, run_sequential
+from biocypher_metta.adapters import Adapter
+from biocypher_metta.metta_writer import MeTTaWriter
+from biocypher_metta.neo4j_csv_writer import Neo4jCSVWriter
+from biocypher_metta.prolog_writer import PrologWriter
+from biocypher_metta.schema_cache import load_schema
+
+
+class TranscriptsAdapter(Adapter):
+    """
+    Adapter of the tests, count genes with a transcript each, the ids starting with prefix.
+    """
+    def __init__(self, prefix, count, write_properties, add_provenance):
+        self.prefix = prefix
+        self.count = count
+        self.source = f"transcripts {prefix}"
+        super().__init__(write_properties, add_provenance)
+
+    def get_nodes(self):
+        for i in range(self.count):
+            yield f"{self.prefix}G{i}", "gene", {"gene_name": f"{self.prefix}{i}", "start": i}
+
+    def get_edges(self):
+        for i in range(self.count):
+            yield f"{self.prefix}G{i}", f"{self.prefix}T{i}", "transcribed_to", {"source": self.source}
+
+
+def entry(prefix, count, outdir):
+    return {"adapter": {"module": __name__, "cls": "TranscriptsAdapter", "args": {"prefix": prefix, "count": count}},
+            "outdir": outdir, "nodes": True, "edges": True}
+
+
+def read_output(output):
+    return {path.relative_to(output).as_posix(): path.read_bytes()
+            for path in sorted(output.rglob("*")) if path.is_file()}
+
+
+@pytest.mark.parametrize("writer_class", [MeTTaWriter, PrologWriter, Neo4jCSVWriter])
+def test_parallel_output_is_the_sequential_output(tmp_path, writer_schema, writer_class):
+    # the first two entries share their outdir, the entries finish out of config order
+    adapters_dict = {"first": entry("ENSA", 300, "shared"), "second": entry("ENSB", 3, "shared"),
+                     "third": entry("ENSC", 5, "other")}
+
+    schema_dict = load_schema(*writer_schema)["edges"]
+    sequential = writer_class(*writer_schema, tmp_path / "sequential")
+    sequential_totals = run_sequential(adapters_dict, sequential, None, None, True, False, schema_dict)
+    parallel = writer_class(*writer_schema, tmp_path / "parallel")
+    parallel_totals = run_parallel(adapters_dict, parallel, parallel.clone, 3, None, None, True, False, schema_dict)
+
+    expected = read_output(tmp_path / "sequential")
+    shared = b"".join(data for name, data in expected.items() if name.startswith("shared/")).lower()
+    assert b"ensag299" in shared and b"ensbg2" in shared
+    output = read_output(tmp_path / "parallel")
+    if writer_class is Neo4jCSVWriter:
+        # the load queries hold the absolute path of their csv file
+        output = {name: data.replace(b"/parallel/", b"/sequential/") for name, data in output.items()}
+    assert output == expected
+    assert not (tmp_path / "parallel" / SHARDS_DIR).exists()
+    for key in ("nodes_count", "edges_count"):
+        assert parallel_totals[key] == sequential_totals[key]
@@ -0,0 +1,139 @@
+"""
+Tests of the registry of the auxiliary maps: the memoized loads, the read-only views and the
+release of a map after the last entry reading it.
+"""
+import os
+import pickle
+
+import pytest
+
+from biocypher_metta import aux_maps
+from biocypher_metta.adapter_runner import run_sequential
+from biocypher_metta.adapters import Adapter
+from biocypher_metta.aux_maps import load_aux_map, loaded_aux_maps, map_key, plan_releases, release_finished
+from biocypher_metta.metta_writer import MeTTaWriter
+from biocypher_metta.schema_cache import load_schema
+
+# the keys of the maps loaded when each MapAdapter started writing its nodes
+seen = []
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    aux_maps._maps.clear()
+    seen.clear()
+    yield
+    aux_maps._maps.clear()
+
+
+def dump(path, value):
+    with open(path, "wb") as f:
+        pickle.dump(value, f)
+
+
+class CountingLoader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def test_loads_are_memoized_by_realpath(tmp_path):
+    dump(tmp_path / "hgnc_to_ensembl.pkl", {"TP53": "ENSG00000141510"})
+    os.symlink(tmp_path / "hgnc_to_ensembl.pkl", tmp_path / "link.pkl")
+    loader = CountingLoader()
+
+    first = load_aux_map(str(tmp_path / "hgnc_to_ensembl.pkl"), loader)
+    assert load_aux_map(str(tmp_path / "link.pkl"), loader) is first
+    assert load_aux_map(str(tmp_path / "." / "hgnc_to_ensembl.pkl"), loader) is first
+    assert loader.calls == 1
+    assert loaded_aux_maps() == [map_key(tmp_path / "hgnc_to_ensembl.pkl")]
+
+
+def test_changed_maps_are_reloaded(tmp_path):
+    path = tmp_path / "hgnc_to_ensembl.pkl"
+    dump(path, {"TP53": "ENSG00000141510"})
+    loader = CountingLoader()
+    assert dict(load_aux_map(path, loader)) == {"TP53": "ENSG00000141510"}
+
+    # a different size
+    dump(path, {"TP53": "ENSG00000141510", "BRCA1": "ENSG00000012048"})
+    assert dict(load_aux_map(path, loader)) == {"TP53": "ENSG00000141510", "BRCA1": "ENSG00000012048"}
+    # the same size, a different mtime
+    dump(path, {"TP53": "ENSG00000141510", "BRCA2": "ENSG00000139618"})
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert dict(load_aux_map(path, loader)) == {"TP53": "ENSG00000141510", "BRCA2": "ENSG00000139618"}
+    assert loader.calls == 3
+    assert load_aux_map(path, loader)["BRCA2"] == "ENSG00000139618" and loader.calls == 3
+
+
+def test_dict_maps_are_read_only(tmp_path):
+    dump(tmp_path / "tissues.pkl", {"liver": "UBERON:0002107"})
+    tissues = load_aux_map(tmp_path / "tissues.pkl")
+    with pytest.raises(TypeError):
+        tissues["blood"] = "UBERON:0000178"
+    with pytest.raises(AttributeError):
+        tissues.pop("liver")
+    assert tissues.get("liver") == "UBERON:0002107" and "liver" in tissues
+
+    # other maps are returned as loaded
+    dump(tmp_path / "names.pkl", ["liver"])
+    assert load_aux_map(tmp_path / "names.pkl") == ["liver"]
+
+
+def test_maps_are_released_after_their_last_unit(tmp_path):
+    for name in ("a", "b"):
+        dump(tmp_path / f"{name}.pkl", {name: name})
+    adapters_dict = {name: {"adapter": {"args": {"map": str(tmp_path / f"{path}.pkl"), "filepath": "x.tsv"}}}
+                     for name, path in [("first", "a"), ("second", "b"), ("third", "a"), ("fourth", "b")]}
+    adapters_dict["rsids"] = {"adapter": {"args": {"dbsnp_rsid_map": None}}}
+    units = [("first",), ("second", "third"), ("rsids",), ("fourth",)]
+    dbsnp_paths = {"dbsnp_rsid_map": str(tmp_path / "dbsnp"), "dbsnp_pos_map": None}
+    last_use = plan_releases(adapters_dict, units, dbsnp_paths)
+    assert last_use == {map_key(tmp_path / "a.pkl"): 1, map_key(tmp_path / "b.pkl"): 3,
+                        map_key(tmp_path / "dbsnp"): 2}
+
+    for name in ("a", "b"):
+        load_aux_map(tmp_path / f"{name}.pkl")
+    release_finished(last_use, 0)
+    assert len(loaded_aux_maps()) == 2
+    release_finished(last_use, 1)
+    assert loaded_aux_maps() == [map_key(tmp_path / "b.pkl")]
+    release_finished(last_use, 3)
+    assert loaded_aux_maps() == []
+
+
+class MapAdapter(Adapter):
+    """
+    Adapter of the tests, a gene per entry of the auxiliary map at map_path.
+    """
+    def __init__(self, map_path, write_properties, add_provenance):
+        self.map = load_aux_map(map_path)
+        super().__init__(write_properties, add_provenance)
+
+    def get_nodes(self):
+        seen.append(sorted(loaded_aux_maps()))
+        for symbol, id in self.map.items():
+            yield id, "gene", {"gene_name": symbol}
+
+    def get_edges(self):
+        return iter([])
+
+
+def test_run_releases_a_map_after_its_last_entry(tmp_path, writer_schema):
+    dump(tmp_path / "a.pkl", {"TP53": "ENSG00000141510"})
+    dump(tmp_path / "b.pkl", {"BRCA1": "ENSG00000012048"})
+    a, b = map_key(tmp_path / "a.pkl"), map_key(tmp_path / "b.pkl")
+    adapters_dict = {name: {"adapter": {"module": __name__, "cls": "MapAdapter", "args": {"map_path": str(tmp_path / path)}},
+                            "outdir": name, "nodes": True, "edges": False}
+                     for name, path in [("first", "a.pkl"), ("second", "b.pkl"), ("third", "a.pkl"), ("fourth", "b.pkl")]}
+
+    writer = MeTTaWriter(*writer_schema, tmp_path / "output")
+    run_sequential(adapters_dict, writer, None, None, True, False, load_schema(*writer_schema)["edges"])
+    # a is released once the third entry ran, b once the fourth entry ran
+    assert seen == [[a], sorted([a, b]), sorted([a, b]), [b]]
+    assert loaded_aux_maps() == []
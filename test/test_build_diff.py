@@ -0,0 +1,154 @@
+"""
+Tests of the delta between two builds, on builds written to temporary directories.
+"""
+import csv
+import json
+
+import pytest
+
+from biocypher_metta.build_diff import (CSVDelta, DELTA_REPORT, MeTTaDelta, PROLOG_LOADER, PrologDelta,
+                                        diff_builds, diff_file)
+
+NODE_QUERY = """
+CALL apoc.periodic.iterate(
+    "LOAD CSV WITH HEADERS FROM 'file:///{path}' AS row FIELDTERMINATOR '|' RETURN row",
+    "MERGE (n:gene {{id: row.id}})
+    SET n += apoc.map.removeKeys(row, ['id'])",
+    {{batchSize:1000, parallel:true, concurrency:4}}
+)
+YIELD batches, total
+RETURN batches, total;
+"""
+
+EDGE_QUERY = """
+CALL apoc.periodic.iterate(
+    "LOAD CSV WITH HEADERS FROM 'file:///{path}' AS row FIELDTERMINATOR '|' RETURN row",
+    "MATCH (source:row.source_type {{id: row.source_id}})
+    MATCH (target:row.target_type {{id: row.target_id}})
+    MERGE (source)-[r:transcribed_to]->(target)
+    SET r += apoc.map.removeKeys(row, ['source_id', 'target_id', 'label', 'source_type', 'target_type'])",
+    {{batchSize:1000}}
+)
+YIELD batches, total
+RETURN batches, total;
+"""
+
+
+def write_lines(path, lines):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(line + "\n" for line in lines))
+    return path
+
+
+def write_csv(path, query, rows):
+    write_lines(path, rows)
+    path.with_suffix(".cypher").write_text(query.format(path=path))
+    return path
+
+
+def read_lines(path):
+    return path.read_text().splitlines()
+
+
+@pytest.mark.parametrize("run_lines", [1, 2, 1000])
+def test_diff_file_classifies_the_entities(tmp_path, run_lines):
+    old = write_lines(tmp_path / "old" / "nodes.metta", [
+        "(gene ensg1)", "(gene_name (gene ensg1) a)", "(gene ensg2)", "(gene ensg4)", "(gene ensg4)"])
+    new = write_lines(tmp_path / "new" / "nodes.metta", [
+        "(gene ensg4)", "(gene ensg3)", "(gene_name (gene ensg1) b)", "(gene ensg1)"])
+    delta = MeTTaDelta(old, new, tmp_path / "delta", "nodes")
+    counts = diff_file(old, new, delta, tmp_path, run_lines=run_lines)
+    delta.close()
+
+    assert counts == {"added": 1, "removed": 1, "changed": 1, "unchanged": 1}
+    assert sorted(read_lines(tmp_path / "delta" / "nodes.added.metta")) == ["(gene ensg3)", "(gene_name (gene ensg1) b)"]
+    assert sorted(read_lines(tmp_path / "delta" / "nodes.removed.metta")) == [
+        "!(remove-atom &self (gene ensg2))", "!(remove-atom &self (gene_name (gene ensg1) a))"]
+
+
+def test_diff_file_of_an_added_file(tmp_path):
+    new = write_lines(tmp_path / "nodes.pl", ["gene(ensg1).", "gene(ensg2)."])
+    delta = PrologDelta(None, new, tmp_path / "delta", "nodes")
+    assert diff_file(None, new, delta, tmp_path) == {"added": 2, "removed": 0, "changed": 0, "unchanged": 0}
+    assert [path.name for path in delta.close()] == ["nodes.added.pl"]
+
+
+def test_csv_keys(tmp_path):
+    edges = write_csv(tmp_path / "edges_transcribed_to.csv", EDGE_QUERY, [])
+    delta = CSVDelta(edges, edges, tmp_path / "delta", "edges_transcribed_to")
+    # an edge is its source, target and label, its properties change
+    assert delta.key("gene|ensg1|transcript|enst1|transcribed_to|GENCODE") == \
+        delta.key("gene|ensg1|transcript|enst1|transcribed_to|other")
+    assert delta.key("gene|ensg1|transcript|enst1|transcribed_to") != \
+        delta.key("gene|ensg1|transcript|enst2|transcribed_to")
+    assert delta.key("gene|ensg1|transcript|enst1|transcribed_to") != \
+        delta.key("gene|ensg1|transcript|enst1|transcribed_from")
+
+    nodes = write_csv(tmp_path / "nodes_gene.csv", NODE_QUERY, [])
+    assert CSVDelta(nodes, nodes, tmp_path / "delta", "nodes_gene").key('"ensg|1"|gene|x') == "ensg|1"
+
+
+def test_diff_builds(tmp_path):
+    old, new, out = tmp_path / "old", tmp_path / "new", tmp_path / "delta"
+    write_lines(old / "gencode" / "nodes.metta", ["(gene ensg1)", "(gene ensg2)"])
+    write_lines(new / "gencode" / "nodes.metta", ["(gene ensg1)", "(gene ensg3)"])
+    write_lines(old / "gencode" / "nodes.pl", ["gene(ensg1).", "gene_name(gene(ensg1), a).", "gene(ensg2)."])
+    write_lines(new / "gencode" / "nodes.pl", ["gene(ensg1).", "gene_name(gene(ensg1), b)."])
+    write_lines(new / "gencode" / "load.pl", [":- consult('nodes.pl')."])
+    write_csv(old / "gencode" / "nodes_gene.csv", NODE_QUERY, ["id|label|gene_name", "ensg1|gene|A", "ensg2|gene|B"])
+    write_csv(new / "gencode" / "nodes_gene.csv", NODE_QUERY, ["id|label|gene_name", "ensg1|gene|C", "ensg3|gene|D"])
+    write_csv(old / "gencode" / "edges_transcribed_to.csv", EDGE_QUERY, [
+        "source_type|source_id|target_type|target_id|label|source",
+        "gene|ensg1|transcript|enst1|transcribed_to|GENCODE",
+        "gene|ensg2|transcript|enst2|transcribed_to|GENCODE"])
+    write_csv(new / "gencode" / "edges_transcribed_to.csv", EDGE_QUERY, [
+        "source_type|source_id|target_type|target_id|label|source",
+        "gene|ensg1|transcript|enst1|transcribed_to|GENCODE"])
+    write_lines(new / "gencode" / "nodes_gene-00000.parquet", [])
+
+    report = diff_builds(old, new, out)
+    assert json.loads((out / DELTA_REPORT).read_text()) == report
+    assert report["unsupported"] == ["gencode/load.pl", "gencode/nodes_gene-00000.parquet"]
+    assert report["files"]["gencode/nodes.metta"]["added"] == 1
+    assert report["files"]["gencode/nodes.pl"] == {"added": 0, "removed": 1, "changed": 1, "unchanged": 0,
+                                                   "file": "compared",
+                                                   "delta": ["gencode/nodes.removed.pl", "gencode/nodes.added.pl"]}
+
+    assert read_lines(out / "gencode" / "nodes.removed.metta") == ["!(remove-atom &self (gene ensg2))"]
+    assert sorted(read_lines(out / "gencode" / "nodes.removed.pl")) == [
+        ":- retract(gene(ensg2)).", ":- retract(gene_name(gene(ensg1), a))."]
+    assert read_lines(out / "gencode" / "nodes.added.pl") == ["gene_name(gene(ensg1), b)."]
+    assert read_lines(out / PROLOG_LOADER)[1:] == [":- consult('gencode/nodes.removed.pl').",
+                                                   ":- consult('gencode/nodes.added.pl')."]
+
+    with open(out / "gencode" / "nodes_gene.csv", newline="") as f:
+        assert list(csv.reader(f, delimiter="|")) == [["id", "label", "gene_name"], ["ensg1", "gene", "C"],
+                                                      ["ensg3", "gene", "D"]]
+    assert read_lines(out / "gencode" / "nodes_gene.delete.csv") == ["id|label|gene_name", "ensg2|gene|B"]
+    assert str((out / "gencode" / "nodes_gene.csv").resolve()) in (out / "gencode" / "nodes_gene.cypher").read_text()
+    assert "MATCH (n:gene {id: row.id}) DETACH DELETE n" in (out / "gencode" / "nodes_gene.delete.cypher").read_text()
+    # the changed node ensg1 gets the properties of its new row only
+    assert "SET n = apoc.map.removeKeys(row, ['id']), n.id = row.id\"" in (out / "gencode" / "nodes_gene.cypher").read_text()
+    assert report["files"]["gencode/edges_transcribed_to.csv"]["removed"] == 1
+    assert read_lines(out / "gencode" / "edges_transcribed_to.delete.csv")[1:] == [
+        "gene|ensg2|transcript|enst2|transcribed_to|GENCODE"]
+    assert "-[r:transcribed_to]->" in (out / "gencode" / "edges_transcribed_to.delete.cypher").read_text()
+    assert not (out / "gencode" / "edges_transcribed_to.csv").exists()
+
+
+def test_changed_edges_replace_their_properties(tmp_path):
+    header = "source_type|source_id|target_type|target_id|label|source|score"
+    old = write_csv(tmp_path / "old" / "edges_transcribed_to.csv", EDGE_QUERY, [
+        header, "gene|ensg1|transcript|enst1|transcribed_to|GENCODE|0.5"])
+    new = write_csv(tmp_path / "new" / "edges_transcribed_to.csv", EDGE_QUERY, [
+        header, "gene|ensg1|transcript|enst1|transcribed_to|GENCODE|"])
+    delta = CSVDelta(old, new, tmp_path / "delta", "edges_transcribed_to")
+    assert diff_file(old, new, delta, tmp_path)["changed"] == 1
+    delta.close()
+
+    query = (tmp_path / "delta" / "edges_transcribed_to.cypher").read_text()
+    assert "SET r = apoc.map.removeKeys(row, ['source_id', 'target_id', 'label', 'source_type', 'target_type'])\"" \
+        in query
+    assert "+=" not in query
+    assert read_lines(tmp_path / "delta" / "edges_transcribed_to.csv") == [
+        header, "gene|ensg1|transcript|enst1|transcribed_to|GENCODE|"]
@@ -0,0 +1,146 @@
+"""
+Tests of the fingerprints of the build manifest and of the incremental builds that rely on them.
+"""
+import json
+import shutil
+
+import pytest
+
+from biocypher_metta import build_manifest
+from biocypher_metta.adapter_runner import SHARDS_DIR, run_incremental, shard_dir_for
+from biocypher_metta.adapters import Adapter
+from biocypher_metta.build_manifest import BuildManifest, imported_modules, module_file
+from biocypher_metta.metta_writer import MeTTaWriter
+
+# names of the entries whose adapter was created, in order
+created = []
+
+
+class LinesAdapter(Adapter):
+    """
+    Adapter of the tests, a gene node for every line of its input.
+    """
+    def __init__(self, filepath, write_properties, add_provenance, prefix=""):
+        created.append(prefix)
+        self.filepath = filepath
+        self.prefix = prefix
+        self.source = "lines"
+        super().__init__(write_properties, add_provenance)
+
+    def get_nodes(self):
+        with open(self.filepath) as f:
+            for line in f:
+                yield line.strip(), "gene", {"gene_name": self.prefix + line.strip()}
+
+
+def entry(filepath, prefix="", outdir="lines"):
+    return {"adapter": {"module": __name__, "cls": "LinesAdapter",
+                        "args": {"filepath": str(filepath), "prefix": prefix}},
+            "outdir": outdir, "nodes": True, "edges": False}
+
+
+@pytest.fixture
+def build(writer_schema, tmp_path):
+    """
+    :return: a function running an incremental build of the adapters config into tmp_path / "output"
+        and returning the MeTTa output of the "lines" outdir
+    """
+    output = tmp_path / "output"
+
+    def run(adapters_dict):
+        created.clear()
+        output.mkdir(exist_ok=True)
+        writer = MeTTaWriter(*writer_schema, output)
+        manifest = BuildManifest(output, "metta", True, False, writer_class=MeTTaWriter)
+        run_incremental(adapters_dict, writer, lambda path: writer.clone(path), 1, manifest, None, None,
+                        True, False, {})
+        return (output / "lines" / "nodes.metta").read_text()
+    return run
+
+
+def test_is_clean_and_record(tmp_path):
+    genes = tmp_path / "genes.txt"
+    genes.write_text("ensg1\n")
+    shard_dir = tmp_path / "shard"
+    config = entry(genes)
+    manifest = BuildManifest(tmp_path, "metta", True, False, writer_class=MeTTaWriter)
+    assert not manifest.is_clean("genes", config, shard_dir)
+    manifest.record("genes", {"nodes_count": {"gene": 1}, "nodes_props": {"gene": {"gene_name"}},
+                              "edges_count": {}, "datasets": {}})
+    manifest.save()
+
+    manifest = BuildManifest(tmp_path, "metta", True, False, writer_class=MeTTaWriter)
+    # the shard of the entry is gone
+    assert not manifest.is_clean("genes", config, shard_dir)
+    shard_dir.mkdir()
+    assert manifest.is_clean("genes", config, shard_dir)
+    assert manifest.result("genes")["nodes_props"] == {"gene": {"gene_name"}}
+    assert not manifest.is_clean("genes", entry(genes, prefix="x"), shard_dir)
+    assert not BuildManifest(tmp_path, "metta", False, False, writer_class=MeTTaWriter).is_clean(
+        "genes", config, shard_dir)
+    assert not BuildManifest(tmp_path, "prolog", True, False, writer_class=MeTTaWriter).is_clean(
+        "genes", config, shard_dir)
+    genes.write_text("ensg2\n")
+    assert not manifest.is_clean("genes", config, shard_dir)
+
+
+def test_fingerprint_covers_the_imported_modules(tmp_path, monkeypatch):
+    package = tmp_path / "biocypher_metta"
+    shutil.copytree(build_manifest.PACKAGE_DIR, package, ignore=shutil.ignore_patterns("__pycache__"))
+    monkeypatch.setattr(build_manifest, "PACKAGE_DIR", package)
+    config = {"adapter": {"module": "biocypher_metta.adapters.tadmap_adapter", "cls": "TADMapAdapter",
+                          "args": {}}, "outdir": "tadmap", "nodes": True, "edges": False}
+
+    def fingerprint():
+        return BuildManifest(tmp_path, "metta", True, False, writer_class=MeTTaWriter).fingerprint("tadmap", config)
+    fingerprints = [fingerprint()]
+    for module in ("adapters/tadmap_adapter.py", "adapters/helpers.py", "regions.py", "metta_writer.py",
+                   "__init__.py", "compression.py"):
+        with open(package / module, "a") as f:
+            f.write("\n# changed\n")
+        fingerprints.append(fingerprint())
+    assert len(set(fingerprints)) == len(fingerprints)
+    # a module neither imports
+    with open(package / "adapters" / "gwas_adapter.py", "a") as f:
+        f.write("\n# changed\n")
+    assert fingerprint() == fingerprints[-1]
+
+
+def test_imported_modules():
+    modules = imported_modules(module_file("biocypher_metta.adapters.tadmap_adapter"))
+    assert "biocypher_metta.adapters" in modules and "biocypher_metta.adapters.helpers" in modules
+    assert module_file("biocypher_metta.adapters.helpers.check_genomic_location") is None
+    assert module_file("biocypher_metta").name == "__init__.py"
+
+
+def test_run_incremental_skips_the_clean_entries(build, tmp_path):
+    genes, more_genes = tmp_path / "genes.txt", tmp_path / "more_genes.txt"
+    genes.write_text("ensg1\nensg2\n")
+    more_genes.write_text("ensg3\n")
+    adapters = {"genes": entry(genes, "a"), "more_genes": entry(more_genes, "b")}
+
+    first = build(adapters)
+    assert created == ["a", "b"]
+    assert first.index("ensg1") < first.index("ensg3")
+    assert build(adapters) == first
+    assert created == []
+    manifest = json.loads((tmp_path / "output" / BuildManifest.FILE_NAME).read_text())
+    assert set(manifest["entries"]) == {"genes", "more_genes"}
+
+    # an input change reruns the entry, the output keeps the config order
+    genes.write_text("ensg1\nensg4\n")
+    changed = build(adapters)
+    assert created == ["a"]
+    assert "ensg4" in changed and "ensg2" not in changed and changed.index("ensg4") < changed.index("ensg3")
+
+    # an args change
+    adapters["more_genes"] = entry(more_genes, "c")
+    changed = build(adapters)
+    assert created == ["c"]
+    assert "censg3" in changed and "bensg3" not in changed
+
+    # a removed entry drops its shard and its output
+    del adapters["genes"]
+    assert "ensg1" not in build(adapters)
+    assert created == []
+    assert not shard_dir_for(tmp_path / "output" / SHARDS_DIR, "genes").exists()
@@ -0,0 +1,57 @@
+"""
+Tests of the counters of the build metrics, on adapters run over the sample files.
+"""
+import gzip
+import pathlib
+
+from biocypher_metta.adapters.tflink_adapter import TFLinkAdapter
+from biocypher_metta.adapters.uniprot_protein_adapter import UniprotProteinAdapter
+from biocypher_metta.build_metrics import PhaseMetrics
+from biocypher_metta.metta_writer import MeTTaWriter
+from biocypher_metta.prolog_writer import PrologWriter
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SAMPLES = ROOT / "samples"
+AUX_FILES = ROOT / "aux_files"
+
+
+def output_size(directory):
+    return sum(f.stat().st_size for f in directory.rglob("*") if f.is_file())
+
+
+def test_counters_of_an_adapter_reading_with_open_input(writer_schema, tmp_path):
+    writer = MeTTaWriter(*writer_schema, tmp_path)
+    adapter = UniprotProteinAdapter(str(SAMPLES / "uniprot_sprot_human_sample.dat.gz"), True, False)
+    with PhaseMetrics(tmp_path / "uniprot", "nodes") as phase:
+        freq, _ = writer.write_nodes(adapter.get_nodes(), path_prefix="uniprot")
+        phase.records = sum(freq.values())
+
+    metrics = phase.metrics
+    assert metrics["records"] == freq["protein"] > 0
+    assert metrics["bytes_written"] == output_size(tmp_path / "uniprot") > 0
+    assert metrics["input_bytes_read"] == (SAMPLES / "uniprot_sprot_human_sample.dat.gz").stat().st_size
+    with gzip.open(SAMPLES / "uniprot_sprot_human_sample.dat.gz", "rb") as f:
+        assert metrics["input_bytes_decompressed"] == len(f.read())
+
+
+def test_counters_of_the_clustered_prolog_layout(writer_schema, tmp_path):
+    writer = PrologWriter(*writer_schema, tmp_path, clustered=True)
+    adapter = UniprotProteinAdapter(str(SAMPLES / "uniprot_sprot_human_sample.dat.gz"), True, False)
+    with PhaseMetrics(tmp_path / "tf", "nodes") as nodes:
+        freq, _ = writer.write_nodes(adapter.get_nodes(), path_prefix="tf")
+        nodes.records = sum(freq.values())
+    written = output_size(tmp_path / "tf")
+    adapter = TFLinkAdapter(str(SAMPLES / "tflink_homo_sapiens_interactions.tsv.gz"),
+                            str(AUX_FILES / "entrez_to_ensembl.pkl"), True, False)
+    with PhaseMetrics(tmp_path / "tf", "edges") as edges:
+        edges.records = sum(writer.write_edges(adapter.get_edges(), path_prefix="tf").values())
+
+    assert nodes.metrics["records"] > 0 and edges.metrics["records"] > 0
+    # the predicate files of the clustered layout are named after neither phase
+    assert not any(f.name.startswith(("nodes", "edges")) for f in (tmp_path / "tf").iterdir())
+    assert nodes.metrics["bytes_written"] == written > 0
+    assert edges.metrics["bytes_written"] == output_size(tmp_path / "tf") - written > 0
+    assert nodes.metrics["input_bytes_read"] > 0
+    # the adapter opens its input with gzip.open, its reads are not measured
+    assert edges.metrics["input_bytes_read"] is None
+    assert edges.metrics["input_bytes_decompressed"] is None
@@ -0,0 +1,164 @@
+"""
+Tests of the compressed output streams: appended gzip members and zstd frames, the encoding of the
+text, and the loaders reading the compressed output.
+"""
+import importlib.util
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+from biocypher_metta.compression import Compression, codec_of, open_binary, open_text, strip_suffix
+from biocypher_metta.metta_writer import MeTTaWriter
+
+SCRIPTS = pathlib.Path(__file__).resolve().parent.parent / "scripts"
+CODECS = ["none", "gzip", pytest.param("zstd", marks=pytest.mark.skipif(
+    importlib.util.find_spec("zstandard") is None, reason="zstandard is not installed"))]
+
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write(compression, path, mode, text):
+    with compression.open(path, mode) as f:
+        f.write(text)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_appended_members_read_as_the_concatenation(tmp_path, codec):
+    compression = Compression(codec)
+    path = tmp_path / f"nodes.metta{compression.suffix}"
+    write(compression, path, "w", "(gene ensg1)\n")
+    write(compression, path, "a", "(gene ensg2)\n")
+    write(compression, path, "a", "")
+    write(compression, path, "a", "(gene ensg3)\n" * 1000)
+    assert codec_of(path) == codec and strip_suffix(path) == str(tmp_path / "nodes.metta")
+    with open_text(path) as f:
+        assert f.read() == "(gene ensg1)\n(gene ensg2)\n" + "(gene ensg3)\n" * 1000
+    with open_binary(path) as f:
+        assert f.read(6) == b"(gene "
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_merged_shards_read_as_the_concatenation(tmp_path, writer_schema, codec):
+    writer = MeTTaWriter(*writer_schema, tmp_path / "output", compression=Compression(codec))
+    writer.write_nodes([("ENSG1", "gene", {})], path_prefix="gencode")
+    for i in (2, 3):
+        shard = writer.clone(tmp_path / f"shard{i}")
+        shard.write_nodes([(f"ENSG{i}", "gene", {})], path_prefix="gencode")
+        writer.merge_shard(tmp_path / f"shard{i}")
+    with open_text(writer.output_file(tmp_path / "output" / "gencode" / "nodes.metta")) as f:
+        assert [line for line in f.read().splitlines() if line] == ["(gene ENSG1)", "(gene ENSG2)", "(gene ENSG3)"]
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_text_is_utf8_whatever_the_locale(tmp_path, codec):
+    path = tmp_path / f"nodes.metta{Compression(codec).suffix}"
+    text = '(gene_name (gene x) "α–β")'
+    # the script is ascii, the arguments of the process are decoded with the locale encoding
+    script = (f"from biocypher_metta.compression import Compression, open_text\n"
+              f"with Compression({codec!r}).open({str(path)!a}, 'w') as f: f.write({text!a})\n"
+              f"with open_text({str(path)!a}) as f: assert f.read() == {text!a}\n")
+    # an ascii locale, without the coercion of the C locale to utf-8
+    env = {"LC_ALL": "C", "PYTHONCOERCECLOCALE": "0", "PYTHONUTF8": "0", "PYTHONPATH": str(SCRIPTS.parent)}
+    subprocess.run([sys.executable, "-c", script], env=env, cwd=tmp_path, check=True, capture_output=True)
+    with open_binary(path) as f:
+        assert f.read() == text.encode("utf-8")
+
+
+class RecordingSession:
+    """
+    Neo4j session stand-in recording the queries, and the csv files they load when they run.
+    """
+    def __init__(self):
+        self.queries = []
+        self.loaded = []
+
+    def run(self, query, params=None):
+        self.queries.append((query, params))
+        for path in query.split("file://")[1:]:
+            self.loaded.append(pathlib.Path(path.split("'")[0]).read_text())
+        return self
+
+    def consume(self):
+        pass
+
+    def __iter__(self):
+        return iter([{"batches": 1, "total": 2}])
+
+
+@pytest.fixture
+def neo4j_loader():
+    pytest.importorskip("neo4j")
+    pytest.importorskip("zstandard")
+    loader = load_script("neo4j_loader").Neo4jLoader("bolt://localhost:7687", "neo4j", "")
+    loader.session = RecordingSession()
+    return loader
+
+
+def test_neo4j_loader_decompresses_zstd_csv(tmp_path, neo4j_loader):
+    compression = Compression("zstd")
+    csv_path = tmp_path / "nodes_gene.csv.zst"
+    write(compression, csv_path, "w", "id|label\nensg1|gene\n")
+    write(compression, csv_path, "a", "ensg2|gene\n")
+    query_path = tmp_path / "nodes_gene.cypher"
+    query_path.write_text(f"""
+CALL apoc.periodic.iterate(
+    "LOAD CSV WITH HEADERS FROM 'file:///{csv_path.as_posix()}' AS row FIELDTERMINATOR '|' RETURN row",
+    "MERGE (n:gene {{id: row.id}})",
+    {{batchSize:1000}}
+)
+YIELD batches, total
+RETURN batches, total;
+""")
+    neo4j_loader.process_cypher_file(query_path)
+    [(query, _)] = neo4j_loader.session.queries
+    assert f"file://{tmp_path.as_posix()}/nodes_gene.csv'" in query
+    assert neo4j_loader.session.loaded == ["id|label\nensg1|gene\nensg2|gene\n"]
+    # the decompressed file is removed once the query ran
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["nodes_gene.csv.zst", "nodes_gene.cypher"]
+
+
+def test_neo4j_loader_reads_zstd_batches(tmp_path, neo4j_loader):
+    compression = Compression("zstd")
+    query_path = tmp_path / "nodes_gene.cypher"
+    query_path.write_text("UNWIND $rows AS row MERGE (n:gene {id: row.id});\n")
+    write(compression, tmp_path / "nodes_gene.jsonl.zst", "w", '{"rows": [{"id": "ensg1"}]}\n')
+    write(compression, tmp_path / "nodes_gene.jsonl.zst", "a", '{"rows": [{"id": "ensg2"}, {"id": "ensg3"}]}\n')
+    assert neo4j_loader.params_file(query_path) == tmp_path / "nodes_gene.jsonl.zst"
+    neo4j_loader.process_cypher_file(query_path)
+    assert [params for _, params in neo4j_loader.session.queries] == [
+        {"rows": [{"id": "ensg1"}]}, {"rows": [{"id": "ensg2"}, {"id": "ensg3"}]}]
+
+
+class RecordingMeTTa:
+    """
+    MeTTa runner stand-in recording the content of the files it imports.
+    """
+    def __init__(self):
+        self.imported = []
+
+    def import_file(self, path):
+        self.imported.append(pathlib.Path(path).read_text())
+
+
+def test_metta_space_import_reads_zstd_files(tmp_path):
+    pytest.importorskip("hyperon")
+    pytest.importorskip("zstandard")
+    metta_space_import = load_script("metta_space_import")
+    compression = Compression("zstd")
+    write(compression, tmp_path / "nodes.metta.zst", "w", "(gene ensg1)\n")
+    write(compression, tmp_path / "nodes.metta.zst", "a", "(gene ensg2)\n")
+    (tmp_path / "edges.metta").write_text("(transcribed_to (gene ensg1) (transcript enst1))\n")
+
+    files = metta_space_import.select_files(tmp_path)
+    assert files == [tmp_path / "edges.metta", tmp_path / "nodes.metta.zst"]
+    metta = RecordingMeTTa()
+    for path in files:
+        metta_space_import.import_metta_file(metta, path)
+    assert metta.imported == ["(transcribed_to (gene ensg1) (transcript enst1))\n", "(gene ensg1)\n(gene ensg2)\n"]
@@ -0,0 +1,110 @@
+"""
+Tests of the memory-mapped dbSNP stores against the pickled sample maps they replace.
+"""
+import pathlib
+import pickle
+
+import pytest
+
+from biocypher_metta.dbsnp_store import (DbsnpPosStore, DbsnpRsidStore, build_pos_store, build_rsid_store,
+                                         convert_pos_pickle, convert_rsid_pickle, load_pos_map, load_rsid_map,
+                                         lookup_rsids)
+
+AUX_FILES = pathlib.Path(__file__).resolve().parent.parent / "aux_files"
+RSID_PICKLE = AUX_FILES / "sample_dbsnp_rsids.pkl"
+POS_PICKLE = AUX_FILES / "sample_dbsnp_pos.pkl"
+
+
+def load_pickle(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+@pytest.fixture
+def rsid_store(tmp_path):
+    convert_rsid_pickle(RSID_PICKLE, tmp_path / "rsids")
+    return load_rsid_map(tmp_path / "rsids")
+
+
+@pytest.fixture
+def pos_store(tmp_path):
+    convert_pos_pickle(POS_PICKLE, tmp_path / "pos")
+    return load_pos_map(tmp_path / "pos")
+
+
+def test_rsid_store_round_trip(rsid_store):
+    rsid_map = load_pickle(RSID_PICKLE)
+    assert isinstance(rsid_store, DbsnpRsidStore)
+    assert len(rsid_store) == len(rsid_map)
+    assert dict(rsid_store.items()) == rsid_map
+    assert "rs1" not in rsid_store
+    with pytest.raises(KeyError):
+        rsid_store["rs1"]
+    # a worker process maps the same files
+    assert dict(pickle.loads(pickle.dumps(rsid_store)).items()) == rsid_map
+
+
+def test_pos_store_round_trip(pos_store):
+    pos_map = load_pickle(POS_PICKLE)
+    assert isinstance(pos_store, DbsnpPosStore)
+    assert len(pos_store) == len(pos_map)
+    assert dict(pos_store.items()) == pos_map
+    # the header row of the sample map is kept
+    assert pos_store["chr16_Position"] == "rsID"
+    for key, rsid in pos_map.items():
+        chr, _, pos = key.rpartition("_")
+        if pos.isdigit():
+            assert pos_store.lookup(chr, int(pos)) == rsid
+    assert pos_store.get("chr16_1") is None
+    assert pos_store.lookup("chr99", 10038) is None
+
+
+def test_lookup_many(pos_store):
+    pos_map = load_pickle(POS_PICKLE)
+    positions = sorted(int(key.rpartition("_")[2]) for key in pos_map if key.rpartition("_")[2].isdigit())
+    # misses before, between and after the positions of the chromosome, and repeated positions
+    queries = [0, positions[0], positions[0] + 1, *positions[:50], positions[-1], positions[-1] + 1, positions[3]]
+    expected = [pos_map.get(f"chr16_{pos}") for pos in queries]
+    assert pos_store.lookup_many("chr16", queries) == expected
+    assert lookup_rsids(pos_store, "chr16", queries) == lookup_rsids(pos_map, "chr16", queries) == expected
+    assert pos_store.lookup_many("chr1", queries) == [None] * len(queries)
+    assert pos_store.lookup_many("chr16", []) == []
+
+
+def test_leading_zeros_are_other_ids(tmp_path):
+    build_rsid_store([("rs1", "chr1", 10), ("rs01", "chr2", 20), ("rs0", "chr3", 30)], tmp_path / "rsids")
+    store = DbsnpRsidStore(tmp_path / "rsids")
+    assert store["rs1"] == {"chr": "chr1", "pos": 10}
+    assert store["rs01"] == {"chr": "chr2", "pos": 20}
+    assert store["rs0"] == {"chr": "chr3", "pos": 30}
+    assert "rs001" not in store
+    assert len(store) == 3 and sorted(store) == ["rs0", "rs01", "rs1"]
+
+    build_pos_store([("chr1", 10, "rs1"), ("chr1", 11, "rs011")], tmp_path / "pos")
+    store = DbsnpPosStore(tmp_path / "pos")
+    assert store["chr1_10"] == "rs1" and store["chr1_11"] == "rs011"
+    assert store.get("chr1_010") is None
+
+
+def test_duplicates_keep_the_last_entry(tmp_path):
+    build_rsid_store([("rs5", "chr1", 10), ("rs2", "chr1", 5), ("rs5", "chr2", 20)], tmp_path / "rsids")
+    store = DbsnpRsidStore(tmp_path / "rsids")
+    assert dict(store.items()) == {"rs2": {"chr": "chr1", "pos": 5}, "rs5": {"chr": "chr2", "pos": 20}}
+
+    build_pos_store([("chr1", 10, "rs5"), ("chr2", 10, "rs7"), ("chr1", 10, "rs6"), ("chr1", 3, "rs1")],
+                    tmp_path / "pos")
+    store = DbsnpPosStore(tmp_path / "pos")
+    assert dict(store.items()) == {"chr1_3": "rs1", "chr1_10": "rs6", "chr2_10": "rs7"}
+    assert store.lookup_many("chr1", [3, 10]) == ["rs1", "rs6"]
+
+
+def test_pickle_conversion_keeps_keys_that_are_not_positions(tmp_path):
+    pos_map = {"chr1_10": "rs1", "chr1_Position": "rsID", "chr1_010": "rs2", "chr1_11": "rs3", "unplaced": "rs4"}
+    with open(tmp_path / "pos.pkl", "wb") as f:
+        pickle.dump(pos_map, f)
+    convert_pos_pickle(tmp_path / "pos.pkl", tmp_path / "pos")
+    store = DbsnpPosStore(tmp_path / "pos")
+    assert store.extra == {"chr1_Position": "rsID", "chr1_010": "rs2", "unplaced": "rs4"}
+    assert dict(store.items()) == pos_map
+    assert store["chr1_010"] == "rs2" and store["unplaced"] == "rs4"
+    assert store.lookup_many("chr1", [10, 11]) == ["rs1", "rs3"]
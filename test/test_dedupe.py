@@ -0,0 +1,155 @@
+"""
+Tests of the deduplication of the nodes: spooling, merging and the conflict rules.
+"""
+from collections import Counter
+import csv
+import json
+
+import pytest
+
+from biocypher_metta import dedupe
+from biocypher_metta.dedupe import (DEDUPE_REPORT, DEDUPE_SPOOL_DIR, DEFAULT_RULES,
+                                    dedupe_nodes, merge_properties, merge_value, merged_nodes, parse_rules,
+                                    partition_file, partition_of, read_spool, spool_nodes)
+from biocypher_metta.neo4j_csv_writer import Neo4jCSVWriter
+
+
+class RecordingWriter:
+    """
+    Writer stand-in recording the nodes dedupe_nodes writes.
+    """
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.written = []
+
+    def clear_counts(self):
+        pass
+
+    def write_nodes(self, nodes, path_prefix=None):
+        nodes = list(nodes)
+        self.written.append((path_prefix, nodes))
+        return Counter(node[1] for node in nodes), {}
+
+
+def merge(records, rules=None, default_rule="first"):
+    merged = dict(records[0])
+    conflicts = Counter()
+    for properties in records[1:]:
+        merge_properties(merged, properties, DEFAULT_RULES if rules is None else rules, default_rule, conflicts)
+    return merged, conflicts
+
+
+def test_spool_partitions_the_nodes(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe, "SPOOL_CHUNK", 3)
+    nodes = [(f"ENSG{i}", "gene" if i % 3 else "transcript", {"n": i}) for i in range(50)]
+    node_freq, node_props = spool_nodes(iter(nodes), tmp_path, 4, "gencode")
+    # a second shard appends to the same spool files
+    spool_nodes(iter(nodes[:5]), tmp_path, 4, "gencode")
+    assert node_freq == {"gene": 33, "transcript": 17}
+    assert node_props == {"gene": {"n"}, "transcript": {"n"}}
+
+    spooled = []
+    for partition in range(4):
+        records = list(read_spool(partition_file(tmp_path, partition)))
+        assert all(partition_of(label, key, 4) == partition for _, key, _, label, _ in records)
+        spooled.extend(records)
+    assert Counter(map(repr, spooled)) == Counter(repr(("gencode", id, id, label, properties))
+                                                  for id, label, properties in nodes + nodes[:5])
+
+
+@pytest.mark.parametrize("rule, expected", [
+    ("first", "a"), ("last", "c"), ("union", ["a", "b", "c"]), ("min", "a"), ("max", "c")])
+def test_merge_value(rule, expected):
+    value = "a"
+    for other in ("b", "a", "c"):
+        value = merge_value(value, other, rule)
+    assert value == expected
+
+
+def test_merge_value_of_unordered_values():
+    assert merge_value(1, "a", "min") == 1
+    assert merge_value(["a"], ["b", "a"], "union") == ["a", "b"]
+
+
+@pytest.mark.parametrize("rule, merged, conflicts", [
+    ("first", {"score": 0.5}, 0),
+    ("last", {"score": 0.2}, 3),
+    ("union", {"score": [0.5, 0.9, 0.2]}, 2),
+    ("min", {"score": 0.2}, 1),
+    ("max", {"score": 0.9}, 1),
+])
+def test_conflicts_count_the_changed_values(rule, merged, conflicts):
+    records = [{"score": 0.5}, {"score": 0.9}, {"score": 0.5}, {"score": None}, {"score": ""}, {"score": 0.2}]
+    assert merge(records, {"score": rule}) == (merged, Counter({"score": conflicts} if conflicts else {}))
+
+
+def test_union_of_contained_values_is_not_a_conflict():
+    records = [{"source": "GENCODE"}, {"source": "Ensembl"}, {"source": "GENCODE"}, {"source": ["Ensembl"]}]
+    assert merge(records) == ({"source": ["GENCODE", "Ensembl"]}, Counter({"source": 1}))
+
+
+def test_empty_values_are_filled():
+    assert merge([{"name": "", "chr": None}, {"name": "DDX11L2", "chr": "chr1"}]) == \
+        ({"name": "DDX11L2", "chr": "chr1"}, Counter())
+
+
+def test_parse_rules():
+    assert parse_rules(None) == DEFAULT_RULES
+    assert parse_rules(["score=max", "source=first"]) == {"source": "first", "source_url": "union", "score": "max"}
+    for spec in ("score", "score=mean"):
+        with pytest.raises(ValueError):
+            parse_rules([spec])
+
+
+def test_merged_nodes(tmp_path):
+    spool_nodes(iter([("ENSG1", "gene", {"source": "GENCODE", "name": "A"}),
+                      ("ENSG2", "gene", {"source": "GENCODE"}),
+                      ("ENSG1", "transcript", {"source": "GENCODE"})]), tmp_path, 1, "gencode")
+    spool_nodes(iter([("ENSG1", "gene", {"source": "HGNC", "name": "B", "hgnc_id": "HGNC:1"})]), tmp_path, 1, "hgnc")
+    stats = {}
+    assert list(merged_nodes(tmp_path, DEFAULT_RULES, "last", stats)) == [
+        ("gencode", ("ENSG1", "gene", {"source": ["GENCODE", "HGNC"], "name": "B", "hgnc_id": "HGNC:1"})),
+        ("gencode", ("ENSG2", "gene", {"source": "GENCODE"})),
+        ("gencode", ("ENSG1", "transcript", {"source": "GENCODE"})),
+    ]
+    assert stats == {"gene": {"records": 3, "unique": 2, "conflicts": Counter({"source": 1, "name": 1})},
+                     "transcript": {"records": 1, "unique": 1, "conflicts": Counter()}}
+
+
+def test_dedupe_nodes(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe, "SPOOL_CHUNK", 1)
+    spool_dir = tmp_path / DEDUPE_SPOOL_DIR
+    spool_nodes(iter([("ENSG1", "gene", {"score": 1}), ("ENSG1", "gene", {"score": 3}),
+                      ("ENSG2", "gene", {"score": 2})]), spool_dir, 8, "gencode")
+    spool_nodes(iter([("ENSG3", "gene", {"score": 4}), ("ENSG2", "gene", {"score": 5})]), spool_dir, 8, "hgnc")
+
+    writer = RecordingWriter(tmp_path)
+    node_freq, _, report = dedupe_nodes(writer, parse_rules(["score=max"]))
+    assert node_freq == {"gene": 3}
+    # every merged node is written to the output directory of its first record
+    assert [(path_prefix, sorted(nodes)) for path_prefix, nodes in writer.written] == [
+        ("gencode", [("ENSG1", "gene", {"score": 3}), ("ENSG2", "gene", {"score": 5})]),
+        ("hgnc", [("ENSG3", "gene", {"score": 4})]),
+    ]
+    assert report["labels"]["gene"] == {"records": 5, "unique": 3, "ratio": 1.6667, "conflicts": {"score": 2}}
+    assert json.loads((tmp_path / DEDUPE_REPORT).read_text()) == report
+    assert not spool_dir.exists()
+
+
+def test_dedupe_merges_the_ids_the_writer_outputs_the_same(tmp_path, writer_schema):
+    writer = Neo4jCSVWriter(*writer_schema, tmp_path)
+    spool_dir = tmp_path / DEDUPE_SPOOL_DIR
+    spool_nodes(iter([("GO:0001", "go", {"name": "a"})]), spool_dir, 8, "go", writer.normalize_id)
+    spool_nodes(iter([("go_0001", "go", {"name": "b"}), ("GO:0002", "go", {})]), spool_dir, 8, "go_subset",
+                writer.normalize_id)
+    node_freq, _, report = dedupe_nodes(writer)
+    assert node_freq == {"go": 2}
+    assert report["unique"] == 2
+
+    # the first record of GO:0001 is in go, the one of GO:0002 in go_subset
+    rows = {}
+    for outdir in ("go", "go_subset"):
+        with open(tmp_path / outdir / "nodes_go.csv", newline="") as f:
+            header, *rows[outdir] = csv.reader(f, delimiter="|")
+    assert [(row[0], row[-1]) for row in rows["go"]] == [("go_0001", "a")]
+    assert [row[0] for row in rows["go_subset"]] == ["go_0002"]
@@ -0,0 +1,103 @@
+"""
+Tests of the external sort against an in-memory sort, with runs small enough that every input
+takes the multi-run path.
+"""
+import gzip
+import random
+
+import pytest
+
+from biocypher_metta import external_sort as external_sort_module
+from biocypher_metta.external_sort import external_sort, sorted_runs
+
+
+def random_lines(count, seed=0):
+    rng = random.Random(seed)
+    words = ["gene", "transcript", "ENSG00000101349", "é", "Z", "a b", "中", ""]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(1, 3))) + "\n" for _ in range(count)]
+
+
+def write_lines(path, lines):
+    path.write_text("".join(lines), encoding="utf-8", newline="")
+    return path
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return f.readlines()
+
+
+def byte_sorted(lines):
+    # the order of LC_ALL=C sort
+    return sorted(lines, key=lambda line: line.encode("utf-8"))
+
+
+@pytest.mark.parametrize("run_lines", [1, 3, 1000])
+def test_sort_matches_an_in_memory_sort(tmp_path, run_lines):
+    lines = random_lines(200)
+    src = write_lines(tmp_path / "lines.txt", lines)
+    assert external_sort(src, tmp_path / "sorted.txt", run_lines=run_lines) == len(lines)
+    assert read_lines(tmp_path / "sorted.txt") == byte_sorted(lines)
+
+
+def test_intermediate_merges(tmp_path, monkeypatch):
+    monkeypatch.setattr(external_sort_module, "MAX_MERGE_FANIN", 3)
+    merges = []
+    merge_runs = external_sort_module._merge_runs
+
+    def counted_merge_runs(paths, out, unique):
+        merges.append(len(paths))
+        return merge_runs(paths, out, unique)
+    monkeypatch.setattr(external_sort_module, "_merge_runs", counted_merge_runs)
+
+    lines = random_lines(100, seed=1)
+    src = write_lines(tmp_path / "lines.txt", lines)
+    assert external_sort(src, src, run_lines=2) == len(lines)
+    assert read_lines(src) == byte_sorted(lines)
+    # 50 runs of 2 lines, merged into 17, 6 and 2 intermediate runs and then into the output
+    assert len(merges) == 17 + 6 + 2 + 1
+    assert max(merges) == 3
+    # the runs are removed with the work directory
+    assert [path.name for path in tmp_path.iterdir()] == ["lines.txt"]
+
+
+def test_sorted_runs(tmp_path):
+    lines = random_lines(10, seed=4)
+    runs = sorted_runs(lines, tmp_path, run_lines=4)
+    assert [len(read_lines(run)) for run in runs] == [4, 4, 2]
+    assert [read_lines(run) for run in runs] == [sorted(lines[i:i + 4]) for i in (0, 4, 8)]
+
+
+@pytest.mark.parametrize("fanin", [2, 256])
+def test_unique(tmp_path, monkeypatch, fanin):
+    monkeypatch.setattr(external_sort_module, "MAX_MERGE_FANIN", fanin)
+    lines = random_lines(300, seed=2)
+    assert len(set(lines)) < len(lines)
+    src = write_lines(tmp_path / "lines.txt", lines)
+    assert external_sort(src, tmp_path / "sorted.txt", run_lines=4, unique=True) == len(set(lines))
+    assert read_lines(tmp_path / "sorted.txt") == byte_sorted(set(lines))
+
+
+@pytest.mark.parametrize("run_lines", [1, 2, 1000])
+def test_missing_trailing_newline(tmp_path, run_lines):
+    src = write_lines(tmp_path / "lines.txt", ["b\n", "c\n", "a"])
+    assert external_sort(src, src, run_lines=run_lines) == 3
+    assert read_lines(src) == ["a\n", "b\n", "c\n"]
+
+
+def test_compressed_source_and_destination(tmp_path):
+    lines = random_lines(50, seed=3)
+    src = tmp_path / "lines.txt.gz"
+    with gzip.open(src, "wt", encoding="utf-8", newline="") as f:
+        f.writelines(lines)
+    dest = tmp_path / "sorted.txt.gz"
+    external_sort(src, dest, run_lines=7,
+                  open_dest=lambda path: gzip.open(path, "wt", encoding="utf-8", newline=""))
+    with gzip.open(dest, "rt", encoding="utf-8", newline="") as f:
+        assert f.readlines() == byte_sorted(lines)
+
+
+def test_empty_file(tmp_path):
+    src = write_lines(tmp_path / "lines.txt", [])
+    assert external_sort(src, src, run_lines=2) == 0
+    assert read_lines(src) == []
@@ -0,0 +1,160 @@
+"""
+Tests of the Bloom filters of the node ids and of the referential integrity check of the edges.
+"""
+import hashlib
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from biocypher_metta.neo4j_csv_writer import Neo4jCSVWriter
+from biocypher_metta.prolog_writer import PrologWriter
+from biocypher_metta.integrity import (BloomFilter, NodeFilters, check_edges, load_filters, spool_edges,
+                                       spooled_edge_counts, INTEGRITY_DIR, INTEGRITY_REPORT, FILTERS_DIR)
+
+SCHEMA = {
+    "transcribed_to": {"source": "gene", "target": "transcript"},
+    "belongs_to": {"source": "gene", "target": "ontology_term"},
+}
+
+
+class RecordingWriter:
+    """
+    Writer stand-in recording the edges check_edges writes, per output directory.
+    """
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.written = []
+
+    def clear_counts(self):
+        pass
+
+    def normalize_id(self, id):
+        return id
+
+    def write_edges(self, edges, path_prefix=None):
+        edges = list(edges)
+        self.written.append((path_prefix, edges))
+        return Counter(edge[2] for edge in edges)
+
+
+def settings(capacity=1000):
+    return {"expected": {}, "capacity": capacity, "fp_rate": 0.001}
+
+
+def save_nodes(output_path, nodes, normalize_id=None):
+    filters = NodeFilters(settings(), normalize_id)
+    for _ in filters.watch(nodes):
+        pass
+    filters.save(output_path)
+
+
+def test_positions_are_double_hashes():
+    bloom = BloomFilter(1 << 12, 5)
+    keys = ["ENSG00000101349", "ENST00000456328", 42]
+    for key, positions in zip(keys, bloom._positions(keys)):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        assert [int(p) for p in positions] == [((h1 + i * h2) % 2 ** 64) % (1 << 12) for i in range(5)]
+
+
+@pytest.mark.parametrize("capacity, fp_rate", [(1, 0.001), (1000, 0.01), (100_000, 0.001), (10_000_000, 0.0001)])
+def test_for_capacity(capacity, fp_rate):
+    bloom = BloomFilter.for_capacity(capacity, fp_rate)
+    optimal = -capacity * math.log(fp_rate) / math.log(2) ** 2
+    assert bloom.bits & (bloom.bits - 1) == 0
+    assert bloom.bits >= max(64, optimal) and bloom.bits < max(128, 2 * optimal)
+    assert 1 <= bloom.hashes <= math.ceil(-math.log2(fp_rate))
+    assert len(bloom.data) == bloom.bits // 8
+    # the false positive rate of the filter full at capacity
+    assert (1 - math.exp(-bloom.hashes * capacity / bloom.bits)) ** bloom.hashes <= fp_rate
+
+
+def test_an_added_id_is_never_reported():
+    bloom = BloomFilter.for_capacity(10_000, 0.01)
+    ids = [f"ENSG{i:011d}" for i in range(10_000)]
+    bloom.add(ids)
+    assert bloom.contains(ids).all()
+    absent = [f"ENST{i:011d}" for i in range(10_000)]
+    assert bloom.contains(absent).mean() < 0.03
+
+
+def test_load_filters_ors_the_appended_blocks(tmp_path):
+    first, second, resized = BloomFilter(1 << 10, 4), BloomFilter(1 << 10, 4), BloomFilter(1 << 12, 4)
+    first.add(["a", "b"])
+    second.add(["c"])
+    resized.add(["d"])
+    path = tmp_path / "gene.bloom"
+    for bloom in (first, second, resized):
+        with open(path, "ab") as f:
+            f.write(bloom.to_bytes())
+
+    filters = load_filters(path)
+    assert [(bloom.bits, bloom.hashes) for bloom in filters] == [(1 << 10, 4), (1 << 12, 4)]
+    assert filters[0].contains(["a", "b", "c"]).all()
+    np.testing.assert_array_equal(filters[0].data, first.data | second.data)
+    np.testing.assert_array_equal(filters[1].data, resized.data)
+
+
+def test_load_filters_rejects_other_files(tmp_path):
+    path = tmp_path / "gene.bloom"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        load_filters(path)
+
+
+def test_check_edges_reports_the_dangling_edges(tmp_path):
+    save_nodes(tmp_path, [("ENSG1", "gene", {}), ("ENST1", "transcript", {})])
+    edges = [("ENSG1", "ENST1", "transcribed_to", {}), ("ENSG1", "ENST2", "transcribed_to", {}),
+             ("ENSG2", "GO:0001", "belongs_to", {}), ("ENSG1", "ENST1", "unknown", {})]
+    assert list(spool_edges(edges, tmp_path, "gencode", keep=False)) == edges
+
+    writer = RecordingWriter(tmp_path)
+    edge_freq, report = check_edges(writer, SCHEMA)
+    assert edge_freq is None and writer.written == []
+    assert report["edges"] == 4 and report["dangling"] == 2
+    assert report["labels"]["transcribed_to"]["dangling_target"] == 1
+    assert report["labels"]["transcribed_to"]["examples"] == [["ENSG1", "ENST2"]]
+    assert report["labels"]["belongs_to"]["dangling_source"] == 1
+    # the go terms have no filter and are checked against the nodes of every label
+    assert report["labels"]["belongs_to"]["dangling_target"] == 1
+    assert not report["labels"]["unknown"]["checked"] and report["labels"]["unknown"]["dangling"] == 0
+    assert (tmp_path / INTEGRITY_REPORT).exists()
+    assert not (tmp_path / INTEGRITY_DIR).exists()
+
+
+def test_drop_mode_writes_the_edges_of_every_outdir(tmp_path):
+    # two adapter runs, each appending its filters and edges
+    save_nodes(tmp_path, [("ENSG1", "gene", {}), ("ENST1", "transcript", {})])
+    save_nodes(tmp_path, [("ENSG2", "gene", {}), ("ENST2", "transcript", {})])
+    assert len(load_filters(tmp_path / INTEGRITY_DIR / FILTERS_DIR / "gene.bloom")) == 1
+    gencode = [("ENSG1", "ENST1", "transcribed_to", {"source": "GENCODE"}),
+               ("ENSG1", "ENST3", "transcribed_to", {"source": "GENCODE"}),
+               ("ENSG2", "ENST2", "transcribed_to", {"source": "GENCODE"})]
+    other = [("ENSG3", "ENST1", "transcribed_to", {"source": "other"}),
+             ("ENSG2", "ENST1", "transcribed_to", {"source": "other"})]
+    assert spooled_edge_counts(iter(gencode), tmp_path, "gencode") == {"transcribed_to": 3}
+    assert spooled_edge_counts(iter(other), tmp_path, "other") == {"transcribed_to": 2}
+
+    writer = RecordingWriter(tmp_path)
+    edge_freq, report = check_edges(writer, SCHEMA, drop=True)
+    assert writer.written == [("gencode", [gencode[0], gencode[2]]), ("other", [other[1]])]
+    assert edge_freq == {"transcribed_to": 3}
+    assert report["dropped"] and report["edges"] == 5 and report["dangling"] == 2
+
+
+@pytest.mark.parametrize("writer_class", [Neo4jCSVWriter, PrologWriter])
+def test_ids_are_compared_as_the_writer_outputs_them(tmp_path, writer_schema, writer_class):
+    writer = writer_class(*writer_schema, tmp_path)
+    # the writer outputs GO:0001, Go:0001 and go_0001 as the same id
+    save_nodes(tmp_path, [("ENSG00000101349", "gene", {}), ("go_0001", "go", {})], writer.normalize_id)
+    edges = [("ensg00000101349", "GO:0001", "belongs_to", {}), ("ENSG00000101349", "Go:0001", "belongs_to", {}),
+             ("ENSG000000101349", "GO:0001", "belongs_to", {})]
+    spooled_edge_counts(iter(edges), tmp_path, "go")
+
+    recording = RecordingWriter(tmp_path)
+    recording.normalize_id = writer.normalize_id
+    _, report = check_edges(recording, SCHEMA, drop=True)
+    assert recording.written == [("go", edges[:2])]
+    assert report["labels"]["belongs_to"]["examples"] == [["ENSG000000101349", "GO:0001"]]
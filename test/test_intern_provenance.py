@@ -0,0 +1,110 @@
+"""
+Tests of the interned provenance output: a dataset node per source and source_url of the build,
+referenced by every record instead of its source and source_url.
+"""
+import re
+
+import pytest
+
+from biocypher_metta import PROVENANCE_DIR, dataset_id
+from biocypher_metta.adapter_runner import run_sequential
+from biocypher_metta.adapters import Adapter
+from biocypher_metta.compression import open_text
+from biocypher_metta.metta_writer import MeTTaWriter
+from biocypher_metta.neo4j_admin_writer import Neo4jAdminWriter
+from biocypher_metta.neo4j_csv_writer import Neo4jCSVWriter
+from biocypher_metta.neo4j_writer import Neo4jWriter
+from biocypher_metta.prolog_writer import PrologWriter
+from biocypher_metta.schema_cache import load_schema
+
+WRITERS = [MeTTaWriter, PrologWriter, Neo4jCSVWriter, Neo4jAdminWriter, Neo4jWriter,
+           pytest.param("parquet", id="ParquetWriter")]
+
+GTEX_EXPRESSION = "https://forgedb.cancer.gov/api/gtex/v1.0/gtex.forgedb.csv.gz"
+GTEX_EQTL = "https://www.gtexportal.org/home/datasets"
+GENCODE = "https://www.gencodegenes.org/human/"
+
+
+class SourceAdapter(Adapter):
+    """
+    Adapter of the tests, count genes with a transcript each from the given source.
+    """
+    def __init__(self, prefix, count, source, source_url, write_properties, add_provenance):
+        self.prefix = prefix
+        self.count = count
+        self.source = source
+        self.source_url = source_url
+        super().__init__(write_properties, add_provenance)
+
+    def get_nodes(self):
+        for i in range(self.count):
+            yield f"{self.prefix}G{i}", "gene", {"gene_name": f"{self.prefix}{i}",
+                                                  "source": self.source, "source_url": self.source_url}
+
+    def get_edges(self):
+        for i in range(self.count):
+            yield f"{self.prefix}G{i}", f"{self.prefix}T{i}", "transcribed_to", {
+                "source": self.source, "source_url": self.source_url}
+
+
+def entry(prefix, count, source, source_url, outdir):
+    return {"adapter": {"module": __name__, "cls": "SourceAdapter",
+                        "args": {"prefix": prefix, "count": count, "source": source, "source_url": source_url}},
+            "outdir": outdir, "nodes": True, "edges": True}
+
+
+def read_text(path):
+    """
+    The records of an output file as text, one line per record for the parquet files.
+    """
+    if path.name.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return "\n".join(repr(row) for row in pq.read_table(path).to_pylist())
+    with open_text(path) as f:
+        return f.read()
+
+
+def writer_for(writer_class, writer_schema, output):
+    if writer_class == "parquet":
+        pytest.importorskip("pyarrow")
+        from biocypher_metta.parquet_writer import ParquetWriter
+        writer_class = ParquetWriter
+    return writer_class(*writer_schema, output, intern_provenance=True)
+
+
+@pytest.mark.parametrize("writer_class", WRITERS)
+def test_a_dataset_per_source_and_url(tmp_path, writer_schema, writer_class):
+    # the two GTEx entries share a name, the two GENCODE entries their name and url
+    adapters_dict = {"gtex_expression": entry("ENSA", 3, "GTEx", GTEX_EXPRESSION, "gtex"),
+                     "gtex_eqtl": entry("ENSB", 4, "GTEx", GTEX_EQTL, "gtex"),
+                     "gencode_genes": entry("ENSC", 5, "GENCODE", GENCODE, "gencode"),
+                     "gencode_transcripts": entry("ENSD", 6, "GENCODE", GENCODE, "gencode")}
+    writer = writer_for(writer_class, writer_schema, tmp_path)
+    totals = run_sequential(adapters_dict, writer, None, None, True, False, load_schema(*writer_schema)["edges"])
+    writer.write_datasets(totals["datasets"])
+    writer.finalize()
+
+    ids = {dataset_id("GTEx", GTEX_EXPRESSION), dataset_id("GTEx", GTEX_EQTL), dataset_id("GENCODE", GENCODE)}
+    assert len(ids) == 3 and set(totals["datasets"]) == ids
+    references = re.compile("|".join(sorted(ids)))
+
+    # a node per dataset, holding its name and url
+    provenance = "".join(read_text(path) for path in sorted((tmp_path / PROVENANCE_DIR).rglob("*")) if path.is_file())
+    for id in ids:
+        assert writer.normalize_id(id) == id and id in provenance
+    for url in (GTEX_EXPRESSION, GTEX_EQTL, GENCODE):
+        # the prolog writer writes strings as atoms
+        assert (writer.sanitize_text(url) if isinstance(writer, PrologWriter) else url) in provenance
+
+    # every node and edge references its dataset, and none holds a source_url
+    expected = {dataset_id("GTEx", GTEX_EXPRESSION): 2 * 3, dataset_id("GTEx", GTEX_EQTL): 2 * 4,
+                dataset_id("GENCODE", GENCODE): 2 * (5 + 6)}
+    found = {id: 0 for id in ids}
+    for directory in ("gtex", "gencode"):
+        for path in sorted((tmp_path / directory).rglob("*")):
+            if path.is_file():
+                text = read_text(path)
+                assert "gtexportal" not in text and "forgedb" not in text and "gencodegenes" not in text
+                for match in references.findall(text):
+                    found[match] += 1
+    assert found == expected
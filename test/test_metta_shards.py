@@ -0,0 +1,89 @@
+"""
+Tests of the sharded MeTTa output: the routing of the records to the shard files, the shard
+manifest and the merge of the shards of parallel runs.
+"""
+import hashlib
+import json
+
+import pytest
+
+from biocypher_metta.compression import Compression, open_binary
+from biocypher_metta.metta_writer import SHARD_COUNTS_FILE, SHARD_MANIFEST, MeTTaWriter, file_sha256, shard_of
+from biocypher_metta.output_index import metta_key
+
+SHARDS = 4
+
+
+def nodes(start, stop):
+    return [(f"ENSG{i}", "gene", {"gene_name": f"A{i}", "start": i}) for i in range(start, stop)]
+
+
+def edges(start, stop):
+    return [(f"ENSG{i}", f"ENST{i}", "transcribed_to", {"source": "GENCODE"}) for i in range(start, stop)]
+
+
+def write(writer, start, stop):
+    writer.write_nodes(nodes(start, stop), path_prefix="gencode")
+    writer.write_edges(edges(start, stop), path_prefix="gencode")
+
+
+def keys_of(path):
+    with open_binary(path) as f:
+        return [metta_key(line) for line in f.read().splitlines() if line.strip()]
+
+
+def test_shard_of_is_stable():
+    # crc32, the same on every run and machine, unlike hash() of a str
+    assert [shard_of(key, 8) for key in ("ENSG00000101349", "rs367896724", "42", 42)] == [5, 7, 0, 0]
+    assert shard_of("ENSG00000101349", 1 << 32) == 4087500037
+
+
+@pytest.mark.parametrize("codec", ["none", "gzip"])
+def test_records_go_to_the_shard_of_their_id(tmp_path, writer_schema, codec):
+    writer = MeTTaWriter(*writer_schema, tmp_path, compression=Compression(codec), shards=SHARDS, batch_lines=7)
+    write(writer, 0, 100)
+    writer.finalize()
+
+    directory = tmp_path / "gencode"
+    with open(directory / SHARD_MANIFEST) as f:
+        manifest = json.load(f)
+    assert not (directory / SHARD_COUNTS_FILE).exists()
+    assert (manifest["shard_count"], manifest["hash"], manifest["compression"]) == (SHARDS, "crc32", codec)
+    assert sorted(entry["file"] for entry in manifest["files"]) == sorted(
+        p.name for p in directory.iterdir() if p.name != SHARD_MANIFEST)
+
+    ids = {"nodes": set(), "edges": set()}
+    for entry in manifest["files"]:
+        path = directory / entry["file"]
+        assert entry["file"] == f"{entry['kind']}.{entry['shard']}.metta{writer.compression.suffix}"
+        # every line of a node (its properties) or edge is in the shard of its id or source id
+        keys = keys_of(path)
+        assert {shard_of(key, SHARDS) for key in keys} == {entry["shard"]}
+        assert entry["records"] == len(set(keys))
+        ids[entry["kind"]].update(keys)
+        assert entry["bytes"] == path.stat().st_size
+        assert entry["sha256"] == hashlib.sha256(path.read_bytes()).hexdigest() == file_sha256(path)
+    assert ids["nodes"] == ids["edges"] == {f"ENSG{i}" for i in range(100)}
+
+
+def test_merged_shards_are_the_output_of_a_single_writer(tmp_path, writer_schema):
+    single = MeTTaWriter(*writer_schema, tmp_path / "single", shards=SHARDS)
+    write(single, 0, 30)
+    write(single, 30, 50)
+    single.finalize()
+
+    # two parallel runs writing into their own shard directories, merged in order
+    merged = MeTTaWriter(*writer_schema, tmp_path / "merged", shards=SHARDS)
+    for i, (start, stop) in enumerate([(0, 30), (30, 50)]):
+        write(merged.clone(tmp_path / f"shard{i}"), start, stop)
+    merged.merge_shard(tmp_path / "shard0", move=True)
+    merged.merge_shard(tmp_path / "shard1")
+    merged.finalize()
+
+    assert sorted(p.name for p in (tmp_path / "merged" / "gencode").iterdir()) == \
+        sorted(p.name for p in (tmp_path / "single" / "gencode").iterdir())
+    for path in sorted((tmp_path / "single" / "gencode").iterdir()):
+        assert (tmp_path / "merged" / "gencode" / path.name).read_bytes() == path.read_bytes(), path.name
+    with open(tmp_path / "merged" / "gencode" / SHARD_MANIFEST) as f:
+        manifest = json.load(f)
+    assert sum(entry["records"] for entry in manifest["files"] if entry["kind"] == "nodes") == 50
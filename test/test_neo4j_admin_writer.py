@@ -0,0 +1,59 @@
+"""
+Test of the typed headers and data files of the neo4j-admin writer on labels of the schema config.
+"""
+import csv
+
+from biocypher_metta.neo4j_admin_writer import Neo4jAdminWriter
+
+TRANSCRIPTS = [
+    ("ENST00000456328", "transcript", {"transcript_id": "ENST00000456328", "chr": "chr1", "start": 11869,
+                                       "end": 14409, "gene_name": "DDX11L2"}),
+    ("ENST00000450305", "transcript", {"transcript_id": "ENST00000450305", "chr": "chr1", "start": 12010,
+                                       "end": 13670, "gene_name": "DDX11L1", "old_gene_name": "DDX11P1"}),
+]
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f, delimiter="|"))
+
+
+def read_group(directory, name):
+    header = read_rows(directory / f"{name}-header.csv")
+    assert len(header) == 1
+    return header[0], [dict(zip(header[0], row)) for row in read_rows(directory / f"{name}.csv")]
+
+
+def test_inherited_columns_are_typed(writer_schema, tmp_path):
+    writer = Neo4jAdminWriter(*writer_schema, tmp_path)
+    writer.write_nodes(TRANSCRIPTS, path_prefix="gencode")
+
+    header, rows = read_group(tmp_path / "gencode", "nodes_transcript")
+    assert {"chr:string", "start:long", "end:long", "gene_name:string"} <= set(header)
+    # added after the first row was written, the earlier rows are padded
+    assert header[-1] == "old_gene_name:string"
+    assert [row["start:long"] for row in rows] == ["11869", "12010"]
+    assert [row["old_gene_name:string"] for row in rows] == ["", "DDX11P1"]
+    assert all(len(row) == len(header) for row in read_rows(tmp_path / "gencode" / "nodes_transcript.csv"))
+
+
+def test_properties_missing_from_the_schema_are_typed(writer_schema, tmp_path):
+    writer = Neo4jAdminWriter(*writer_schema, tmp_path)
+    writer.write_nodes([("rs367896724", "snp", {"raw_cadd_score": 0.1234, "phred_score": 3.21})], path_prefix="cadd")
+
+    header, rows = read_group(tmp_path / "cadd", "nodes_snp")
+    assert {"raw_cadd_score:double", "phred_score:double", "start:long"} <= set(header)
+    assert rows[0]["phred_score:double"] == "3.21"
+
+
+def test_shards_with_other_columns_merge_by_name(writer_schema, tmp_path):
+    writer = Neo4jAdminWriter(*writer_schema, tmp_path / "output")
+    writer.write_nodes(TRANSCRIPTS[:1], path_prefix="gencode")
+    shard = writer.clone(tmp_path / "shard")
+    shard.write_nodes(TRANSCRIPTS[1:], path_prefix="gencode")
+    writer.merge_shard(tmp_path / "shard")
+
+    header, rows = read_group(tmp_path / "output" / "gencode", "nodes_transcript")
+    assert header[-1] == "old_gene_name:string"
+    assert [row["id:ID(transcript)"] for row in rows] == ["enst00000456328", "enst00000450305"]
+    assert [row["old_gene_name:string"] for row in rows] == ["", "DDX11P1"]
@@ -0,0 +1,154 @@
+"""
+Test of the columns of the Neo4j CSV writer against the writer it replaced, which took the columns
+of a label from the properties of its first record, on records shaped like the ones of the
+transcript and snp adapters, and of the csv files whose columns grow or that a later build replaces.
+"""
+import csv
+import logging
+
+import pytest
+
+from biocypher_metta.compression import Compression, open_text
+from biocypher_metta.neo4j_admin_writer import Neo4jAdminWriter
+from biocypher_metta.neo4j_csv_writer import Neo4jCSVWriter
+
+GENCODE = "GENCODE"
+GENCODE_URL = "https://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_44/gencode.v44.annotation.gtf.gz"
+
+# adapter -> (label, records), as the adapters yield them
+ADAPTER_RECORDS = {
+    "gencode_transcript": ("transcript", [
+        ("ENST00000456328", "transcript", {"transcript_id": "ENST00000456328", "transcript_name": "DDX11L2-202",
+                                           "transcript_type": "lncRNA", "chr": "chr1", "start": 11869, "end": 14409,
+                                           "gene_name": "DDX11L2", "source": GENCODE, "source_url": GENCODE_URL}),
+        # the replaced gene symbols add a property the schema doesn't declare, after the first record
+        ("ENST00000450305", "transcript", {"transcript_id": "ENST00000450305", "transcript_name": "DDX11L1-201",
+                                           "transcript_type": "transcribed_unprocessed_pseudogene", "chr": "chr1",
+                                           "start": 12010, "end": 13670, "gene_name": "DDX11L1",
+                                           "old_gene_name": "DDX11P1", "source": GENCODE, "source_url": GENCODE_URL}),
+    ]),
+    "dbsnp": ("snp", [
+        ("rs367896724", "snp", {"chr": "chr1", "start": 10177, "end": 10177, "ref": "A", "alt": "AC",
+                                "caf_ref": 0.5747, "caf_alt": 0.4253, "source": "dbSNP", "source_url": "https://www.ncbi.nlm.nih.gov/snp/"}),
+    ]),
+    "cadd": ("snp", [
+        ("rs367896724", "snp", {"raw_cadd_score": 0.1234, "phred_score": 3.21, "source": "CADD",
+                                "source_url": "https://forgedb.cancer.gov/api/cadd/v1.0/cadd.forgedb.csv.gz"}),
+    ]),
+    "polyphen-2": ("snp", [
+        ("rs1000", "snp", {"ref": "A", "alt": "G", "polyphen2_humdiv_score": 0.998,
+                           "polyphen2_humdiv_prediction": "probably_damaging", "polyphen2_humvar_score": 0.87,
+                           "polyphen2_humvar_prediction": "possibly_damaging", "source": "PolyPhen-2",
+                           "source_url": "http://genetics.bwh.harvard.edu/pph2/"}),
+    ]),
+}
+
+
+def baseline_header(records):
+    return ["id", "label", *records[0][2]]
+
+
+def read_csv(path):
+    with open_text(path, newline="") as f:
+        rows = list(csv.reader(f, delimiter="|"))
+    return rows[0], rows[1:]
+
+
+@pytest.mark.parametrize("codec", ["none", "gzip"])
+@pytest.mark.parametrize("adapter", sorted(ADAPTER_RECORDS))
+def test_columns_keep_the_baseline_columns(writer_schema, tmp_path, adapter, codec):
+    label, records = ADAPTER_RECORDS[adapter]
+    writer = Neo4jCSVWriter(*writer_schema, tmp_path, Compression(codec))
+    writer.write_nodes(records, path_prefix=adapter)
+
+    header, rows = read_csv(tmp_path / adapter / f"nodes_{label}.csv{writer.compression.suffix}")
+    assert set(baseline_header(records)) <= set(header)
+    assert len(rows) == len(records)
+    for (id, _, properties), row in zip(records, rows):
+        assert len(row) == len(header)
+        values = dict(zip(header, row))
+        assert values["id"] == id.lower()
+        for key, value in properties.items():
+            assert values[key] == str(value)
+
+
+def test_inherited_columns(writer_schema, tmp_path):
+    writer = Neo4jCSVWriter(*writer_schema, tmp_path)
+    for label in ("transcript", "exon", "enhancer", "promoter", "snp", "structural_variant", "tad"):
+        assert {"chr", "start", "end"} <= set(writer.node_headers[label]), label
+
+
+def test_merge_matches_columns_by_name(writer_schema, tmp_path):
+    label, records = ADAPTER_RECORDS["gencode_transcript"]
+    writer = Neo4jCSVWriter(*writer_schema, tmp_path / "output")
+    writer.write_nodes(records[:1], path_prefix="gencode")
+    shard = Neo4jCSVWriter(*writer_schema, tmp_path / "shard")
+    shard.node_headers[label].insert(0, "extra")
+    shard.write_nodes([(id, label, {**properties, "extra": "x"}) for id, label, properties in records[1:]],
+                      path_prefix="gencode")
+    writer.merge_shard(tmp_path / "shard")
+
+    header, rows = read_csv(tmp_path / "output" / "gencode" / "nodes_transcript.csv")
+    assert header[-1] == "extra"
+    values = [dict(zip(header, row)) for row in rows]
+    assert [v["id"] for v in values] == ["enst00000456328", "enst00000450305"]
+    assert [v["extra"] for v in values] == ["", "x"]
+    assert [v["old_gene_name"] for v in values] == ["", "DDX11P1"]
+
+
+def read_rows(writer, path):
+    """
+    The header and rows of a data file of the writer, whose header may be in a file of its own.
+    """
+    with open_text(path, newline="") as f:
+        return writer.read_header(path), list(writer.csv_rows(f))
+
+
+def transcripts(start, stop, **extra):
+    return [(f"ENST{i}", "transcript", {"transcript_name": f"T{i}", "chr": "chr1", "start": i, "end": i + 10,
+                                        "source": GENCODE, **{k: v(i) for k, v in extra.items()}})
+            for i in range(start, stop)]
+
+
+@pytest.mark.parametrize("codec", ["none", "gzip"])
+@pytest.mark.parametrize("writer_class", [Neo4jCSVWriter, Neo4jAdminWriter])
+def test_growing_header(writer_schema, tmp_path, caplog, writer_class, codec):
+    writer = writer_class(*writer_schema, tmp_path, Compression(codec))
+    # the columns grow after three rows were written
+    records = transcripts(0, 3) + transcripts(3, 5, old_gene_name=lambda i: f"G{i}")
+    with caplog.at_level(logging.WARNING, logger="biocypher"):
+        writer.write_nodes(records, path_prefix="gencode")
+    assert any("grew while it was written" in record.getMessage() and "old_gene_name" in record.getMessage()
+               for record in caplog.records)
+    # the next adapter writing into the outdir appends under the grown header
+    writer.write_nodes(transcripts(5, 6, old_gene_name=lambda i: f"G{i}"), path_prefix="gencode")
+
+    path = tmp_path / "gencode" / f"nodes_transcript.csv{writer.compression.suffix}"
+    header, rows = read_rows(writer, path)
+    names = [column.split(":")[0] for column in header]
+    assert names[-1] == "old_gene_name" and len(set(names)) == len(names)
+    assert all(len(row) == len(header) for row in rows)
+    values = [dict(zip(names, row)) for row in rows]
+    assert [v["id"] for v in values] == [f"enst{i}" for i in range(6)]
+    assert [v["old_gene_name"] for v in values] == ["", "", "", "G3", "G4", "G5"]
+    assert [v["start"] for v in values] == [str(i) for i in range(6)]
+
+
+@pytest.mark.parametrize("writer_class", [Neo4jCSVWriter, Neo4jAdminWriter])
+def test_a_second_build_replaces_the_files(writer_schema, tmp_path, writer_class):
+    for build in range(2):
+        writer = writer_class(*writer_schema, tmp_path / "output")
+        writer.write_nodes(transcripts(0, 2), path_prefix="gencode")
+        writer.write_nodes(transcripts(2, 3), path_prefix="gencode")
+        # the output of the shards of a parallel build, the later build with an added column
+        extra = {"old_gene_name": lambda i: f"G{i}"} if build else {}
+        shard = writer_class(*writer_schema, tmp_path / f"shard{build}")
+        shard.write_nodes(transcripts(0, 2, **extra), path_prefix="shared")
+        writer.merge_shard(tmp_path / f"shard{build}")
+
+    header, rows = read_rows(writer, tmp_path / "output" / "gencode" / "nodes_transcript.csv")
+    assert [row[0] for row in rows] == ["enst0", "enst1", "enst2"]
+    header, rows = read_rows(writer, tmp_path / "output" / "shared" / "nodes_transcript.csv")
+    assert [row[0] for row in rows] == ["enst0", "enst1"]
+    values = [dict(zip([column.split(":")[0] for column in header], row)) for row in rows]
+    assert [v["old_gene_name"] for v in values] == ["G0", "G1"]
@@ -0,0 +1,79 @@
+"""
+Tests of the batched cypher output of the Neo4j writer: the statements of every group and the
+batches of parameter rows they read.
+"""
+import json
+
+import pytest
+
+from biocypher_metta.compression import Compression, open_text
+from biocypher_metta.neo4j_writer import Neo4jWriter
+
+
+def read_batches(path):
+    with open_text(path) as f:
+        return [json.loads(line)["rows"] for line in f if line.strip()]
+
+
+@pytest.mark.parametrize("codec", ["none", "gzip"])
+def test_node_batches(tmp_path, writer_schema, codec):
+    writer = Neo4jWriter(*writer_schema, tmp_path, Compression(codec), batch_size=2)
+    nodes = [(f"ENSG{i}", "gene", {"gene_name": f"A{i}", "start": i, "synonyms": ["x", "y"], "empty": "",
+                                    "none": None}) for i in range(5)]
+    writer.write_nodes(nodes, path_prefix="gencode")
+
+    query = (tmp_path / "gencode" / "nodes_gene.cypher").read_text()
+    assert query == ("CREATE CONSTRAINT IF NOT EXISTS FOR (n:`gene`) REQUIRE n.id IS UNIQUE;\n"
+                     "UNWIND $rows AS row MERGE (n:`gene` {id: row.id}) SET n += row.properties;\n")
+    batches = read_batches(tmp_path / "gencode" / f"nodes_gene.jsonl{writer.compression.suffix}")
+    assert [len(rows) for rows in batches] == [2, 2, 1]
+    assert batches[2] == [{"id": "ensg4", "properties": {"gene_name": "A4", "start": 4, "synonyms": ["x", "y"]}}]
+
+
+def test_nested_dicts_are_json_strings(tmp_path, writer_schema):
+    writer = Neo4jWriter(*writer_schema, tmp_path)
+    properties = {"score": 0.5, "evidence": {"pmid": [1, 2], "method": "ChIP-seq"},
+                  "contexts": [{"tissue": "liver"}, "blood"], "flag": True, "date": object}
+    writer.write_nodes([("ENSG1", "gene", properties)])
+
+    [[row]] = read_batches(tmp_path / "nodes_gene.jsonl")
+    assert row["properties"] == {"score": 0.5, "evidence": '{"pmid": [1, 2], "method": "ChIP-seq"}',
+                                 "contexts": ['{"tissue": "liver"}', "blood"], "flag": True,
+                                 "date": str(object)}
+    assert json.loads(row["properties"]["evidence"]) == properties["evidence"]
+
+
+def test_edge_batches_merge_on_the_endpoints_and_label(tmp_path, writer_schema):
+    writer = Neo4jWriter(*writer_schema, tmp_path, batch_size=10)
+    edges = [("ENSG1", "ENST1", "transcribed_to", {"source": "GENCODE"}),
+             ("ENSG1", "ENST1", "transcribed_to", {"source": "GENCODE", "biological_context": "CL:0000057"}),
+             ("CL:0000057", "GO:0008150", "cl_capable_of", {"source": "CL"})]
+    assert writer.write_edges(edges, path_prefix="edges") == {"transcribed_to": 2, "cl_capable_of": 1}
+
+    query = (tmp_path / "edges" / "edges_transcribed_to_gene_transcript.cypher").read_text()
+    assert query == ("UNWIND $rows AS row MATCH (a:`gene` {id: row.source_id}) "
+                     "MATCH (b:`transcript` {id: row.target_id}) "
+                     "CALL apoc.merge.relationship(a, 'transcribed_to', {}, row.properties, b, row.properties) "
+                     "YIELD rel RETURN count(rel) AS total;\n")
+    assert read_batches(tmp_path / "edges" / "edges_transcribed_to_gene_transcript.jsonl") == [[
+        {"source_id": "ensg1", "target_id": "enst1", "properties": {"source": "GENCODE"}},
+        {"source_id": "ensg1", "target_id": "enst1",
+         "properties": {"source": "GENCODE", "biological_context": "CL:0000057"}},
+    ]]
+    # written with its output label
+    query = (tmp_path / "edges" / "edges_cl_capable_of_cl_go.cypher").read_text()
+    assert "apoc.merge.relationship(a, 'capable_of', {}, row.properties, b, row.properties)" in query
+    assert read_batches(tmp_path / "edges" / "edges_cl_capable_of_cl_go.jsonl") == [[
+        {"source_id": "cl:0000057", "target_id": "go:0008150", "properties": {"source": "CL"}}]]
+
+
+def test_merge_keeps_one_query_per_group(tmp_path, writer_schema):
+    writer = Neo4jWriter(*writer_schema, tmp_path / "output")
+    writer.write_nodes([("ENSG1", "gene", {})], path_prefix="gencode")
+    shard = writer.clone(tmp_path / "shard")
+    shard.write_nodes([("ENSG2", "gene", {})], path_prefix="gencode")
+    writer.merge_shard(tmp_path / "shard")
+
+    assert (tmp_path / "output" / "gencode" / "nodes_gene.cypher").read_text().count("MERGE") == 1
+    assert read_batches(tmp_path / "output" / "gencode" / "nodes_gene.jsonl") == [
+        [{"id": "ensg1", "properties": {}}], [{"id": "ensg2", "properties": {}}]]
@@ -0,0 +1,116 @@
+"""
+Tests of the sidecar indexes of the MeTTa and Prolog output against a linear scan of the files.
+"""
+import itertools
+import random
+
+import pytest
+
+from biocypher_metta.output_index import (GraphIndex, OutputIndex, build_index, index_path, metta_key, prolog_key,
+                                          prolog_query, write_indexes)
+
+IDS = ["ENSG00000101349", "ENSG00000290825", "ENST00000456328", "CL:0000057", "GO:0008150", "rs367896724",
+       "P31946", "ensg_lower"]
+
+
+def metta_lines(rng):
+    lines = [";; nodes and edges of the test"]
+    for _ in range(200):
+        id = rng.choice(IDS)
+        lines.append(rng.choice([f"(gene {id})", f"(gene_name (gene {id}) x{rng.randint(0, 9)})",
+                                 f"(transcribed_to (gene {id}) (transcript {rng.choice(IDS)}))"]))
+    return lines
+
+
+def prolog_lines(rng):
+    lines = [":- discontiguous gene/1."]
+    for _ in range(200):
+        id = prolog_query(rng.choice(IDS))
+        lines.append(rng.choice([f"gene({id}).", f"gene_name(gene({id}), x{rng.randint(0, 9)}).",
+                                 f"transcribed_to(gene({id}), transcript({prolog_query(rng.choice(IDS))}))."]))
+    return lines
+
+
+def linear_scan(lines, key_of, key):
+    return [line for line in lines if key_of(line.encode("utf-8")) == key]
+
+
+def runs(lines, key_of, key):
+    """
+    Number of runs of consecutive lines of key in lines.
+    """
+    return sum(1 for k, _ in itertools.groupby(key_of(line.encode("utf-8")) for line in lines) if k == key)
+
+
+@pytest.mark.parametrize("run_lines", [7, 100_000])
+@pytest.mark.parametrize("suffix, make_lines, key_of, key_of_id", [
+    (".metta", metta_lines, metta_key, lambda id: id),
+    (".pl", prolog_lines, prolog_key, prolog_query),
+])
+def test_lookups_match_a_linear_scan(tmp_path, run_lines, suffix, make_lines, key_of, key_of_id):
+    lines = make_lines(random.Random(0))
+    path = tmp_path / f"nodes{suffix}"
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+    keys = {key_of(line.encode("utf-8")) for line in lines} - {None}
+    assert build_index(path, key_of, run_lines=run_lines) == len(keys)
+    with OutputIndex(path) as index:
+        assert list(index.keys()) == sorted(keys, key=lambda key: key.encode("utf-8"))
+        for id in IDS:
+            key = key_of_id(id)
+            expected = linear_scan(lines, key_of, key)
+            assert expected
+            assert index.lines(id) == expected
+            assert id in index
+            # consecutive lines of a key are a single range
+            assert len(index.ranges(id)) == runs(lines, key_of, key)
+        assert index.find("ENSG00000000000") is None
+        assert index.lines("ENSG00000000000") == []
+
+
+def test_ranges_coalesce_consecutive_lines(tmp_path):
+    lines = ["(gene a)", "(gene_name (gene a) x)", "(gene b)", "(gene_name (gene a) y)",
+             "(gene_name (gene a) z)", "(gene b)"]
+    path = tmp_path / "nodes.metta"
+    path.write_text("".join(line + "\n" for line in lines))
+    build_index(path, metta_key, run_lines=2)
+
+    with OutputIndex(path) as index:
+        assert index.ranges("a") == [(0, 32), (41, 46)]
+        assert index.ranges("b") == [(32, 9), (87, 9)]
+        assert index.lines("a") == [lines[0], lines[1], lines[3], lines[4]]
+
+
+def test_prolog_lookups_sanitize_the_ids(tmp_path):
+    path = tmp_path / "nodes.pl"
+    path.write_text("cell_type(cl_0000057).\nname(cell_type(cl_0000057), fibroblast).\ngene(ensg1).\n")
+    build_index(path, prolog_key)
+
+    with OutputIndex(path) as index:
+        assert index.lines("CL:0000057") == ["cell_type(cl_0000057).", "name(cell_type(cl_0000057), fibroblast)."]
+        assert index.lines("ENSG1") == ["gene(ensg1)."]
+    with OutputIndex(path, query=lambda id: id) as index:
+        assert index.lines("CL:0000057") == []
+        assert index.lines("cl_0000057")
+
+
+def test_graph_index_skips_the_hidden_directories(tmp_path):
+    (tmp_path / "gencode").mkdir()
+    (tmp_path / ".shards" / "gencode").mkdir(parents=True)
+    for directory in (tmp_path / "gencode", tmp_path / ".shards" / "gencode"):
+        (directory / "nodes.metta").write_text("(gene a)\n")
+        (directory / "edges.metta").write_text("(transcribed_to (gene a) (transcript b))\n")
+    assert write_indexes(tmp_path, ".metta", metta_key) == 2
+    assert not index_path(tmp_path / ".shards" / "gencode" / "nodes.metta").exists()
+
+    with GraphIndex(tmp_path) as index:
+        assert sorted(index.lines("a")) == ["(gene a)", "(transcribed_to (gene a) (transcript b))"]
+        assert index.lines("b") == []
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "nodes.metta"
+    path.write_text("(gene a)\n")
+    index_path(path).write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        OutputIndex(path)
@@ -0,0 +1,97 @@
+"""
+Test of the columns of the Parquet writer on labels of the schema config.
+"""
+import os
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+from biocypher_metta.parquet_writer import ParquetWriter
+
+ENHANCERS = [
+    ("chr1_10000_10400_GRCh38", "enhancer", {"chr": "chr1", "start": 10000, "end": 10400,
+                                              "source": "EnhancerAtlas", "source_url": "http://www.enhanceratlas.org/"}),
+    ("chr1_20000_20800_GRCh38", "enhancer", {"chr": "chr1", "start": "20000", "end": 20800.0,
+                                              "source": "EnhancerAtlas", "source_url": "http://www.enhanceratlas.org/"}),
+]
+
+
+def read_label(directory, stem):
+    return pa.concat_tables([pq.read_table(path) for path in sorted(directory.glob(f"{stem}-*.parquet"))],
+                            promote_options="default")
+
+
+def test_inherited_columns_are_typed(writer_schema, tmp_path):
+    writer = ParquetWriter(*writer_schema, tmp_path)
+    columns = dict(writer.node_columns["enhancer"])
+    assert columns["start"] == "int" and columns["end"] == "int" and columns["chr"] == "str"
+
+    writer.write_nodes(ENHANCERS, path_prefix="enhancer_atlas")
+    table = pq.read_table(next((tmp_path / "enhancer_atlas").glob("nodes_enhancer-*.parquet")))
+    assert table.schema.field("start").type == pa.int64()
+    assert table.schema.field("end").type == pa.int64()
+    assert table.column("start").to_pylist() == [10000, 20000]
+    assert table.column("end").to_pylist() == [10400, 20800]
+
+
+def test_properties_missing_from_the_schema_are_kept(writer_schema, tmp_path):
+    writer = ParquetWriter(*writer_schema, tmp_path)
+    snps = [
+        ("rs1", "snp", {"chr": "chr1", "start": 10, "end": 10, "ref": "A", "alt": "G"}),
+        ("rs2", "snp", {"chr": "chr1", "start": 20, "end": 20, "raw_cadd_score": 0.25, "phred_score": 3.5}),
+    ]
+    writer.write_nodes(snps, path_prefix="snps")
+    parts = sorted((tmp_path / "snps").glob("nodes_snp-*.parquet"))
+    # the label gained columns at the second record, which starts a new part
+    assert len(parts) == 2
+    table = read_label(tmp_path / "snps", "nodes_snp")
+    assert table.schema.field("raw_cadd_score").type == pa.float64()
+    assert table.column("phred_score").to_pylist() == [None, 3.5]
+    assert table.column("ref").to_pylist() == ["A", None]
+
+
+def genes(start, stop, **extra):
+    return [(f"ENSG{i}", "gene", {"gene_name": f"A{i}", "start": i, **{k: v(i) for k, v in extra.items()}})
+            for i in range(start, stop)]
+
+
+def test_merged_shards_read_back_as_one_label(writer_schema, tmp_path):
+    writer = ParquetWriter(*writer_schema, tmp_path / "output", rows_per_file=2)
+    writer.write_nodes(genes(0, 3), path_prefix="gencode")
+    # a score column typed int in the first shard and float in the second, which also has a ref column
+    shards = [(3, 8, {"score": lambda i: i}), (8, 11, {"score": float, "ref": lambda i: "A"})]
+    for i, (start, stop, extra) in enumerate(shards):
+        # the writer of a worker process, whose columns are not shared with the other writers
+        shard = ParquetWriter(*writer_schema, tmp_path / f"shard{i}", rows_per_file=2)
+        shard.write_nodes(genes(start, stop, **extra), path_prefix="gencode")
+    for i in range(len(shards)):
+        writer.merge_shard(tmp_path / f"shard{i}", move=True)
+
+    directory = tmp_path / "output" / "gencode"
+    assert sorted(p.name for p in directory.iterdir()) == [f"nodes_gene-{i:05d}.parquet" for i in range(2 + 3 + 2)]
+    table = read_label(directory, "nodes_gene")
+    assert table.column("id").to_pylist() == [f"ENSG{i}" for i in range(11)]
+    # the first part holding the column decides its type
+    assert table.schema.field("score").type == pa.int64()
+    assert table.column("score").to_pylist() == [None] * 3 + list(range(3, 11))
+    assert table.column("ref").to_pylist() == [None] * 8 + ["A"] * 3
+    assert table.column("start").to_pylist() == list(range(11))
+
+
+def test_shard_parts_follow_the_parts_of_the_output(writer_schema, tmp_path):
+    writer = ParquetWriter(*writer_schema, tmp_path / "output", rows_per_file=1)
+    shard = writer.clone(tmp_path / "shard")
+    shard.rows_per_file = 1
+    shard.write_nodes(genes(0, 12), path_prefix="gencode")
+    # the output only holds a later part of the label, the parts of the shard come after it
+    writer.write_nodes(genes(100, 101), path_prefix="gencode")
+    os.rename(tmp_path / "output" / "gencode" / "nodes_gene-00000.parquet",
+              tmp_path / "output" / "gencode" / "nodes_gene-00003.parquet")
+    writer.merge_shard(tmp_path / "shard")
+
+    directory = tmp_path / "output" / "gencode"
+    assert sorted(p.name for p in directory.iterdir()) == [f"nodes_gene-{i:05d}.parquet" for i in range(3, 16)]
+    assert read_label(directory, "nodes_gene").column("id").to_pylist() == \
+        ["ENSG100"] + [f"ENSG{i}" for i in range(12)]
@@ -0,0 +1,83 @@
+"""
+Tests of the producer thread between the adapter generators and the writers.
+"""
+import contextvars
+import itertools
+import threading
+
+import pytest
+
+from biocypher_metta.prefetch import Prefetcher
+
+current_input = contextvars.ContextVar("current_input", default=None)
+
+
+@pytest.mark.parametrize("batch_size, queue_depth", [(1, 1), (7, 2), (1000, 4)])
+def test_records_keep_their_order(batch_size, queue_depth):
+    records = [(f"ENSG{i}", "gene", {"start": i}) for i in range(2500)]
+    assert list(Prefetcher(iter(records), batch_size, queue_depth)) == records
+
+
+def test_empty_generator():
+    assert list(Prefetcher(iter([]))) == []
+
+
+def test_producer_exceptions_reach_the_consumer():
+    def records():
+        yield from range(5)
+        raise ValueError("malformed line 6")
+
+    prefetcher = Prefetcher(records(), batch_size=2)
+    consumed = []
+    with pytest.raises(ValueError, match="malformed line 6"):
+        for record in prefetcher:
+            consumed.append(record)
+    # the records of the full batches before the exception are consumed
+    assert consumed == [0, 1, 2, 3]
+    assert not prefetcher._thread.is_alive()
+
+
+def test_early_close_stops_the_producer():
+    closed = threading.Event()
+    produced = []
+
+    def records():
+        try:
+            for i in itertools.count():
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    threads = threading.active_count()
+    prefetcher = Prefetcher(records(), batch_size=10, queue_depth=2)
+    iterator = iter(prefetcher)
+    assert [next(iterator) for _ in range(15)] == list(range(15))
+    iterator.close()
+
+    assert not prefetcher._thread.is_alive()
+    assert threading.active_count() == threads
+    # the generator was closed, and the producer stopped a bounded number of batches ahead
+    assert closed.is_set()
+    assert len(produced) <= 10 * (2 + 3)
+
+
+def test_close_before_iterating():
+    prefetcher = Prefetcher(iter(range(10)))
+    prefetcher.close()
+    assert not prefetcher._thread.is_alive()
+
+
+def test_producer_runs_in_the_context_of_the_caller():
+    def records():
+        for i in range(3):
+            yield current_input.get(), threading.current_thread().name
+
+    token = current_input.set("uniprot_sprot_human.dat.gz")
+    try:
+        prefetcher = Prefetcher(records(), batch_size=1, name="uniprot:nodes")
+    finally:
+        current_input.reset(token)
+    # the context is copied when the prefetcher is created
+    assert list(prefetcher) == [("uniprot_sprot_human.dat.gz", "uniprot:nodes")] * 3
+    assert current_input.get() is None
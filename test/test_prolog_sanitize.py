@@ -0,0 +1,101 @@
+"""
+Differential test of the sanitizer of PrologWriter against the implementation it replaced, over
+every field of the sample files and a set of edge cases.
+"""
+import gzip
+import itertools
+import pathlib
+import re
+
+import pytest
+
+from biocypher_metta.prolog_writer import PrologWriter, sanitize_string
+
+SAMPLES = pathlib.Path(__file__).resolve().parent.parent / "samples"
+# lines read from every sample file, the largest ones hold more than a million
+SAMPLE_LINES = 10000
+
+
+def legacy_sanitize_text(prop):
+    replace_chars = {
+        " ": "_",
+        "-": "_",
+        ":": "_",
+        "/": "_",
+        "–": "_",  # en dash
+        "—": "_",  # em dash
+        "&": "_",
+        ";": ","
+    }
+
+    if isinstance(prop, str):
+        for char, replacement in replace_chars.items():
+            prop = prop.replace(char, replacement).lower()
+
+        # sanitizes each string separated by comma ','
+        if "," in prop:
+            prop = ",".join([legacy_sanitize_text(p) for p in prop.split(',') if legacy_sanitize_text(p) not in ["", None]])
+            return prop if prop != "" else None
+
+        prop = re.sub(r'[^\w_,]', '', prop) # removes special characters except for underscores "_" and comma ","
+        prop = re.sub(r"_+", "_", prop) # removes multiple adjacent under scores '_'
+        prop.strip("_")
+        if prop == "":
+            return None
+        try:
+            float(prop)
+            return prop # It's a numeric string, return as is
+        except ValueError:
+            # Check if the first character is a digit
+            if prop[0].isdigit():
+                return f"'{prop}'"
+    elif isinstance(prop, list):
+        for i in range(len(prop)):
+            prop[i] = legacy_sanitize_text(prop[i])
+        prop = [p for p in prop if p != None]
+    return prop
+
+
+def sample_values():
+    """
+    The first SAMPLE_LINES lines of every sample file and their tab separated fields.
+    """
+    values = set()
+    for path in sorted(SAMPLES.rglob("*")):
+        if not path.is_file():
+            continue
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            for line in itertools.islice(f, SAMPLE_LINES):
+                line = line.rstrip("\n")
+                values.add(line)
+                values.update(line.split("\t"))
+    return values
+
+
+EDGE_CASES = [
+    "", " ", "_", ",", ";", ",,", "a,,b", " , ", "__a__b__", "-1", "1e5", "1_000", "nan", "Infinity",
+    "١٢٣", "12ab", "1 2", "0x1F", "GO:0005634", "CL_0000001; UBERON:0002107", "ENSG00000290825.1",
+    "https://www.gencodegenes.org/human/", "ΑΣ:Β", "ΑΣ Β", "ΟΔΟΣ", "İstanbul", "ß", "Å–B—C&D/E",
+    "(a)[b]{c}'d\"e", "tab\there", "ｆｕｌｌ－ｗｉｄｔｈ",
+]
+
+
+def test_sanitize_matches_legacy_on_samples():
+    values = sample_values()
+    assert values
+    mismatches = [v for v in values if sanitize_string(v) != legacy_sanitize_text(v)]
+    assert mismatches[:10] == []
+
+
+@pytest.mark.parametrize("value", EDGE_CASES)
+def test_sanitize_matches_legacy_on_edge_cases(value):
+    assert sanitize_string(value) == legacy_sanitize_text(value)
+
+
+def test_sanitize_non_strings():
+    writer = object.__new__(PrologWriter)
+    for value in (1, 2.5, True, None, {"a": 1}):
+        assert writer.sanitize_text(value) == legacy_sanitize_text(value)
+    values = ["A b", "", 3, ["c:d"]]
+    assert writer.sanitize_text(list(values)) == legacy_sanitize_text(list(values))
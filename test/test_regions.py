@@ -0,0 +1,142 @@
+"""
+Tests of the regions of region-scoped builds and of the args they give the region-aware adapters.
+"""
+import pytest
+
+from biocypher_metta import adapter_runner
+from biocypher_metta.adapter_runner import run_sequential
+from biocypher_metta.adapters import Adapter
+from biocypher_metta.metta_writer import MeTTaWriter
+from biocypher_metta.regions import RegionSet, active_regions, region_args, region_scope, select_entries, \
+    set_active_regions
+from biocypher_metta.schema_cache import load_schema
+
+
+class RegionAdapter:
+    def __init__(self, filepath, chr=None, start=None, end=None):
+        pass
+
+
+class OtherAdapter:
+    def __init__(self, filepath):
+        pass
+
+
+def test_contains():
+    regions = RegionSet([("chr1", 100, 200), ("chr1", 150, 300), ("chr2", None, 50)])
+    assert regions.contains("chr1", 100, 300)
+    assert regions.contains("chr1", "120", "130")
+    assert not regions.contains("chr1", 90, 120)
+    assert not regions.contains("chr1", 250, 301)
+    assert regions.contains("chr2", 1, 50)
+    assert not regions.contains("chr3", 1, 2)
+
+
+@pytest.mark.parametrize("start, end", [(None, 150), (150, None), (None, None), ("", "")])
+def test_contains_missing_coordinates(start, end):
+    assert not RegionSet([("chr1", 100, 200)]).contains("chr1", start, end)
+
+
+@pytest.mark.parametrize("args, expected", [
+    ({}, {"chr": "chr1", "start": None, "end": None}),
+    ({"chr": "chr1", "start": 100, "end": 200}, {"chr": "chr1", "start": 100, "end": 200}),
+    ({"chr": None, "start": None, "end": None}, {"chr": "chr1", "start": None, "end": None}),
+])
+def test_region_args_keep_the_configured_range(args, expected):
+    assert region_args(RegionAdapter, RegionSet([("chr1", None, None)]), args) == expected
+
+
+def test_region_args_intersect_the_ranges():
+    regions = RegionSet([("chr1", 150, 300)])
+    assert region_args(RegionAdapter, regions, {"chr": "chr1", "start": 100, "end": 200}) == \
+        {"chr": "chr1", "start": 150, "end": 200}
+    assert region_args(RegionAdapter, regions, {"chr": "chr1", "start": 200}) == \
+        {"chr": "chr1", "start": 200, "end": 300}
+    assert region_args(RegionAdapter, regions, {"end": 250}) == {"chr": "chr1", "start": 150, "end": 250}
+
+
+def test_region_args_of_other_adapters_and_regions():
+    assert region_args(OtherAdapter, RegionSet([("chr1", 1, 2)]), {}) == {}
+    assert region_args(RegionAdapter, None, {"chr": "chr1"}) == {}
+    assert region_args(RegionAdapter, RegionSet([("chr1", 1, 2), ("chr2", 1, 2)]), {}) == {}
+
+
+def test_select_entries():
+    def entry(cls, **args):
+        return {"adapter": {"module": __name__, "cls": cls, "args": {"filepath": "input", **args}}}
+    adapters = {
+        "all": entry("RegionAdapter"),
+        "inside": entry("RegionAdapter", chr="chr1", start=100, end=200),
+        "other_range": entry("RegionAdapter", chr="chr1", start=1000, end=2000),
+        "other_chr": entry("RegionAdapter", chr="chr2"),
+        "unfiltered": entry("OtherAdapter"),
+    }
+    regions = RegionSet([("chr1", 150, 300)])
+    assert list(select_entries(adapters, regions, "skip")) == ["all", "inside"]
+    assert list(select_entries(adapters, regions, "include")) == ["all", "inside", "unfiltered"]
+    assert select_entries(adapters, None, "skip") is adapters
+
+
+def test_region_scope():
+    regions = RegionSet([("chr1", 150, 300)])
+    set_active_regions(regions)
+    try:
+        with region_scope(RegionAdapter):
+            assert active_regions() is regions
+            with region_scope(OtherAdapter):
+                assert active_regions() is None
+            assert active_regions() is regions
+    finally:
+        set_active_regions(None)
+
+
+class GenesAdapter(Adapter):
+    """
+    Adapter of the tests, a gene at every position of positions kept by the filter of
+    check_genomic_location on the active regions.
+    """
+    def __init__(self, prefix, positions, write_properties, add_provenance):
+        self.prefix = prefix
+        self.positions = positions
+        super().__init__(write_properties, add_provenance)
+
+    def get_nodes(self):
+        for position in self.positions:
+            regions = active_regions()
+            if regions is None or regions.contains("chr1", position, position):
+                yield f"{self.prefix}{position}", "gene", {"chr": "chr1", "start": position, "end": position}
+
+    def get_edges(self):
+        return iter([])
+
+
+class RegionGenesAdapter(GenesAdapter):
+    def __init__(self, prefix, positions, write_properties, add_provenance, chr=None, start=None, end=None):
+        super().__init__(prefix, positions, write_properties, add_provenance)
+
+
+@pytest.mark.parametrize("prefetch_batch_size", [0, 2])
+def test_active_regions_only_filter_region_aware_adapters(tmp_path, writer_schema, monkeypatch,
+                                                         prefetch_batch_size):
+    regions = RegionSet([("chr1", 150, 300), ("chr2", 1, 10)])
+    monkeypatch.setitem(adapter_runner.run_options, "regions", regions)
+    monkeypatch.setitem(adapter_runner.run_options, "prefetch_batch_size", prefetch_batch_size)
+    set_active_regions(regions)
+    positions = [100, 200, 300, 400]
+    adapters_dict = {
+        name: {"adapter": {"module": __name__, "cls": cls, "args": {"prefix": prefix, "positions": positions}},
+               "outdir": name, "nodes": True, "edges": False}
+        for name, cls, prefix in [("aware", "RegionGenesAdapter", "ENSA"), ("unfiltered", "GenesAdapter", "ENSB")]}
+    adapters_dict = select_entries(adapters_dict, regions, "include")
+    try:
+        totals = run_sequential(adapters_dict, MeTTaWriter(*writer_schema, tmp_path), None, None, True, False,
+                                load_schema(*writer_schema)["edges"])
+    finally:
+        set_active_regions(None)
+
+    # the records of the adapter without positional filtering are all included
+    assert totals["nodes_count"]["gene"] == 2 + 4
+    aware = (tmp_path / "aware" / "nodes.metta").read_text()
+    unfiltered = (tmp_path / "unfiltered" / "nodes.metta").read_text()
+    assert "(gene ENSA200)" in aware and "(gene ENSA300)" in aware and "ENSA100" not in aware
+    assert all(f"(gene ENSB{position})" in unfiltered for position in positions)
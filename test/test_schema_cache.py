@@ -0,0 +1,102 @@
+"""
+Tests of the compiled schema cache: hits, misses and the invalidation on a change of the configs,
+the BioCypher version or the ontologies.
+"""
+import json
+
+import biocypher
+import pytest
+
+from biocypher_metta import schema_cache
+from biocypher_metta.schema_cache import load_schema, schema_key
+
+SCHEMA = """
+gene:
+  represented_as: node
+  input_label: gene
+  properties:
+    gene_name: str
+"""
+
+
+@pytest.fixture
+def configs(tmp_path):
+    schema_config = tmp_path / "schema_config.yaml"
+    schema_config.write_text(SCHEMA)
+    biocypher_config = tmp_path / "biocypher_config.yaml"
+    biocypher_config.write_text(f"biocypher:\n  offline: true\n  schema_config_path: {schema_config}\n")
+    return str(schema_config), str(biocypher_config)
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    """
+    Replace the compilation with BioCypher, which needs network access, recording the compiled configs.
+    """
+    compiled = []
+
+    def compile_schema(schema_config, biocypher_config):
+        compiled.append(schema_config)
+        return {"version": schema_cache.SCHEMA_CACHE_VERSION, "schema": {}, "edges": {}, "node_labels": [],
+                "type_hierarchy": [], "compile": len(compiled)}
+    monkeypatch.setattr(schema_cache, "compile_schema", compile_schema)
+    monkeypatch.setattr(schema_cache, "_loaded", {})
+    return compiled
+
+
+def test_cache_dir_is_anchored_to_the_repository():
+    assert schema_cache.SCHEMA_CACHE_DIR.is_absolute()
+    assert (schema_cache.SCHEMA_CACHE_DIR.parent.parent / "biocypher_metta" / "schema_cache.py").exists()
+
+
+def test_hit_and_miss(configs, compiles, tmp_path):
+    cache_dir = tmp_path / "cache"
+    assert load_schema(*configs, cache_dir=cache_dir)["compile"] == 1
+    assert load_schema(*configs, cache_dir=cache_dir)["compile"] == 1
+    # a new process reads the cache file
+    schema_cache._loaded.clear()
+    assert load_schema(*configs, cache_dir=cache_dir)["compile"] == 1
+    assert len(compiles) == 1
+    assert [path.name for path in cache_dir.iterdir()] == [f"{schema_key(*configs)}.json"]
+
+    with open(configs[0], "a") as f:
+        f.write("    gene_type: str\n")
+    assert load_schema(*configs, cache_dir=cache_dir)["compile"] == 2
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_stale_and_unreadable_files_are_recompiled(configs, compiles, tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    cache_path = cache_dir / f"{schema_key(*configs)}.json"
+    cache_path.write_text(json.dumps({"version": schema_cache.SCHEMA_CACHE_VERSION - 1}))
+    assert load_schema(*configs, cache_dir=cache_dir)["compile"] == 1
+    assert json.loads(cache_path.read_text())["version"] == schema_cache.SCHEMA_CACHE_VERSION
+
+    schema_cache._loaded.clear()
+    cache_path.write_text("{")
+    assert load_schema(*configs, cache_dir=cache_dir)["compile"] == 2
+
+
+def test_key_covers_the_biocypher_version(configs, monkeypatch):
+    key = schema_key(*configs)
+    monkeypatch.setattr(biocypher, "__version__", "0.0.0")
+    assert schema_key(*configs) != key
+
+
+def test_key_covers_the_head_ontology(configs, tmp_path):
+    default = schema_key(*configs)
+    ontology = tmp_path / "ontology.owl.ttl"
+    ontology.write_text("@prefix : <http://example.org/> .\n")
+    with open(configs[1], "a") as f:
+        f.write(f"  head_ontology:\n    url: {ontology}\n    root_node: entity\n")
+    local = schema_key(*configs)
+    assert local != default
+    # a local ontology file is hashed with its content
+    ontology.write_text("@prefix : <http://example.org/v2/> .\n")
+    assert schema_key(*configs) != local
+
+
+def test_ontologies_default_to_the_ones_of_biocypher(configs):
+    head_ontology = schema_cache.ontologies(configs[1])["head_ontology"]
+    assert head_ontology["url"].startswith("https://")
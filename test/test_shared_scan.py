@@ -0,0 +1,89 @@
+"""
+Tests of the streams a SharedScan hands to its consumers, which the parsers of the adapters read
+like files, and of the grouping of the config entries into shared scans.
+"""
+import gzip
+import pathlib
+import threading
+
+from Bio import SwissProt
+import pytest
+
+from biocypher_metta.adapter_runner import plan_units
+from biocypher_metta.shared_scan import SharedScan, open_input
+
+UNIPROT_SAMPLE = pathlib.Path(__file__).resolve().parent.parent / "samples" / "uniprot_sprot_human_sample.dat.gz"
+
+
+def scan_of(path, consumers, batch_bytes=64):
+    scan = SharedScan(str(path), batch_bytes=batch_bytes)
+    streams = [scan.add_consumer() for _ in range(consumers)]
+    scan.start()
+    return scan, streams
+
+
+def consume(scan, streams, read):
+    results = [None] * len(streams)
+
+    def run(i, stream):
+        with scan.attach(stream):
+            with open_input(scan.filepath) as f:
+                results[i] = read(f)
+
+    threads = [threading.Thread(target=run, args=(i, stream)) for i, stream in enumerate(streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scan.join()
+    return results
+
+
+def test_swissprot_parser_reads_the_shared_stream():
+    with gzip.open(UNIPROT_SAMPLE, "rt") as f:
+        expected = [(record.accessions, record.sequence) for record in SwissProt.parse(f)]
+    assert expected
+
+    scan, streams = scan_of(UNIPROT_SAMPLE, 2, batch_bytes=4096)
+    results = consume(scan, streams, lambda f: [(record.accessions, record.sequence)
+                                                for record in SwissProt.parse(f)])
+    assert results == [expected, expected]
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("first line\nsecond\n\nlast without newline")
+    return path
+
+
+def test_read_and_readline_sizes(text_file):
+    scan, (stream,) = scan_of(text_file, 1)
+
+    def read(f):
+        return [f.read(0), f.readline(3), f.readline(), f.read(4), f.readline(0), f.readline(),
+                f.readline(), f.read(9), f.read(), f.read(1), f.readline()]
+    (result,) = consume(scan, [stream], read)
+    assert result == ["", "fir", "st line\n", "seco", "", "nd\n", "\n", "last with", "out newline", "", ""]
+
+
+def test_read_size_spans_lines(text_file):
+    scan, streams = scan_of(text_file, 2)
+    results = consume(scan, streams, lambda f: [f.read(15), list(f)])
+    assert results == [["first line\nseco", ["nd\n", "\n", "last without newline"]]] * 2
+
+
+def test_plan_units_groups_opted_in_adapters(tmp_path):
+    dat = tmp_path / "sample.dat"
+    dat.write_text("")
+
+    def entry(module, cls):
+        return {"adapter": {"module": module, "cls": cls, "args": {"filepath": str(dat)}}}
+    adapters = {
+        "uniprotkb_sprot": entry("biocypher_metta.adapters.uniprot_protein_adapter", "UniprotProteinAdapter"),
+        "other": entry("biocypher_metta.adapters", "Adapter"),
+        "uniprotkb_sprot_translates_to": entry("biocypher_metta.adapters.uniprot_adapter", "UniprotAdapter"),
+        "other_again": entry("biocypher_metta.adapters", "Adapter"),
+    }
+    assert plan_units(adapters, list(adapters)) == [("uniprotkb_sprot", "uniprotkb_sprot_translates_to"),
+                                                    ("other",), ("other_again",)]